@@ -873,8 +873,8 @@ def handle_args():
     parser.add_argument('-g', '--gridless',
         help = dedent('''\
         When performing a geographical search, a geographical index is used.
-        This may lead to inaccurate results in some (rare) case when using
-        --closest searches (--near searches are never impacted).
+        Results are exact for both --closest and --near searches,
+        the index only narrows down the candidates.
         Adding this option will disable the index, and browse the full
         data set to look for the results.
         '''),
@@ -1309,8 +1309,19 @@ def main():
             if interactive_field == '__key__':
                 res = enumerate(values)
             else:
-                conditions = [(interactive_field, val) for val in values]
-                res = g.getKeysWhere(conditions, force_str=True, mode='or')
+                # One set lookup per key, results are the same as with
+                # one condition per value in 'or' mode: each key once,
+                # with the number of matching values
+                counts = {}
+                for val in values:
+                    counts[val] = counts.get(val, 0) + 1
+
+                matches = {}
+                for val, keys in g.getKeysWhereIn(interactive_field, counts, force_str=True):
+                    for k in keys:
+                        matches[k] = counts[val]
+
+                res = [(matches[k], k) for k in g if k in matches]
                 last = 'exact'
 
         elif interactive_type == '__fuzzy__':
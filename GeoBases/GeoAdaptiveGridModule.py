@@ -0,0 +1,650 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+This module is an adaptive grid implementation, in order
+to provide exact geographical indexation features, whatever
+the density of points.
+
+Cells are geohash prefixes. A cell is split in its 32 sub-cells
+when it contains too many points, so dense areas get small cells
+and sparse areas keep large ones. Searches are best-first on cells,
+using a lower bound of the distance from the point to each cell.
+
+    >>> a = GeoAdaptiveGrid(capacity=2)
+    Setting adaptive grid capacity to 2
+    >>> a.add('ORY', (48.72, 2.359))
+    >>> a.add('CDG', (48.75, 2.361))
+    >>> a.add('NCE', (43.66, 7.215))
+    >>> sorted(a._leaves)
+    ['s', 'u']
+    >>> a.add('LBG', (48.97, 2.441))
+    >>> sorted(a._leaves)
+    ['s', 'u09t', 'u09w']
+    >>> a._keys['ORY']
+    {'case': 'u09tjtjy8d', 'lat_lng': (48.7..., 2.359)}
+    >>> list(a.findNearKey('ORY', 20))
+    [(0.0, 'ORY'), (3.33..., 'CDG')]
+    >>> list(a.findClosestFromPoint((48.75, 2.361), N=2))
+    [(0.0, 'CDG'), (3.33..., 'ORY')]
+    >>> list(a.findClosestFromKey('NCE', N=5))
+    [(0.0, 'NCE'), (675.1..., 'ORY'), (677.8..., 'CDG'), (694.6..., 'LBG')]
+"""
+
+
+from __future__ import with_statement
+
+import heapq
+from itertools import islice, takewhile, izip
+from math import asin, sin, cos, degrees
+from geohash import encode, neighbors, bbox
+
+from .GeoUtils import haversine, radian, EARTH_RADIUS
+from .GeoUtils import corridor_points, route_distances
+from .GeoUtils import bbox_area, unwrap_polygon, polygon_area, point_in_area, box_in_area
+
+
+# Default max number of points in a cell
+CAPACITY = 32
+
+# Cells are not split beyond this geohash length
+MAX_PRECISION = 10
+
+# Geohash length -> (lat bits, lng bits)
+HASH_BITS = dict((p, ((5 * p) // 2, (5 * p + 1) // 2)) for p in range(1, MAX_PRECISION + 1))
+
+# Geohash length -> (cell height, cell width), in degrees
+HASH_SIZE = dict((p, (180.0 / 2 ** lat_b, 360.0 / 2 ** lng_b)) for p, (lat_b, lng_b) in HASH_BITS.iteritems())
+
+
+
+def cell_lower_bound(lat_lng, box):
+    """
+    Lower bound of the distance between a point and a cell.
+
+    :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+    :param box:     the bounding box of the cell, a dict with keys 's', 'w', 'n', 'e'
+    :returns:       the lower bound, in kilometers
+
+    >>> cell_lower_bound((48.72, 2.359), bbox('u09'))
+    0.0
+    >>> cell_lower_bound((46.0, 2.0), bbox('u09')) # south of cell
+    201.5...
+    >>> haversine((46.0, 2.0), (47.8125, 2.0))
+    201.5...
+    """
+    lat, lng = lat_lng
+
+    # Latitude alone, any path changes latitude at least that much
+    lat_diff = max(box['s'] - lat, lat - box['n'], 0)
+
+    if box['w'] <= lng <= box['e']:
+        return EARTH_RADIUS * radian(lat_diff)
+
+    # Distance to the great circles of the closest edges
+    lng_diffs = [abs((lng - edge + 180) % 360 - 180) for edge in (box['w'], box['e'])]
+    antipode  = (lng + 360) % 360 - 180
+
+    if box['w'] <= antipode <= box['e']:
+        min_sin = 0.0
+    else:
+        min_sin = min(abs(sin(radian(d))) for d in lng_diffs)
+
+    cross = asin(min(cos(radian(lat)) * min_sin, 1.0))
+
+    return EARTH_RADIUS * max(radian(lat_diff), cross)
+
+
+
+class GeoAdaptiveGrid(object):
+    """
+    This is the main and only class.
+    """
+    def __init__(self, capacity=CAPACITY, verbose=True):
+        """Creates adaptive grid.
+
+        :param capacity: the maximum number of points in a cell, \
+            before it is split
+        :param verbose:  toggle verbosity
+        :returns:        None
+        """
+        self._capacity = capacity
+
+        # Points, leaf cells, and sub-cells of split cells
+        # The empty prefix is the root cell, always split
+        self._keys     = {}
+        self._leaves   = {}
+        self._children = { '' : set() }
+
+        # Cache for bounding boxes of cells
+        self._bbox = {}
+
+        if verbose:
+            print 'Setting adaptive grid capacity to %s' % capacity
+
+
+    def _computeCaseId(self, lat_lng):
+        """
+        Computing the id of the finest case for a (lat, lng).
+
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :returns:       the case_id
+        """
+        return encode(*lat_lng, precision=MAX_PRECISION)
+
+
+
+    def add(self, key, lat_lng, verbose=True):
+        """
+        Add a point to the grid. If the key is already
+        in the grid, the point is moved.
+
+        :param key:     the key to be added
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param verbose: toggle verbosity
+        :returns:       None
+        """
+        try:
+            case_id = self._computeCaseId(lat_lng)
+
+        except (TypeError, Exception):
+            # TypeError for wrong type (NoneType, str)
+            # Exception for invalid coordinates
+            if verbose:
+                print 'Wrong coordinates %s for key %s, skipping point.' % (str(lat_lng), key)
+
+            # The previous location is not valid anymore
+            self.remove(key)
+            return
+
+        if key in self._keys:
+            self.remove(key)
+
+        self._keys[key] = {
+            'case'    : case_id,
+            'lat_lng' : lat_lng
+        }
+
+        # Going down to the leaf
+        cell = ''
+
+        while cell in self._children:
+            child = case_id[:len(cell) + 1]
+            self._children[cell].add(child)
+            cell = child
+
+        if cell not in self._leaves:
+            self._leaves[cell] = []
+
+        self._leaves[cell].append(key)
+
+        if len(self._leaves[cell]) > self._capacity:
+            self._splitCell(cell)
+
+
+
+    def remove(self, key):
+        """
+        Remove a point from the grid. Unknown keys are ignored.
+        Empty cells are removed, up to the root.
+
+        :param key: the key to be removed
+        :returns:   None
+
+        >>> a = GeoAdaptiveGrid(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.remove('ORY')
+        >>> a.remove('ORY')
+        >>> sorted(a._keys), a._leaves
+        (['CDG'], {'u': ['CDG']})
+        >>> a.remove('CDG')
+        >>> a._leaves, a._children
+        ({}, {'': set([])})
+        """
+        if key not in self._keys:
+            return
+
+        case_id = self._keys.pop(key)['case']
+
+        # Going down to the leaf
+        cell = ''
+
+        while cell in self._children:
+            cell = case_id[:len(cell) + 1]
+
+        self._leaves[cell].remove(key)
+
+        if self._leaves[cell]:
+            return
+
+        del self._leaves[cell]
+
+        while cell:
+            parent = cell[:-1]
+            self._children[parent].discard(cell)
+
+            if parent == '' or self._children[parent]:
+                break
+
+            del self._children[parent]
+            cell = parent
+
+
+
+    def _splitCell(self, cell):
+        """
+        Split a leaf cell in its sub-cells, recursively
+        if sub-cells are still too dense.
+        """
+        if len(cell) >= MAX_PRECISION:
+            return
+
+        keys = self._leaves.pop(cell)
+        self._children[cell] = set()
+
+        for key in keys:
+            child = self._keys[key]['case'][:len(cell) + 1]
+            self._children[cell].add(child)
+
+            if child not in self._leaves:
+                self._leaves[child] = []
+
+            self._leaves[child].append(key)
+
+        for child in list(self._children[cell]):
+            if len(self._leaves[child]) > self._capacity:
+                self._splitCell(child)
+
+
+
+    def _getBox(self, cell):
+        """
+        Bounding box of a cell, cached.
+        """
+        if cell not in self._bbox:
+            self._bbox[cell] = bbox(cell)
+
+        return self._bbox[cell]
+
+
+    def _startCells(self, lat_lng, radius):
+        """
+        Cells from which a radius search starts. This is the
+        point cell and its neighbors, at the finest level where
+        they cover the radius. Without such level, this is the root.
+        """
+        if radius is None:
+            return ['']
+
+        ang = float(radius) / EARTH_RADIUS
+
+        if ang >= 1 or sin(ang) >= cos(radian(lat_lng[0])):
+            return ['']
+
+        lat_ext = degrees(ang)
+        lng_ext = degrees(asin(sin(ang) / cos(radian(lat_lng[0]))))
+
+        level = 0
+
+        for p in sorted(HASH_SIZE, reverse=True):
+            height, width = HASH_SIZE[p]
+
+            if height >= lat_ext and width >= lng_ext:
+                level = p
+                break
+
+        if level == 0:
+            return ['']
+
+        case_id = self._computeCaseId(lat_lng)[:level]
+        cells   = set()
+
+        # Cells may not exist at that level, or be inside a larger leaf
+        for target in [case_id] + neighbors(case_id):
+            cell = ''
+
+            while cell in self._children and len(cell) < level:
+                child = target[:len(cell) + 1]
+
+                if child not in self._children[cell]:
+                    cell = None
+                    break
+
+                cell = child
+
+            if cell is not None:
+                cells.add(cell)
+
+        return sorted(cells)
+
+
+
+    def iterClosestFromPoint(self, lat_lng, from_keys=None, start=('',)):
+        """
+        Yields the closest things from a point, by increasing
+        distance, with a best-first search on cells, so the search
+        can be stopped at any time.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform the search.
+        :param start:     the cells from which the search starts, the root by default
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> a = GeoAdaptiveGrid(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> it = a.iterClosestFromPoint((48.75, 2.361))
+        >>> next(it), next(it)
+        ((0.0, 'CDG'), (3.33..., 'ORY'))
+        """
+        if lat_lng is None:
+            return
+
+        # Cells are (bound, 0, cell), points are (distance, 1, key)
+        # So ties between points are broken on keys
+        queue = [(cell_lower_bound(lat_lng, self._getBox(c)) if c else 0.0, 0, c) for c in start]
+        heapq.heapify(queue)
+
+        while queue:
+            dist, kind, item = heapq.heappop(queue)
+
+            if kind == 1:
+                yield dist, item
+                continue
+
+            if item in self._children:
+                for child in self._children[item]:
+                    bound = cell_lower_bound(lat_lng, self._getBox(child))
+                    heapq.heappush(queue, (bound, 0, child))
+            else:
+                for key in self._leaves.get(item, ()):
+                    if from_keys is None or key in from_keys:
+                        heapq.heappush(queue, (haversine(lat_lng, self._keys[key]['lat_lng']), 1, key))
+
+
+
+    def findNearPoint(self, lat_lng, radius=20, double_check=False):
+        """
+        Returns a list of nearby things from a point (given
+        latidude and longitude), and a radius for the search.
+        Results are exact, so double_check is only here for
+        compatibility with the grid.
+
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if lat_lng is None:
+            # Case where the lat_lng was missing from base
+            return iter([])
+
+        start = self._startCells(lat_lng, radius)
+
+        return list(takewhile(lambda r: r[0] <= radius,
+                              self.iterClosestFromPoint(lat_lng, start=start)))
+
+
+
+    def findNearKey(self, key, radius=20, double_check=False):
+        """
+        Same as findNearPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+
+        :param key:     the key
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if key not in self._keys:
+            # Case where the key probably did not have a proper geocode
+            # and as such was never indexed
+            return iter([])
+
+        return self.findNearPoint(self._keys[key]['lat_lng'], radius, double_check)
+
+
+
+    def findClosestFromPoint(self, lat_lng, N=1, double_check=False, from_keys=None):
+        """
+        Concept close to findNearPoint, but here we do not
+        look for the things radius-close to a point,
+        we look for the closest thing from this point, given by
+        latitude/longitude. Results are exact.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if lat_lng is None:
+            # Case where the lat_lng was missing from base
+            return iter([])
+
+        if from_keys is not None:
+            if not isinstance(from_keys, (set, frozenset)):
+                from_keys = set(from_keys)
+
+            # If from_keys is empty, the result is obvious
+            if not from_keys:
+                return []
+
+        return list(islice(self.iterClosestFromPoint(lat_lng, from_keys), N))
+
+
+
+    def findClosestFromKey(self, key, N=1, double_check=False, from_keys=None):
+        """
+        Same as findClosestFromPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+
+        :param key:       the key
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if key not in self._keys:
+            # Case where the key probably did not have a proper geocode
+            # and as such was never indexed
+            return iter([])
+
+        return self.findClosestFromPoint(self._keys[key]['lat_lng'], N, double_check, from_keys)
+
+
+
+    def findNearPoints(self, points, radius=20, double_check=False):
+        """
+        Same as findNearPoint, for many points at once.
+
+        :param points:  an iterable of lat_lng
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+        """
+        return [list(self.findNearPoint(lat_lng, radius, double_check)) for lat_lng in points]
+
+
+
+    def findClosestFromPoints(self, points, N=1, double_check=False, from_keys=None):
+        """
+        Same as findClosestFromPoint, for many points at once.
+
+        :param points:    an iterable of lat_lng
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+        """
+        if from_keys is not None:
+            # Computed once for all points
+            from_keys = set(from_keys)
+
+        return [list(self.findClosestFromPoint(lat_lng, N, double_check, from_keys)) for lat_lng in points]
+
+
+
+    def _allKeysInCell(self, cell):
+        """
+        Yields all keys under a cell.
+        """
+        stack = [cell]
+
+        while stack:
+            cell = stack.pop()
+
+            if cell in self._children:
+                stack.extend(self._children[cell])
+            elif cell in self._leaves:
+                for key in self._leaves[cell]:
+                    yield key
+
+
+
+    def _findInArea(self, area, polygon=None):
+        """
+        Generates keys inside an area, and inside the polygon if given.
+        Cells fully inside are yielded without any test, cells crossing
+        the boundary are split further, or tested key by key for leaves.
+        """
+        stack = list(self._children[''])
+
+        while stack:
+            cell = stack.pop()
+            kind = box_in_area(self._getBox(cell), area, polygon)
+
+            if kind == 'out':
+                continue
+
+            if kind == 'in':
+                for key in self._allKeysInCell(cell):
+                    yield key
+
+            elif cell in self._children:
+                stack.extend(self._children[cell])
+
+            elif cell in self._leaves:
+                for key in self._leaves[cell]:
+                    if point_in_area(self._keys[key]['lat_lng'], area, polygon):
+                        yield key
+
+
+
+    def findInBBox(self, south, west, north, east):
+        """
+        Returns keys inside a bounding box. If *west* is greater
+        than *east*, the box crosses the antimeridian.
+
+        :param south: the southern latitude
+        :param west:  the western longitude
+        :param north: the northern latitude
+        :param east:  the eastern longitude
+        :returns:     an iterable of keys
+
+        >>> a = GeoAdaptiveGrid(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInBBox(48.73, 2, 49, 3))
+        ['CDG']
+        >>> sorted(a.findInBBox(-25, 170, -15, -170))
+        ['SUV', 'TBU']
+        """
+        return self._findInArea(bbox_area(south, west, north, east))
+
+
+
+    def findInPolygon(self, points):
+        """
+        Returns keys inside a polygon, given as a list of LatLng
+        vertices. Polygons crossing the antimeridian are supported.
+
+        :param points: the vertices of the polygon
+        :returns:      an iterable of keys
+
+        >>> a = GeoAdaptiveGrid(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInPolygon([(48, 2), (48.74, 2), (48.74, 3), (48, 3)]))
+        ['ORY']
+        >>> sorted(a.findInPolygon([(-25, 170), (-15, 170), (-15, -170), (-25, -170)]))
+        ['SUV', 'TBU']
+        """
+        polygon = unwrap_polygon(points)
+
+        if len(polygon) < 3:
+            return iter([])
+
+        return self._findInArea(polygon_area(polygon), polygon)
+
+
+
+    def findNearRoute(self, points, radius=20, double_check=False):
+        """
+        Returns keys near a route, made of the shortest paths between
+        successive points. Candidates around points along the route
+        are gathered once, then exact cross-track distances are computed.
+
+        :param points:  the list of lat_lng of the route
+        :param radius:  the half width of the corridor (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       a list of (distance, key, along-track position), sorted \
+            by along-track position
+
+        >>> a = GeoAdaptiveGrid(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.21))
+        >>> a.findNearRoute([(48.84, 2.367), (43.70, 7.26)], 15)
+        [(6.12..., 'CDG', 7.93...), (8.16..., 'ORY', 10.57...), (5.99..., 'NCE', 683.85...)]
+        """
+        route = list(points)
+
+        if not route:
+            return []
+
+        samples, search = corridor_points(route, radius)
+        candidate = set()
+
+        for lat_lng in samples:
+            candidate.update(key for _, key in self.findNearPoint(lat_lng, search))
+
+        candidate = list(candidate)
+        lat_lngs  = [self._keys[can]['lat_lng'] for can in candidate]
+
+        results = [(dist, can, along)
+                   for (dist, along), can in izip(route_distances(route, lat_lngs), candidate)
+                   if dist <= radius]
+
+        return sorted(results, key=lambda r: (r[2], r[0]))
+
+
+
+def _test():
+    """
+    When called directly, launching doctests.
+    """
+    import doctest
+
+    extraglobs = {}
+
+    opt =  (doctest.ELLIPSIS |
+            doctest.NORMALIZE_WHITESPACE |
+            doctest.REPORT_ONLY_FIRST_FAILURE |
+            doctest.IGNORE_EXCEPTION_DETAIL)
+
+    doctest.testmod(extraglobs=extraglobs, optionflags=opt)
+
+
+
+if __name__ == '__main__':
+    _test()
@@ -6,13 +6,16 @@ This module is a general class *GeoBase* to manipulate geographical
 data. It loads static csv files containing data about
 airports or train stations, and then provides tools to browse it.
 
-It relies on three other modules:
+It relies on five other modules:
 
 - *GeoUtils*: to compute haversine distances between points
 - *LevenshteinUtils*: to calculate distances between strings. Indeed, we need
   a good tool to do it, in order to recognize things like station names
   in schedule files where we do not have the station id
 - *GeoGridModule*: to handle geographical indexation
+- *GeoTreeModule*: to handle exact geographical indexation, with ``spatial_index='tree'``
+- *GeoAdaptiveGridModule*: to handle exact geographical indexation with cells
+  adapted to the density, with ``spatial_index='adaptive'``
 
 Examples for airports::
 
@@ -52,8 +55,15 @@ from __future__ import with_statement
 
 import os
 import os.path as op
+import sys
 import heapq
-from itertools import izip_longest, count
+import hashlib
+import threading
+import multiprocessing
+from itertools import izip, izip_longest, count
+from math import pi
+from operator import itemgetter
+from UserDict import DictMixin
 import csv
 import json
 from shutil import copy
@@ -61,9 +71,14 @@ from shutil import copy
 # Not in standard library
 import yaml
 
-from .GeoUtils         import haversine
+from .GeoUtils         import haversine, haversine_vect, haversine_within, haversine_matrix
+from .GeoUtils         import unradian, EARTH_RADIUS
+from .GeoUtils         import bbox_area, unwrap_polygon, polygon_area, point_in_area
+from .GeoUtils         import route_distances
 from .LevenshteinUtils import mod_leven, clean
-from .GeoGridModule    import GeoGrid
+from .GeoGridModule    import GeoGrid, encode_cell, cell_bbox, cell_to_geohash
+from .GeoTreeModule    import GeoTree
+from .GeoAdaptiveGridModule import GeoAdaptiveGrid
 
 
 try:
@@ -80,6 +95,18 @@ else:
     HAS_TREP_SUPPORT = True
 
 
+try:
+    # NumPy is optional, it is only used to
+    # provide arrays from bulk methods, and
+    # to compute many distances at once
+    import numpy as np
+
+except ImportError:
+    HAS_NUMPY_SUPPORT = False
+else:
+    HAS_NUMPY_SUPPORT = True
+
+
 # Relative paths handling
 def relative(rel_path, root_file=__file__):
     """Handle relative paths.
@@ -144,6 +171,62 @@ ASSETS = {
 }
 
 
+# Registry of shared instances, see GeoBase.shared
+# The budget is in megabytes, None means no limit
+SHARED = {
+    'bases'   : {}, # config key -> instance
+    'sizes'   : {}, # config key -> estimated memory in bytes
+    'usage'   : {}, # config key -> last use tick
+    'loading' : {}, # config key -> lock held while loading
+    'budget'  : None,
+    'tick'    : count(),
+    'lock'    : threading.RLock(),
+}
+
+# Number of things sampled to estimate memory usage
+NB_MEMORY_SAMPLE = 1000
+
+# Under this number of from_keys, geographical searches
+# just compute all distances instead of using the grid
+MAX_BRUTE_FORCE = 200
+
+# Under this number of from_keys, closest searches compute all
+# distances with NumPy instead of filtering the results of the grid,
+# which may explore many rings without any of from_keys; on cities,
+# both take about 1ms per search for 3000 random from_keys
+MAX_BRUTE_FORCE_CLOSEST = 3000
+
+# Number of keys processed together in spatial joins
+JOIN_CHUNK = 2000
+
+# Number of distances between keys kept by distance
+DISTANCE_CACHE_SIZE = 100000
+
+# Precision of the cells of reverse geocoding, cells of
+# precision 5 are about 5km large
+REVERSE_PRECISION = 5
+
+# Distance (km) a moving object can travel in a stream
+# of positions before its candidates are computed again
+STREAM_MARGIN = 10
+
+# Number of moving objects kept in the cache of streams
+STREAM_CACHE_SIZE = 10000
+
+# Number of cells kept in the cache of reverse geocoding
+REVERSE_CACHE_SIZE = 10000
+
+# Number of distances computed together in distance matrices,
+# to bound the memory used by temporary arrays
+DISTANCE_CHUNK = 1000000
+
+# Spatial indexes available for geographical searches
+SPATIAL_INDEXES = {
+    'grid'     : lambda: GeoGrid(radius=50, verbose=False),
+    'tree'     : lambda: GeoTree(verbose=False),
+    'adaptive' : lambda: GeoAdaptiveGrid(verbose=False),
+}
+
 
 # We only export the main class
 __all__ = ['GeoBase', 'BASES']
@@ -166,6 +249,280 @@ class GeoBase(object):
         os.system('bash %s %s' % (script_path, force_option))
 
 
+    @classmethod
+    def shared(cls, data, **kwargs):
+        """Get a process-wide shared instance.
+
+        One instance is loaded and cached for each configuration,
+        so independent modules do not load the same data again.
+        Shared instances should not be modified.
+
+        :param data:   the type of data wanted, like in __init__
+        :param kwargs: additional parameters, like in __init__
+        :returns:      the shared GeoBase instance
+
+        >>> geo_s = GeoBase.shared('stations', verbose=False)
+        >>> geo_s is GeoBase.shared('stations', verbose=False)
+        True
+        >>> geo_s is GeoBase.shared('stations', verbose=False, limit=10)
+        False
+        >>> GeoBase.shared('stations', verbose=False, delimiter=None)
+        Traceback (most recent call last):
+        TypeError: ...
+        >>> SHARED['loading']
+        {}
+        >>> GeoBase.clearShared()
+        """
+        reg = SHARED
+        key = (data, tuple(sorted((k, repr(v)) for k, v in kwargs.iteritems())))
+
+        with reg['lock']:
+            if key in reg['bases']:
+                reg['usage'][key] = next(reg['tick'])
+                return reg['bases'][key]
+
+            # Only one thread loads a given configuration
+            loading = reg['loading'].setdefault(key, threading.Lock())
+
+        with loading:
+            with reg['lock']:
+                if key in reg['bases']:
+                    reg['usage'][key] = next(reg['tick'])
+                    return reg['bases'][key]
+
+            try:
+                base = cls(data, **kwargs)
+                size = base._estimateMemory()
+
+                with reg['lock']:
+                    reg['bases'][key] = base
+                    reg['sizes'][key] = size
+                    reg['usage'][key] = next(reg['tick'])
+
+                    cls._evictShared(keep=key)
+            finally:
+                with reg['lock']:
+                    reg['loading'].pop(key, None)
+
+        return base
+
+
+    @classmethod
+    def preloadShared(cls, datas, workers=4, **kwargs):
+        """Load several shared instances with several threads.
+
+        Only reading files overlaps between threads, parsing holds
+        the interpreter lock, so this mostly helps with slow or
+        remote sources. Loading goes on when some bases fail, their
+        errors are printed and they are None in the results.
+
+        :param datas:   the list of data types, an element may also \
+                be a (data, kwargs) tuple for specific parameters
+        :param workers: the number of threads used for loading
+        :param kwargs:  additional parameters for all instances
+        :returns:       the list of shared instances, None for those \
+                which could not be loaded
+
+        >>> bases = GeoBase.preloadShared(['capitals', 'continents'], verbose=False)
+        >>> bases[0] is GeoBase.shared('capitals', verbose=False)
+        True
+        >>> bases = GeoBase.preloadShared([('capitals', {'delimiter': None}), 'continents'],
+        ...                               verbose=False)
+        /!\ Could not load shared base capitals: TypeError...
+        >>> bases[0] is None, bases[1] is GeoBase.shared('continents', verbose=False)
+        (True, True)
+        >>> GeoBase.clearShared()
+        """
+        tasks = []
+
+        for data in datas:
+            if isinstance(data, tuple):
+                data, options = data
+                options = dict(kwargs, **options)
+            else:
+                options = kwargs
+
+            tasks.append((data, options))
+
+        results = [None] * len(tasks)
+        errors  = []
+        pending = list(enumerate(tasks))
+        lock    = threading.Lock()
+
+        def _worker():
+            """Load bases until there are no more tasks.
+            """
+            while True:
+                with lock:
+                    if not pending:
+                        return
+                    n, (data, options) = pending.pop(0)
+                try:
+                    results[n] = cls.shared(data, **options)
+                except Exception as err:
+                    with lock:
+                        errors.append((n, err))
+
+        threads = [threading.Thread(target=_worker) for _ in xrange(max(1, workers))]
+
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        for n, err in sorted(errors):
+            print '/!\ Could not load shared base %s: %s: %s' % \
+                    (tasks[n][0], type(err).__name__, err)
+
+        return results
+
+
+    @staticmethod
+    def setSharedMemoryBudget(budget):
+        """Set the memory budget for shared instances.
+
+        When the estimated memory of shared instances exceeds
+        the budget, the least recently used ones are evicted.
+
+        :param budget: the budget in megabytes, None for no limit
+        :returns:      None
+
+        >>> GeoBase.setSharedMemoryBudget(1e-6)
+        >>> geo_s = GeoBase.shared('capitals', verbose=False)
+        >>> geo_s = GeoBase.shared('continents', verbose=False)
+        >>> [data for data, _ in GeoBase.listShared()]
+        ['continents']
+        >>> GeoBase.setSharedMemoryBudget(None)
+        >>> GeoBase.clearShared()
+        """
+        with SHARED['lock']:
+            SHARED['budget'] = budget
+            GeoBase._evictShared()
+
+
+    @staticmethod
+    def _evictShared(keep=None):
+        """Evict least recently used shared instances to fit the budget.
+        """
+        reg = SHARED
+
+        if reg['budget'] is None:
+            return
+
+        budget = reg['budget'] * 1024 ** 2
+
+        # Caches of bases grow after loading
+        for key, base in reg['bases'].iteritems():
+            reg['sizes'][key] = base._estimateMemory()
+
+        while sum(reg['sizes'].itervalues()) > budget:
+            candidates = [k for k in reg['bases'] if k != keep]
+
+            if not candidates:
+                break
+
+            lru = min(candidates, key=lambda k: reg['usage'][k])
+
+            del reg['bases'][lru]
+            del reg['sizes'][lru]
+            del reg['usage'][lru]
+
+
+    @staticmethod
+    def listShared():
+        """List shared instances, most recently used first.
+
+        :returns: a list of (data, estimated memory in bytes)
+
+        >>> GeoBase.listShared()
+        []
+        """
+        reg = SHARED
+
+        with reg['lock']:
+            keys = sorted(reg['bases'], key=lambda k: reg['usage'][k], reverse=True)
+            return [(k[0], reg['sizes'][k]) for k in keys]
+
+
+    @staticmethod
+    def clearShared():
+        """Remove all shared instances.
+        """
+        with SHARED['lock']:
+            SHARED['bases'].clear()
+            SHARED['sizes'].clear()
+            SHARED['usage'].clear()
+
+
+    def _estimateMemory(self):
+        """Estimate the memory used by the things, the spatial
+        indexes and the caches, in bytes.
+
+        This is a rough estimation based on a sample of things,
+        taken every few keys so that it does not change between
+        calls, and on the size of the entries of indexes and caches.
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> size = geo_s._estimateMemory()
+        >>> size > 0, size == geo_s._estimateMemory()
+        (True, True)
+        >>> geo_s.buildKnnGraph(5)
+        >>> geo_s._estimateMemory() > size
+        True
+        """
+        if not self._things:
+            return sys.getsizeof(self._things)
+
+        keys = self._things.keys()
+        keys = keys[::max(1, len(keys) // NB_MEMORY_SAMPLE)]
+        size = 0
+
+        for key in keys:
+            row = self._things[key]
+
+            if isinstance(row, _ViewRow):
+                # Shared values are not counted
+                row = row._own
+
+            size += sys.getsizeof(key) + sys.getsizeof(row)
+            size += sum(sys.getsizeof(v) for v in row.itervalues())
+
+        size = size * len(self._things) / len(keys)
+        size += sys.getsizeof(self._things)
+
+        # Spatial indexes
+        size += _estimateIndex(self._ggrid)
+        size += sum(_estimateIndex(index) for _, index in self._subgrids.itervalues())
+
+        if self._coords_buf is not None:
+            size += sum(buf.nbytes for buf in self._coords_buf)
+            size += len(self._coords[0]) * (2 * _ENTRY_SIZE + _INT_SIZE)
+
+        # Caches of distances, the keys of each pair are shared with things
+        size += len(self._cache_dist) * (_LINK_SIZE + _PAIR_SIZE + _FLOAT_SIZE + _ENTRY_SIZE)
+        size += sum(len(pairs) for pairs in self._dist_pairs.itervalues()) * _ENTRY_SIZE
+
+        if self._dist_matrix is not None:
+            n = len(self._dist_matrix[0])
+            size += n * (_ENTRY_SIZE + _INT_SIZE) + n * n * (_FLOAT_SIZE + _ENTRY_SIZE)
+
+        # Graph of nearest neighbours, and reverse lists
+        if self._knn is not None:
+            n = sum(len(l) for l in self._knn['graph'].itervalues())
+            size += n * (_PAIR_SIZE + _FLOAT_SIZE + 2 * _ENTRY_SIZE)
+            size += len(self._knn['graph']) * (sys.getsizeof([]) + sys.getsizeof(set()))
+            size += len(self._knn['kth']) * (_PAIR_SIZE + _FLOAT_SIZE + _ENTRY_SIZE)
+
+        # Candidates of reverse geocoding
+        for entry in self._reverse_cells.keys():
+            n = len(self._reverse_cells.get(entry)[2])
+            size += _LINK_SIZE + 2 * _PAIR_SIZE + n * (_PAIR_SIZE + 2 * _ENTRY_SIZE)
+
+        size += sum(_estimateIndex(info['grid']) for info in self._reverse_grids.itervalues())
+
+        return size
+
+
     def __init__(self, data, **kwargs):
         """Initialization
 
@@ -175,12 +532,21 @@ class GeoBase(object):
         - source        : ``None`` by default, file-like to the source
         - headers       : ``[]`` by default, list of fields in the data
         - indexes       : ``None`` by default, list of fields defining the key for a line
+        - alt_indexes   : ``[]`` by default, list of fields which are alternate unique keys
         - delimiter     : ``'^'`` by default, delimiter for each field,
         - subdelimiters : ``{}`` by default, a ``{ 'field' : 'delimiter' }`` dict to define subdelimiters
         - quotechar     : ``'"'`` by default, this is the string defined for quoting
         - limit         : ``None`` by default, put an int if you want to load only the first lines
         - discard_dups  : ``False`` by default, boolean to discard key duplicates of handle them
         - verbose       : ``True`` by default, toggle verbosity
+        - view_of       : ``None`` by default, a loaded GeoBase whose rows will be shared, \
+            instead of loading the source again. Only keys and duplicates are specific \
+            to this base, so it must have the same headers. Views are snapshots, \
+            changes of the other base with set, setWithDict and delete after the \
+            view is created are not seen by the view, and the other way round
+        - spatial_index : ``'grid'`` by default, the index for geographical searches, \
+            ``'tree'`` gives exact results for findClosest* methods, ``'adaptive'`` \
+            also gives exact results, with cells split where data is dense
 
         :param data: the type of data wanted, 'airports', 'stations', and many more available. \
             'feed' will create an empty instance.
@@ -213,14 +579,87 @@ class GeoBase(object):
         ...         headers=['iata_code', 'name', 'city'],
         ...         verbose=False).get('ORY')
         {'city': 'PAR', 'name': 'Paris-Orly', 'iata_code': 'ORY', '__gar__': 'FR^France^48.7252780^2.3594440', '__par__': [], '__dup__': [], '__key__': 'ORY', '__lno__': 798}
+
+        Keyed views over the rows of another base.
+
+        >>> geo_v = GeoBase(data='airports',
+        ...                 indexes=['country_code', 'iata_code'],
+        ...                 view_of=geo_a,
+        ...                 verbose=False)
+        >>> geo_v.get('FR+ORY', 'name')
+        'Paris-Orly'
+        >>> geo_v.get('FR+ORY', '__key__'), geo_a.get('ORY', '__key__')
+        ('FR+ORY', 'ORY')
+        >>> geo_v.get('FR+ORY')['__gar__'] is geo_a.get('ORY')['__gar__']
+        True
+        >>> type(geo_v.get('FR+ORY'))
+        <type 'dict'>
+
+        Views are snapshots of the other base.
+
+        >>> geo_w = GeoBase(data='stations', verbose=False)
+        >>> geo_x = GeoBase(data='stations', view_of=geo_w, verbose=False)
+        >>> geo_w.set('frnic', 'name', 'Nice')
+        >>> geo_w.delete('frpaz')
+        >>> geo_x.get('frnic', 'name'), geo_x.get('frpaz', 'name')
+        ('Nice-Ville', 'Paris-Austerlitz')
+        >>> geo_x.set('frnic', 'name', 'Nizza')
+        >>> geo_w.get('frnic', 'name'), geo_x.get('frnic', 'name')
+        ('Nice', 'Nizza')
+        >>> GeoBase(data='stations', view_of=geo_a, verbose=False)
+        Traceback (most recent call last):
+        ValueError: Inconsistent: headers = ['code', ...] with view_of headers = ['iata_code', ...]
         """
         # Main structure in which everything will be loaded
         # Dictionary of dictionary
         self._things = {}
         self._ggrid  = None
 
-        # A cache for the fuzzy searches
-        self._cache_fuzzy = {}
+        # Coordinates arrays for vectorized distances, built when needed
+        # Arrays are views on larger buffers, to add keys in place
+        self._coords     = None
+        self._coords_buf = None
+
+        # Sub-grids for searches with conditions, built when needed
+        self._subgrids = {}
+
+        # Candidates of reverse geocoding for each cell and each conditions,
+        # computed when needed, the conditions and the grid of the cached
+        # cells centers for each conditions, and the cells of each candidate
+        self._reverse_cells  = _LRUCache(REVERSE_CACHE_SIZE)
+        self._reverse_grids  = {}
+        self._reverse_by_key = {}
+
+        # Graph of the K nearest neighbours of each key, and
+        # the keys of the lists containing each key, built on demand
+        self._knn = None
+
+        # Scores of things for weighted searches, and their maximum
+        # for each case of the grid, for each field, computed when needed
+        self._scores = {}
+
+        # Rows shared with views over this base, copied before their
+        # first change, and the keys of the rows not shared anymore
+        self._has_views = False
+        self._own_rows  = set()
+
+        # Indexes for alternate keys and composite keys prefixes
+        self._alt_keys    = {}
+        self._prefix_keys = {}
+
+        # A bounded cache for distances between keys, with the pairs
+        # cached for each key, the distances precomputed for some keys
+        # as a matrix, and the counters of hits and misses
+        self._cache_dist  = _LRUCache(DISTANCE_CACHE_SIZE)
+        self._dist_pairs  = {}
+        self._dist_matrix = None
+        self._dist_stats  = {'hits': 0, 'misses': 0}
+
+        # A cache for the fuzzy searches, with the cached
+        # entries for each field, and for each key in results
+        self._cache_fuzzy    = {}
+        self._fuzzy_by_field = {}
+        self._fuzzy_by_key   = {}
         # An other cache if the algorithms are failing on a single
         # example, we first look in this cache
         self._bias_cache_fuzzy = {}
@@ -236,12 +675,15 @@ class GeoBase(object):
             'source'        : None,
             'headers'       : [],
             'indexes'       : None,
+            'alt_indexes'   : [],
             'delimiter'     : '^',
             'subdelimiters' : {},
             'quotechar'     : '"',
             'limit'         : None,
             'discard_dups'  : False,
             'verbose'       : True,
+            'view_of'       : None,
+            'spatial_index' : 'grid',
         }
 
         if data in BASES:
@@ -279,12 +721,19 @@ class GeoBase(object):
         self._source        = props['source']
         self._headers       = props['headers']
         self._indexes       = props['indexes']
+        self._alt_indexes   = props['alt_indexes']
         self._delimiter     = props['delimiter']
         self._subdelimiters = props['subdelimiters']
         self._quotechar     = props['quotechar']
         self._limit         = props['limit']
         self._discard_dups  = props['discard_dups']
         self._verbose       = props['verbose']
+        self._view_of       = props['view_of']
+        self._spatial_index = props['spatial_index']
+
+        if self._spatial_index not in SPATIAL_INDEXES:
+            raise ValueError('Wrong spatial index "%s". Not in %s' % \
+                             (self._spatial_index, sorted(SPATIAL_INDEXES)))
 
         # Some headers are not accepted
         for h in self._headers:
@@ -294,7 +743,11 @@ class GeoBase(object):
         # Loading data
         self._configSubDelimiters()
 
-        if self._source is not None:
+        if self._view_of is not None:
+            # Rows are shared with another base
+            self._loadView(self._view_of)
+
+        elif self._source is not None:
             if 'source' in kwargs:
                 # As a keyword argument, source should be a file-like
                 self._loadFile(self._source)
@@ -309,6 +762,18 @@ class GeoBase(object):
             # We add those default fields if user adds data with self.set
             self.fields = ['__key__', '__dup__', '__par__', '__lno__', '__gar__']
 
+        # Indexes
+        if isinstance(self._alt_indexes, str):
+            self._alt_indexes = [self._alt_indexes]
+
+        for field in self._alt_indexes:
+            if field not in self.fields:
+                raise ValueError("Inconsistent: fields = %s with alt_indexes = %s" % \
+                                 (self.fields, self._alt_indexes))
+
+            self._alt_keys[field] = self._buildAltKeys(field)
+
+        self._prefix_keys = self._buildPrefixKeys()
 
         # Grid
         if self.hasGeoSupport():
@@ -435,6 +900,103 @@ class GeoBase(object):
 
 
 
+    def _storeRow(self, key, row_data, line_nb, discard_dups, verbose):
+        """Store the data of a row, handling duplicated keys.
+        """
+        # No duplicates ever, we will erase all data after if it is
+        if key not in self._things:
+            self._things[key] = row_data
+
+        else:
+            if discard_dups is False:
+                # We compute a new key for the duplicate
+                nb_dups = 1 + len(self._things[key]['__dup__'])
+                d_key   = self._buildDuplicatedKey(key, nb_dups)
+
+                # We update the data with this info
+                row_data['__key__'] = d_key
+                row_data['__dup__'] = self._things[key]['__dup__']
+                row_data['__par__'] = [key]
+
+                # We add the d_key as a new duplicate, and store the duplicate in the main _things
+                self._things[key]['__dup__'].append(d_key)
+                self._things[d_key] = row_data
+
+                if verbose:
+                    print "/!\ [lno %s] %s is duplicated #%s, first found lno %s: creation of %s..." % \
+                            (line_nb, key, nb_dups, self._things[key]['__lno__'], d_key)
+            else:
+                if verbose:
+                    print "/!\ [lno %s] %s is duplicated, first found lno %s: dropping line..." % \
+                            (line_nb, key, self._things[key]['__lno__'])
+
+
+
+    def _loadView(self, base):
+        """Load the things from the rows of an other loaded base.
+
+        Rows are shared with the other base, only the key
+        and the duplicates information are specific to this base.
+        Note that lines too short to compute a key from the source
+        were loaded with empty values by the other base, so they
+        will get a key here.
+
+        :param base: the loaded GeoBase
+        :raises:     ValueError, if the headers are not the same
+        """
+        if not self._headers:
+            self._headers = base._headers
+            self._configSubDelimiters()
+
+        elif self._headers != base._headers:
+            raise ValueError("Inconsistent: headers = %s with view_of headers = %s" % \
+                             (self._headers, base._headers))
+
+        # Values are already split in the shared rows
+        self._subdelimiters = base._subdelimiters
+
+        # The other base now copies rows before changing them
+        base._has_views = True
+        base._own_rows.clear()
+
+        indexes = self._indexes
+        verbose = self._verbose
+
+        if isinstance(indexes, str):
+            indexes = [indexes]
+
+        if not isinstance(indexes, list) or not set(indexes) <= set(base.fields):
+            raise ValueError("Inconsistent: fields = %s with indexes = %s" % \
+                             (base.fields, self._indexes))
+
+        # We use the raw values, as for the key computation from source
+        fields = [
+            '%s@raw' % f if self._subdelimiters.get(f) is not None else f
+            for f in indexes
+        ]
+
+        # Iterating in the source order makes duplicates
+        # handled as if the source was loaded
+        for shared in sorted(base._things.itervalues(), key=itemgetter('__lno__')):
+            try:
+                key = '+'.join(shared[f] for f in fields)
+            except (KeyError, TypeError):
+                # Things added with set may not have all fields
+                if verbose:
+                    print '/!\ Could not compute key with indexes %s for %s' % \
+                            (self._indexes, shared['__key__'])
+                continue
+
+            self._storeRow(key, _ViewRow(shared, key), shared['__lno__'], self._discard_dups, verbose)
+
+        self.fields = base.fields[:]
+
+        if verbose:
+            print "Import successful from view of %s" % base.data
+            print "Available fields for things: %s" % self.fields
+
+
+
     def _loadFile(self, source_fl):
         """Load the file and feed the self._things.
 
@@ -487,32 +1049,7 @@ class GeoBase(object):
 
             row_data = self._buildRowValues(row, headers, delimiter, subdelimiters, key, line_nb)
 
-            # No duplicates ever, we will erase all data after if it is
-            if key not in self._things:
-                self._things[key] = row_data
-
-            else:
-                if discard_dups is False:
-                    # We compute a new key for the duplicate
-                    nb_dups = 1 + len(self._things[key]['__dup__'])
-                    d_key   = self._buildDuplicatedKey(key, nb_dups)
-
-                    # We update the data with this info
-                    row_data['__key__'] = d_key
-                    row_data['__dup__'] = self._things[key]['__dup__']
-                    row_data['__par__'] = [key]
-
-                    # We add the d_key as a new duplicate, and store the duplicate in the main _things
-                    self._things[key]['__dup__'].append(d_key)
-                    self._things[d_key] = row_data
-
-                    if verbose:
-                        print "/!\ [lno %s] %s is duplicated #%s, first found lno %s: creation of %s..." % \
-                                (line_nb, key, nb_dups, self._things[key]['__lno__'], d_key)
-                else:
-                    if verbose:
-                        print "/!\ [lno %s] %s is duplicated, first found lno %s: dropping line..." % \
-                                (line_nb, key, self._things[key]['__lno__'])
+            self._storeRow(key, row_data, line_nb, discard_dups, verbose)
 
 
         # We remove None headers, which are not-loaded-columns
@@ -557,7 +1094,7 @@ class GeoBase(object):
     def createGrid(self):
         """Create the grid for geographical indexation after loading the data.
         """
-        self._ggrid = GeoGrid(radius=50, verbose=False)
+        self._ggrid = SPATIAL_INDEXES[self._spatial_index]()
 
         for key in self:
             lat_lng = self.getLocation(key)
@@ -579,6 +1116,8 @@ class GeoBase(object):
         :param key:     the key of the thing (like 'SFO')
         :param field:   the field (like 'name' or 'iata_code')
         :param default: if key is missing, returns default if given
+        :param by:      if given, the key is a value of this alternate \
+                unique key field (like 'icao_code')
         :raises:        KeyError, if the key is not in the base
         :returns:       the needed information
 
@@ -605,7 +1144,25 @@ class GeoBase(object):
         >>> geo_t.get('frnic', 'not_a_field', default='There')
         Traceback (most recent call last):
         KeyError: "Field 'not_a_field' [for key 'frnic'] not in ['info', 'code', 'name', 'lines@raw', 'lines', '__gar__', '__par__', '__dup__', '__key__', 'lat', 'lng', '__lno__']"
+
+        Lookups on alternate keys, the index is built on the first use
+        if the field was not declared in alt_indexes.
+
+        >>> geo_t.get('Nice-Ville', 'code', by='name')
+        'frnic'
+        >>> geo_t.get('Nice-Moron', 'code', by='name', default='There')
+        'There'
+        >>> geo_t.get('Nice-Moron', 'code', by='name')
+        Traceback (most recent call last):
+        KeyError: 'Thing not found: name=Nice-Moron'
         """
+        if 'by' in kwargs and kwargs['by'] != '__key__':
+            # Translating the alternate key into the main key
+            key = self._getAltKey(key, kwargs['by'], **kwargs)
+
+            if key is None:
+                return kwargs['default']
+
         if key not in self._things:
             # Unless default is set, we raise an Exception
             if 'default' in kwargs:
@@ -615,7 +1172,13 @@ class GeoBase(object):
 
         # Key is in geobase here
         if field is None:
-            return self._things[key]
+            row = self._things[key]
+
+            if isinstance(row, _ViewRow):
+                # Rows of views are proxies to shared rows
+                return dict(row)
+
+            return row
 
         try:
             res = self._things[key][field]
@@ -626,129 +1189,470 @@ class GeoBase(object):
 
 
 
-    def getLocation(self, key):
-        """Returns geocode as (float, float) or None.
-
-        :param key:     the key of the thing (like 'SFO')
-        :returns:       the location, a tuple of floats (lat, lng), or None
+    def _getAltKey(self, alt_key, field, **kwargs):
+        """Find the main key from an alternate key.
 
-        >>> geo_a.getLocation('AGN')
-        (57.50..., -134.585...)
+        Returns None if default is given and the alternate key is not found.
         """
-        try:
-            loc = tuple(float(self.get(key, f)) for f in GEO_FIELDS)
+        if field not in self._alt_keys:
+            if field not in self.fields:
+                raise KeyError("Field '%s' not in %s" % (field, self.fields))
 
-        except ValueError:
-            # Decode geocode, if error, returns None
-            return None
+            self._alt_keys[field] = self._buildAltKeys(field)
 
-        except KeyError:
-            # Probably means that there is not geocode support
-            # But could be that key is unkwown
-            return None
-        # Note that TypeError would mean that the input
-        # type was not even a string, probably NoneType
+        keys = self._alt_keys[field].get(alt_key)
+
+        if not keys:
+            key = None
+        elif len(keys) == 1:
+            key = keys[0]
         else:
-            return loc
+            key = min(keys, key=self._altKeyRank)
 
+        if key is None and 'default' not in kwargs:
+            raise KeyError("Thing not found: %s=%s" % (field, str(alt_key)))
 
+        return key
 
-    def hasParents(self, key):
-        """Tell if a key has parents.
 
-        :param key:     the key of the thing (like 'SFO')
-        :returns:       the number of parents
+    def _buildAltKeys(self, field):
+        """Build the index of an alternate unique key, mapping each
+        value to the list of keys having it.
 
-        >>> geo_o.hasParents('MRS')
-        0
-        >>> geo_o.hasParents('MRS@1')
-        1
-        >>> geo_o.hasParents('PAR')
-        0
+        Empty values are not indexed. If a value is not unique, the
+        key without parents found first in the source is used, see
+        _altKeyRank.
         """
-        return len(self._things[key]['__par__'])
+        alt_keys = {}
 
+        for key, row in self._things.iteritems():
+            value = row.get(field)
 
-    def hasDuplicates(self, key):
-        """Tell if a key has duplicates.
+            if value is None or value == '':
+                continue
 
-        :param key:     the key of the thing (like 'SFO')
-        :returns:       the number of duplicates
+            try:
+                if value not in alt_keys:
+                    alt_keys[value] = []
+            except TypeError:
+                # Unhashable values are not indexed
+                continue
 
-        >>> geo_o.hasDuplicates('MRS')
-        1
-        >>> geo_o.hasDuplicates('MRS@1')
-        1
-        >>> geo_o.hasDuplicates('PAR')
-        0
+            alt_keys[value].append(key)
+
+        return alt_keys
+
+
+    def _altKeyRank(self, key):
+        """This defines which key is kept when the value
+        of an alternate key is not unique, the lowest wins.
         """
-        return len(self._things[key]['__dup__'])
+        return len(self._things[key]['__par__']), self._things[key]['__lno__']
 
 
+    def _prefixFields(self):
+        """Fields used for composite keys prefixes, None if
+        keys are not composite. We use the raw values, as for
+        the key computation.
+        """
+        if not isinstance(self._indexes, list) or len(self._indexes) < 2:
+            return None
 
-    def getAllDuplicates(self, key, field=None, **kwargs):
-        """Get all duplicates data, parent key included.
+        return [
+            '%s@raw' % f if self._subdelimiters.get(f) is not None else f
+            for f in self._indexes
+        ]
 
-        :param key:     the key of the thing (like 'SFO')
-        :param field:   the field (like 'name' or 'iata_code')
-        :returns:       the list of values for the given field iterated \
-                on all duplicates for the key, including the key itself
 
-        >>> geo_o.getAllDuplicates('ORY', 'name')
-        ['Paris-Orly']
-        >>> geo_o.getAllDuplicates('THA', 'name')
-        ['Tullahoma Regional Airport/William Northern Field', 'Tullahoma']
-        >>> geo_o.getAllDuplicates('THA', '__key__')
-        ['THA', 'THA@1']
-        >>> geo_o.getAllDuplicates('THA@1', '__key__')
-        ['THA@1', 'THA']
-        >>> geo_o.get('THA', '__dup__')
-        ['THA@1']
+    def _buildPrefixKeys(self):
+        """Build the index of composite keys prefixes.
+
+        For a key defined by several fields, like 'NCE+CA' for
+        (iata_code, location_type), we map every prefix of values
+        like 'NCE' to the list of all keys starting with it.
         """
-        if key not in self._things:
-            # Unless default is set, we raise an Exception
-            if 'default' in kwargs:
-                return kwargs['default']
+        prefix_keys = {}
+        fields      = self._prefixFields()
 
-            raise KeyError("Thing not found: %s" % str(key))
+        if fields is None:
+            return prefix_keys
 
-        # Building the list of all duplicates
-        keys = [key]
-        for k in self._things[key]['__dup__'] + self._things[key]['__par__']:
-            if k not in keys:
-                keys.append(k)
+        for key, row in self._things.iteritems():
+            try:
+                values = [row[f] for f in fields]
+            except KeyError:
+                # Things added with set may not have all fields
+                continue
 
-        # Key is in geobase here
-        if field is None:
-            return [self._things[k] for k in keys]
+            for n in xrange(1, len(values)):
+                prefix = '+'.join(values[:n])
 
-        try:
-            res = [self._things[k][field] for k in keys]
-        except KeyError:
-            raise KeyError("Field '%s' [for key '%s'] not in %s" % \
-                           (field, key, self._things[key].keys()))
-        else:
-            return res
+                if prefix not in prefix_keys:
+                    prefix_keys[prefix] = []
 
+                prefix_keys[prefix].append(key)
 
+        return prefix_keys
 
-    def getKeysWhere(self, conditions, from_keys=None, reverse=False, force_str=False, mode='and'):
-        """Get iterator of all keys with particular field.
 
-        For example, if you want to know all airports in Paris.
+    def getKeysWithPrefix(self, prefix):
+        """Get all keys whose first indexes are given.
 
-        :param conditions: a list of (field, value) conditions
-        :param reverse:    we look keys where the field is *not* the particular value. \
-                Note that this negation is done at the lower level, before combining \
-                conditions. So if you have two conditions with mode='and', expect \
-                results matching not condition 1 *and* not condition 2.
-        :param force_str:  for the str() method before every test
-        :param mode:       either 'or' or 'and', how to handle several conditions
-        :param from_keys:  if given, we will look for results from this iterable of keys
-        :returns:          an iterable of (v, key) where v is the number of matched \
-                condition
+        This is useful for bases whose keys are defined by several
+        fields, like (iata_code, location_type). Keys are found
+        directly from the index, without scanning the base.
 
-        >>> list(geo_a.getKeysWhere([('city_code', 'PAR')]))
+        :param prefix: the value of the first index field (like 'NCE'), \
+                or a list of values for the first index fields
+        :returns:      the list of matching keys, duplicates included
+
+        >>> geo_m = GeoBase(data='airports', indexes=['country_code', 'iata_code'], verbose=False)
+        >>> geo_m.getKeysWithPrefix('LU')
+        ['LU+LUX']
+        >>> geo_m.getKeysWithPrefix(['LU', 'LUX'])
+        ['LU+LUX']
+        >>> geo_m.getKeysWithPrefix('XX')
+        []
+
+        With a single index field, the prefix is the whole key.
+
+        >>> geo_a.getKeysWithPrefix('NCE')
+        ['NCE']
+        """
+        if not isinstance(prefix, (list, tuple)):
+            prefix = [prefix]
+
+        prefix = '+'.join(prefix)
+
+        if prefix in self._prefix_keys:
+            return list(self._prefix_keys[prefix])
+
+        if prefix in self._things:
+            # Full key, we include duplicates
+            return self.getAllDuplicates(prefix, '__key__')
+
+        return []
+
+
+
+    def _unindexThing(self, key, field=None):
+        """Remove a thing from the alternate keys and prefixes
+        indexes, before a change of field, or of all fields
+        if field is None.
+
+        >>> geo_m = GeoBase(data='airports', indexes=['country_code', 'iata_code'],
+        ...                 alt_indexes=['name'], verbose=False)
+        >>> geo_m._unindexThing('LU+LUX')
+        >>> geo_m.getKeysWithPrefix('LU'), geo_m.get('Luxembourg / Luxembourg', by='name', default=None)
+        ([], None)
+        >>> geo_m._indexThing('LU+LUX')
+        >>> geo_m.getKeysWithPrefix('LU'), geo_m.get('Luxembourg / Luxembourg', 'iata_code', by='name')
+        (['LU+LUX'], 'LUX')
+        """
+        row = self._things[key]
+
+        for f, alt_keys in self._alt_keys.iteritems():
+            if field is not None and f != field:
+                continue
+
+            value = row.get(f)
+
+            try:
+                if key not in alt_keys.get(value, ()):
+                    continue
+            except TypeError:
+                # Unhashable values are not indexed
+                continue
+
+            alt_keys[value].remove(key)
+
+            if not alt_keys[value]:
+                del alt_keys[value]
+
+        for prefix in self._iterPrefixes(key, field):
+            self._prefix_keys[prefix].remove(key)
+
+            if not self._prefix_keys[prefix]:
+                del self._prefix_keys[prefix]
+
+
+    def _indexThing(self, key, field=None):
+        """Add a thing to the alternate keys and prefixes indexes,
+        after a change of field, or of all fields if field is None.
+        """
+        row = self._things[key]
+
+        for f, alt_keys in self._alt_keys.iteritems():
+            if field is not None and f != field:
+                continue
+
+            value = row.get(f)
+
+            if value is None or value == '':
+                continue
+
+            try:
+                if value not in alt_keys:
+                    alt_keys[value] = []
+            except TypeError:
+                # Unhashable values are not indexed
+                continue
+
+            alt_keys[value].append(key)
+
+        for prefix in self._iterPrefixes(key, field):
+            if prefix not in self._prefix_keys:
+                self._prefix_keys[prefix] = []
+
+            self._prefix_keys[prefix].append(key)
+
+
+    def _iterPrefixes(self, key, field=None):
+        """Yield the composite keys prefixes of a thing, if
+        field is None or is one of the prefixes fields.
+        """
+        fields = self._prefixFields()
+
+        if fields is None or (field is not None and field not in fields):
+            return
+
+        try:
+            values = [self._things[key][f] for f in fields]
+        except KeyError:
+            # Things added with set may not have all fields
+            return
+
+        for n in xrange(1, len(values)):
+            yield '+'.join(values[:n])
+
+
+
+    def getMany(self, keys, fields=None, records=False, **kwargs):
+        """Bulk get on the base, for many keys and fields at once.
+
+        This is the same as calling get in a loop, except that the
+        missing keys are handled in bulk, and that results are returned
+        column-wise.
+
+        :param keys:    an iterable of keys (like ['SFO', 'LAX'])
+        :param fields:  the field (like 'name'), or a list of fields, \
+                if None, all fields are returned
+        :param records: if True, a NumPy record array is returned, \
+                with latitude and longitude converted to floats
+        :param default: if a key is missing, all its fields take this value
+        :raises:        KeyError, if some keys are not in the base, \
+                or if a field is not defined for a key
+        :raises:        ImportError, if records is True without NumPy support
+        :returns:       the list of values if fields is a single field, \
+                or a list of columns, one for each field
+
+        >>> geo_a.getMany(['CDG', 'ORY'], 'city_code')
+        ['PAR', 'PAR']
+        >>> geo_a.getMany([u'CDG', u'ORY'], u'city_code')
+        ['PAR', 'PAR']
+        >>> geo_a.getMany(['CDG', 'NCE'], ['city_code', 'country_code'])
+        [['PAR', 'NCE'], ['FR', 'FR']]
+        >>> geo_a.getMany([], ['name'])
+        [[]]
+
+        Cases of unknown keys.
+
+        >>> geo_t.getMany(['frnic', 'frmoron'], 'name', default='There')
+        ['Nice-Ville', 'There']
+        >>> geo_t.getMany(['frnic', 'frmoron', 'frmoron2'], 'name')
+        Traceback (most recent call last):
+        KeyError: "Things not found: ['frmoron', 'frmoron2']"
+
+        Record arrays, with float coordinates.
+
+        >>> if geo_a.hasNumpySupport():
+        ...     r = geo_a.getMany(['CDG', 'ORY', 'XXX'], ['__key__', 'lat'], records=True, default=None)
+        ...     print r['__key__'].tolist(), r['lat'].round(2).tolist()
+        ['CDG', 'ORY', None] [49.01, 48.73, nan]
+        """
+        if records and not HAS_NUMPY_SUPPORT:
+            raise ImportError('NumPy is required for records=True.')
+
+        if fields is None:
+            fields = self.fields
+
+        single = isinstance(fields, basestring)
+
+        if single:
+            fields = [fields]
+
+        # We look up every key only once
+        keys = list(keys)
+        rows = map(self._things.get, keys)
+
+        if None in rows:
+            missing = [k for k, row in izip(keys, rows) if row is None]
+        else:
+            missing = []
+
+        if missing and 'default' not in kwargs:
+            raise KeyError("Things not found: %s" % str(missing))
+
+        default = kwargs.get('default')
+
+        columns = []
+
+        for field in fields:
+            try:
+                if not missing:
+                    # Fast path, itemgetter avoids the Python loop
+                    columns.append(map(itemgetter(field), rows))
+                else:
+                    columns.append([default if row is None else row[field] for row in rows])
+            except KeyError:
+                for key, row in izip(keys, rows):
+                    if row is not None and field not in row:
+                        break
+
+                raise KeyError("Field '%s' [for key '%s'] not in %s" % (field, key, row.keys()))
+
+        if not records:
+            return columns[0] if single else columns
+
+        arrays = []
+
+        for field, column in izip(fields, columns):
+            if field in GEO_FIELDS:
+                arrays.append(np.array([_to_float(v) for v in column], dtype=np.float64))
+            else:
+                # Filling an empty array avoids turning tuples into new dimensions
+                array = np.empty(len(column), dtype=object)
+                array[:] = column
+                arrays.append(array)
+
+        return np.rec.fromarrays(arrays, names=[str(f) for f in fields])
+
+
+
+    def getLocation(self, key):
+        """Returns geocode as (float, float) or None.
+
+        :param key:     the key of the thing (like 'SFO')
+        :returns:       the location, a tuple of floats (lat, lng), or None
+
+        >>> geo_a.getLocation('AGN')
+        (57.50..., -134.585...)
+        """
+        try:
+            loc = tuple(float(self.get(key, f)) for f in GEO_FIELDS)
+
+        except ValueError:
+            # Decode geocode, if error, returns None
+            return None
+
+        except KeyError:
+            # Probably means that there is not geocode support
+            # But could be that key is unkwown
+            return None
+        # Note that TypeError would mean that the input
+        # type was not even a string, probably NoneType
+        else:
+            return loc
+
+
+
+    def hasParents(self, key):
+        """Tell if a key has parents.
+
+        :param key:     the key of the thing (like 'SFO')
+        :returns:       the number of parents
+
+        >>> geo_o.hasParents('MRS')
+        0
+        >>> geo_o.hasParents('MRS@1')
+        1
+        >>> geo_o.hasParents('PAR')
+        0
+        """
+        return len(self._things[key]['__par__'])
+
+
+    def hasDuplicates(self, key):
+        """Tell if a key has duplicates.
+
+        :param key:     the key of the thing (like 'SFO')
+        :returns:       the number of duplicates
+
+        >>> geo_o.hasDuplicates('MRS')
+        1
+        >>> geo_o.hasDuplicates('MRS@1')
+        1
+        >>> geo_o.hasDuplicates('PAR')
+        0
+        """
+        return len(self._things[key]['__dup__'])
+
+
+
+    def getAllDuplicates(self, key, field=None, **kwargs):
+        """Get all duplicates data, parent key included.
+
+        :param key:     the key of the thing (like 'SFO')
+        :param field:   the field (like 'name' or 'iata_code')
+        :returns:       the list of values for the given field iterated \
+                on all duplicates for the key, including the key itself
+
+        >>> geo_o.getAllDuplicates('ORY', 'name')
+        ['Paris-Orly']
+        >>> geo_o.getAllDuplicates('THA', 'name')
+        ['Tullahoma Regional Airport/William Northern Field', 'Tullahoma']
+        >>> geo_o.getAllDuplicates('THA', '__key__')
+        ['THA', 'THA@1']
+        >>> geo_o.getAllDuplicates('THA@1', '__key__')
+        ['THA@1', 'THA']
+        >>> geo_o.get('THA', '__dup__')
+        ['THA@1']
+        """
+        if key not in self._things:
+            # Unless default is set, we raise an Exception
+            if 'default' in kwargs:
+                return kwargs['default']
+
+            raise KeyError("Thing not found: %s" % str(key))
+
+        # Building the list of all duplicates
+        keys = [key]
+        for k in self._things[key]['__dup__'] + self._things[key]['__par__']:
+            if k not in keys:
+                keys.append(k)
+
+        # Key is in geobase here
+        if field is None:
+            return [self._things[k] for k in keys]
+
+        try:
+            res = [self._things[k][field] for k in keys]
+        except KeyError:
+            raise KeyError("Field '%s' [for key '%s'] not in %s" % \
+                           (field, key, self._things[key].keys()))
+        else:
+            return res
+
+
+
+    def getKeysWhere(self, conditions, from_keys=None, reverse=False, force_str=False, mode='and'):
+        """Get iterator of all keys with particular field.
+
+        For example, if you want to know all airports in Paris.
+
+        :param conditions: a list of (field, value) conditions, if value is a set, \
+                the condition is a membership test on the field
+        :param reverse:    we look keys where the field is *not* the particular value. \
+                Note that this negation is done at the lower level, before combining \
+                conditions. So if you have two conditions with mode='and', expect \
+                results matching not condition 1 *and* not condition 2.
+        :param force_str:  for the str() method before every test
+        :param mode:       either 'or' or 'and', how to handle several conditions
+        :param from_keys:  if given, we will look for results from this iterable of keys
+        :returns:          an iterable of (v, key) where v is the number of matched \
+                condition
+
+        >>> list(geo_a.getKeysWhere([('city_code', 'PAR')]))
         [(1, 'ORY'), (1, 'TNF'), (1, 'CDG'), (1, 'BVA')]
         >>> list(geo_o.getKeysWhere([('comment', '')], reverse=True))
         []
@@ -780,6 +1684,15 @@ class GeoBase(object):
         0
         >>> len(list(geo_o.getKeysWhere([('city_code', 'PAR'), ('city_code', 'BVE')], mode='or')))
         20
+
+        Set values are membership conditions.
+
+        >>> list(geo_a.getKeysWhere([('city_code', set(['PAR']))]))
+        [(1, 'ORY'), (1, 'TNF'), (1, 'CDG'), (1, 'BVA')]
+        >>> len(list(geo_a.getKeysWhere([('city_code', set(['PAR', 'NCE']))])))
+        5
+        >>> len(list(geo_a.getKeysWhere([('city_code', set(['PAR', 'NCE']))], reverse=True)))
+        3514
         """
         if from_keys is None:
             from_keys = iter(self)
@@ -788,12 +1701,28 @@ class GeoBase(object):
         # force_str and reverse at each key later
         if not force_str and not reverse:
             pass_one = lambda a, b: a == b
+            pass_set = lambda a, b: _is_in(a, b)
         elif not force_str and reverse:
             pass_one = lambda a, b: a != b
+            pass_set = lambda a, b: not _is_in(a, b)
         elif force_str and not reverse:
             pass_one = lambda a, b: str(a) == str(b)
+            pass_set = lambda a, b: str(a) in b
         else:
             pass_one = lambda a, b: str(a) != str(b)
+            pass_set = lambda a, b: str(a) not in b
+
+        # Set values are membership tests, performed
+        # with one lookup, whatever the number of values
+        tests = []
+
+        for f, v in conditions:
+            if isinstance(v, (set, frozenset)):
+                if force_str:
+                    v = frozenset(str(e) for e in v)
+                tests.append((f, v, pass_set))
+            else:
+                tests.append((f, v, pass_one))
 
         # Handle and/or cases when multiple conditions
         if mode == 'and':
@@ -806,7 +1735,7 @@ class GeoBase(object):
 
         for key in from_keys:
             try:
-                matches = [pass_one(self.get(key, f), v) for f, v in conditions]
+                matches = [pass_test(self.get(key, f), v) for f, v, pass_test in tests]
                 if pass_all(matches):
                     yield sum(matches), key
             except KeyError:
@@ -815,6 +1744,83 @@ class GeoBase(object):
                     print 'Key %-10s raised KeyError in getKeysWhere, moving on...' % key
 
 
+
+    def getKeysWhereIn(self, field, values, from_keys=None, force_str=False):
+        """Get keys whose field is in a list of values, grouped by value.
+
+        This is equivalent to a getKeysWhere with one condition per value
+        in 'or' mode, except that each key is tested with one set lookup,
+        and that results are grouped by input value to be joined back.
+
+        :param field:     the field (like 'city_code')
+        :param values:    an iterable of values
+        :param from_keys: if given, we will look for results from this iterable of keys
+        :param force_str: for the str() method before every test
+        :returns:         a list of (value, keys) aligned with the input values, \
+                where keys is the list of keys whose field is this value
+
+        >>> geo_a.getKeysWhereIn('city_code', ['NCE', 'PAR', 'NCE', 'XXX'])
+        [('NCE', ['NCE']), ('PAR', ['ORY', 'TNF', 'CDG', 'BVA']), ('NCE', ['NCE']), ('XXX', [])]
+        >>> geo_a.getKeysWhereIn('city_code', ['PAR'], from_keys=['CDG', 'NCE', 'ORY'])
+        [('PAR', ['CDG', 'ORY'])]
+
+        Keys are searched directly in the base, and values of
+        alternate keys directly in their index.
+
+        >>> geo_a.getKeysWhereIn('__key__', ['CDG', 'XXX'])
+        [('CDG', ['CDG']), ('XXX', [])]
+        >>> geo_m = GeoBase(data='airports', alt_indexes=['city_code'], verbose=False)
+        >>> geo_m._things = None # No scan of the base
+        >>> geo_m.getKeysWhereIn('city_code', ['NCE', 'PAR', 'XXX'])
+        [('NCE', ['NCE']), ('PAR', ['ORY', 'TNF', 'CDG', 'BVA']), ('XXX', [])]
+        """
+        values = list(values)
+
+        if force_str:
+            convert = str
+        else:
+            convert = lambda v: v
+
+        # Mapping of value -> list of matching keys
+        groups = dict((convert(v), []) for v in values)
+
+        if field == '__key__' and from_keys is None:
+            # Here the index is the base itself
+            for v, keys in groups.iteritems():
+                if v in self._things:
+                    keys.append(v)
+
+        elif field in self._alt_keys and from_keys is None and not force_str and \
+                all(v is not None and v != '' for v in groups):
+            # Empty values are not in the index of alternate keys
+            for v, keys in groups.iteritems():
+                keys.extend(self._alt_keys[field].get(v, []))
+
+        else:
+            if from_keys is None:
+                from_keys = iter(self)
+
+            for key in from_keys:
+                try:
+                    v = convert(self.get(key, field))
+                except KeyError:
+                    # This means from_keys parameters contained unknown keys
+                    if self._verbose:
+                        print 'Key %-10s raised KeyError in getKeysWhereIn, moving on...' % key
+                    continue
+
+                try:
+                    keys = groups.get(v)
+                except TypeError:
+                    # Unhashable values, like lists, are never found
+                    continue
+
+                if keys is not None:
+                    keys.append(key)
+
+        return [(v, groups[convert(v)]) for v in values]
+
+
     def __str__(self):
         """Stringification.
 
@@ -884,18 +1890,45 @@ class GeoBase(object):
         return self._things.keys()
 
 
-    def _buildDistances(self, lat_lng_ref, keys):
+    def _buildDistances(self, lat_lng_ref, keys, radius=None):
         """
         Compute the iterable of (dist, keys) of a reference
         lat_lng and a list of keys. Keys which have not valid
-        geocodes will not appear in the results.
+        geocodes will not appear in the results. With a radius,
+        only keys within the radius are kept, and the others are
+        rejected before computing their distance when possible.
 
         >>> list(geo_a._buildDistances((0,0), ['ORY', 'CDG']))
         [(5422.74..., 'ORY'), (5455.45..., 'CDG')]
+        >>> len(list(geo_a._buildDistances((0,0), None))) == len(list(geo_a))
+        True
+        >>> list(geo_a._buildDistances((48.84, 2.367), ['NCE', 'ORY', 'CDG'], radius=30))
+        [(12.76..., 'ORY'), (23.40..., 'CDG')]
         """
         if lat_lng_ref is None:
             raise StopIteration
 
+        if HAS_NUMPY_SUPPORT:
+            keys, dists = self._computeDistances(lat_lng_ref, keys, radius)
+
+            for dist, key in izip(dists.tolist(), keys):
+                if radius is None or dist <= radius:
+                    yield dist, key
+
+            raise StopIteration
+
+        if keys is None:
+            keys = iter(self)
+
+        if radius is not None:
+            points = ((key, self.getLocation(key), None) for key in keys)
+            points = (p for p in points if p[1] is not None)
+
+            for dist, key in haversine_within(lat_lng_ref, points, radius):
+                yield dist, key
+
+            raise StopIteration
+
         for key in keys:
 
             lat_lng = self.getLocation(key)
@@ -905,28 +1938,291 @@ class GeoBase(object):
                 yield haversine(lat_lng_ref, lat_lng), key
 
 
-    def findNearPoint(self, lat_lng, radius=50, from_keys=None, grid=True, double_check=True):
+    def _getCoordinates(self):
+        """Get the coordinates arrays, building them if necessary.
+        This requires NumPy.
+
+        :returns: a tuple (keys, positions, lats, lngs), where positions \
+            gives the index of each key in the arrays
+
+        >>> keys, positions, lats, lngs = geo_a._getCoordinates()
+        >>> lats[positions['ORY']], lngs[positions['ORY']]
+        (48.72..., 2.35...)
         """
-        Returns a list of nearby things from a point (given
-        latidude and longitude), and a radius for the search.
-        Note that the haversine function, which compute distance
-        at the surface of a sphere, here returns kilometers,
-        so the radius should be in kms.
+        if self._coords is None:
+            keys, lats, lngs = [], [], []
+
+            for key in self:
+                lat_lng = self.getLocation(key)
+
+                if lat_lng is not None:
+                    keys.append(key)
+                    lats.append(lat_lng[0])
+                    lngs.append(lat_lng[1])
+
+            self._coords_buf = (np.array(lats, dtype=np.float64),
+                                np.array(lngs, dtype=np.float64))
+
+            self._coords = (keys,
+                            dict((k, i) for i, k in enumerate(keys)),
+                            self._coords_buf[0],
+                            self._coords_buf[1])
+
+        return self._coords
+
+
+    def _moveCoordinates(self, key, lat_lng):
+        """Update the coordinates arrays for a key, in place.
+        If lat_lng is None, the key is removed, and the last key
+        takes its position. Buffers grow by doubling, so adding
+        keys is amortized constant time.
+
+        :param key:     the key of the thing
+        :param lat_lng: the new location, or None to remove the key
+        :returns:       None
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> keys, positions, lats, lngs = geo_s._getCoordinates()
+        >>> geo_s._moveCoordinates('frnic', (0.0, 0.0))
+        >>> keys, positions, lats, lngs = geo_s._getCoordinates()
+        >>> lats[positions['frnic']], lngs[positions['frnic']]
+        (0.0, 0.0)
+        >>> geo_s._moveCoordinates('frnic', None)
+        >>> 'frnic' in geo_s._getCoordinates()[1]
+        False
+        """
+        if self._coords is None:
+            # Arrays will be built when needed
+            return
 
-        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
-        :param radius:  the radius of the search (kilometers)
-        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
-            iterable of keys to perform search.
-        :param grid:    boolean, use grid or not
-        :param double_check: when using grid, perform an additional check on results distance, \
-            this is useful because the grid is approximate, so the results are only as accurate \
-            as the grid size
-        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        keys, positions, lats, lngs = self._coords
+        lats_buf, lngs_buf = self._coords_buf
 
-        >>> # Paris, airports <= 50km
-        >>> [geo_a.get(k, 'name') for d, k in sorted(geo_a.findNearPoint((48.84, 2.367), 50))]
-        ['Paris-Orly', 'Paris-Le Bourget', 'Toussus-le-Noble', 'Paris - Charles-de-Gaulle']
-        >>>
+        size = len(keys)
+
+        if key in positions:
+            i = positions[key]
+
+            if lat_lng is not None:
+                lats_buf[i], lngs_buf[i] = lat_lng
+                return
+
+            # The last key takes the place of the removed one
+            del positions[key]
+            last = keys.pop()
+            size -= 1
+
+            if last != key:
+                keys[i] = last
+                positions[last] = i
+                lats_buf[i], lngs_buf[i] = lats_buf[size], lngs_buf[size]
+
+        elif lat_lng is not None:
+            if size == len(lats_buf):
+                lats_buf = np.concatenate((lats_buf, np.empty(max(size, 1))))
+                lngs_buf = np.concatenate((lngs_buf, np.empty(max(size, 1))))
+                self._coords_buf = (lats_buf, lngs_buf)
+
+            lats_buf[size], lngs_buf[size] = lat_lng
+            positions[key] = size
+            keys.append(key)
+            size += 1
+
+        else:
+            return
+
+        self._coords = (keys, positions, lats_buf[:size], lngs_buf[:size])
+
+
+    def _computeDistances(self, lat_lng_ref, keys=None, radius=None):
+        """
+        Compute distances from a reference lat_lng to keys at once.
+        Keys which have not valid geocodes are dropped.
+        With a radius, keys out of the latitude band of the radius
+        are also dropped before computing distances, the remaining
+        ones may still be farther than the radius.
+        This requires NumPy.
+
+        :param lat_lng_ref: the lat_lng of the reference point
+        :param keys:        an iterable of keys, None for all keys
+        :param radius:      None, or the radius of the search
+        :returns:           a tuple (keys, distances array)
+
+        >>> keys, dists = geo_a._computeDistances((0,0), ['ORY', 'not_a_key', 'CDG'])
+        >>> keys, dists.tolist()
+        (['ORY', 'CDG'], [5422.74..., 5455.45...])
+        >>> keys, dists = geo_a._computeDistances((48.84, 2.367), radius=20)
+        >>> len(keys) < len(list(geo_a))
+        True
+        """
+        all_keys, positions, lats, lngs = self._getCoordinates()
+
+        if keys is None:
+            if radius is None:
+                return all_keys, haversine_vect(lat_lng_ref, lats, lngs)
+
+            idx  = np.arange(len(all_keys))
+            keys = all_keys
+        else:
+            keys = [k for k in keys if k in positions]
+            idx  = np.array([positions[k] for k in keys], dtype=np.intp)
+
+        if radius is not None:
+            # Latitude band, with some margin for rounding
+            band = unradian(float(radius) / EARTH_RADIUS) * (1 + 1e-9)
+            kept = np.flatnonzero(np.abs(lats[idx] - lat_lng_ref[0]) <= band)
+            keys = [keys[i] for i in kept.tolist()]
+            idx  = idx[kept]
+
+        return keys, haversine_vect(lat_lng_ref, lats[idx], lngs[idx])
+
+
+
+    def _planSearch(self, from_keys=None, conditions=None, closest=True):
+        """
+        Choose how to perform a geographical search. With conditions,
+        the cached sub-grid of the matching keys is used. Then small
+        from_keys are brute forced, and otherwise from_keys filter the
+        grid results. Closest searches brute force more from_keys when
+        distances are computed with NumPy, see MAX_BRUTE_FORCE_CLOSEST.
+
+        :param from_keys:  None, or an iterable of keys
+        :param conditions: None, or a list of (field, value) conditions
+        :param closest:    is this a closest search, or a radius search
+        :returns:          a tuple (index, from_keys), index is None \
+            for brute force, from_keys is None when no filter is needed
+
+        >>> geo_a._planSearch()[0] is geo_a._ggrid
+        True
+        >>> index, from_keys = geo_a._planSearch(['ORY', 'CDG'])
+        >>> index, sorted(from_keys)
+        (None, ['CDG', 'ORY'])
+        >>> index, from_keys = geo_a._planSearch(conditions=[('country_code', 'FR')])
+        >>> sorted(index._keys)[0:3], from_keys
+        (['AGF', 'AJA', 'ANE'], None)
+
+        Between both thresholds, only closest searches are brute forced.
+
+        >>> keys = list(geo_a)[0:MAX_BRUTE_FORCE + 1]
+        >>> geo_a._planSearch(keys, closest=False)[0] is geo_a._ggrid
+        True
+        >>> geo_a._planSearch(keys, closest=True)[0] is None
+        True
+        >>> keys = list(geo_a)[0:MAX_BRUTE_FORCE_CLOSEST + 1]
+        >>> geo_a._planSearch(keys, closest=True)[0] is geo_a._ggrid
+        True
+        """
+        index = self._ggrid
+
+        if conditions is not None:
+            index = self._getSubIndex(conditions)
+
+        if from_keys is None:
+            return index, None
+
+        if conditions is not None:
+            from_keys = set(k for k in from_keys if k in index._keys)
+
+        elif not isinstance(from_keys, (set, frozenset)):
+            from_keys = set(from_keys)
+
+        if len(from_keys) <= MAX_BRUTE_FORCE:
+            return None, from_keys
+
+        if closest and HAS_NUMPY_SUPPORT and len(from_keys) <= MAX_BRUTE_FORCE_CLOSEST:
+            return None, from_keys
+
+        return index, from_keys
+
+
+    def _keysWhere(self, from_keys=None, conditions=None):
+        """
+        Restrict from_keys to the keys matching conditions.
+        """
+        if conditions is None:
+            return from_keys
+
+        return [k for _, k in self.getKeysWhere(conditions, from_keys=from_keys)]
+
+
+    def _buildIndex(self, keys, index):
+        """
+        Build a spatial index for some keys, taking
+        their coordinates from another index.
+        """
+        sub_index = SPATIAL_INDEXES[self._spatial_index]()
+
+        for key in keys:
+            if key in index._keys:
+                sub_index.add(key, index._keys[key]['lat_lng'], False)
+
+        return sub_index
+
+
+    def _getSubIndex(self, conditions):
+        """
+        Get the sub-grid of keys matching conditions,
+        building it if necessary.
+        """
+        cache_key = self._conditionsKey(conditions)
+
+        if cache_key not in self._subgrids:
+            keys = [k for _, k in self.getKeysWhere(conditions)]
+            self._subgrids[cache_key] = (conditions, self._buildIndex(keys, self._ggrid))
+
+        return self._subgrids[cache_key][1]
+
+
+
+    @staticmethod
+    def _conditionsKey(conditions):
+        """
+        Hashable key for caches depending on conditions.
+
+        >>> GeoBase._conditionsKey([('country_code', set(['FR']))])
+        (('country_code', frozenset(['FR'])),)
+        >>> GeoBase._conditionsKey(None)
+        """
+        if conditions is None:
+            return None
+
+        cache_key = tuple((f, frozenset(v) if isinstance(v, (set, frozenset)) else v)
+                          for f, v in conditions)
+
+        try:
+            hash(cache_key)
+        except TypeError:
+            # Unhashable values in conditions
+            cache_key = repr(conditions)
+
+        return cache_key
+
+
+
+    def findNearPoint(self, lat_lng, radius=50, from_keys=None, grid=True, double_check=True, conditions=None):
+        """
+        Returns a list of nearby things from a point (given
+        latidude and longitude), and a radius for the search.
+        Note that the haversine function, which compute distance
+        at the surface of a sphere, here returns kilometers,
+        so the radius should be in kms.
+
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param radius:  the radius of the search (kilometers)
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform search.
+        :param grid:    boolean, use grid or not
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> # Paris, airports <= 50km
+        >>> [geo_a.get(k, 'name') for d, k in sorted(geo_a.findNearPoint((48.84, 2.367), 50))]
+        ['Paris-Orly', 'Paris-Le Bourget', 'Toussus-le-Noble', 'Paris - Charles-de-Gaulle']
+        >>>
         >>> # Nice, stations <= 5km
         >>> [geo_t.get(k, 'name') for d, k in sorted(geo_t.findNearPoint((43.70, 7.26), 5))]
         ['Nice-Ville', 'Nice-Riquier', 'Nice-St-Roch', 'Villefranche-sur-Mer', 'Nice-St-Augustin']
@@ -948,31 +2244,317 @@ class GeoBase(object):
         >>> # Paris, airports <= 50km with from_keys input list
         >>> sorted(geo_a.findNearPoint((48.84, 2.367), 50, from_keys=['ORY', 'CDG', 'BVE'], grid=False))
         [(12.76..., 'ORY'), (23.40..., 'CDG')]
+
+        With conditions on things.
+
+        >>> sorted(geo_a.findNearPoint((48.84, 2.367), 50, conditions=[('city_code', 'PAR')]))
+        [(12.76..., 'ORY'), (21.46..., 'TNF'), (23.40..., 'CDG')]
+        >>> sorted(geo_a.findNearPoint((48.84, 2.367), 50, grid=False, conditions=[('city_code', 'PAR')]))
+        [(12.76..., 'ORY'), (21.46..., 'TNF'), (23.40..., 'CDG')]
         """
-        if from_keys is None:
-            from_keys = iter(self)
+        if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=False)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is not None:
+            # Using grid, from_keys if just a post-filter
+            for dist, thing in index.findNearPoint(lat_lng, radius, double_check):
+
+                if from_keys is None or thing in from_keys:
+
+                    yield (dist, thing)
+
+        elif HAS_NUMPY_SUPPORT:
+            if lat_lng is None:
+                raise StopIteration
+
+            keys, dists = self._computeDistances(lat_lng, from_keys, radius)
+
+            for i in np.flatnonzero(dists <= radius):
+                yield (float(dists[i]), keys[i])
+
+        else:
+
+            for dist, thing in self._buildDistances(lat_lng, from_keys, radius):
+
+                yield (dist, thing)
+
+
+
+    def countNear(self, lat_lng, radius=50, grid=True, conditions=None):
+        """
+        Count the things within a radius from a point, without
+        building the list of results. With the grid, cases fully
+        inside the radius are counted without looking at their keys.
+
+        :param lat_lng:    the lat_lng of the point (a tuple of (lat, lng))
+        :param radius:     the radius of the search (kilometers)
+        :param grid:       boolean, use grid or not
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to count only the matching keys
+        :returns:          the number of things
+
+        >>> geo_t.countNear((43.70, 7.26), 5)
+        5
+        >>> geo_a.countNear((48.84, 2.367), 30), geo_a.countNear((48.84, 2.367), 30, grid=False)
+        (4, 4)
+        >>> geo_a.countNear((48.84, 2.367), 1000, conditions=[('country_code', 'FR')])
+        90
+        """
+        if lat_lng is None:
+            return 0
+
+        index = self._ggrid
+
+        if conditions is not None:
+            index = self._getSubIndex(conditions)
+
+        if grid and isinstance(index, GeoGrid):
+            return index.countNear(lat_lng, radius)
+
+        return sum(1 for _ in self.findNearPoint(lat_lng, radius, grid=grid, conditions=conditions))
+
+
+    def aggregateByCell(self, precision, field=None, agg='count', conditions=None):
+        """
+        Aggregate the things by geohash cells, like the number of
+        things for each cell of precision 4 in a country.
+        With the grid, and a precision up to the grid precision,
+        cases are merged into their cell, so things are counted
+        with the case sizes.
+
+        :param precision:  the geohash length of the cells
+        :param field:      the field of the values, like 'population', \
+            for sum and max, things without numeric values are ignored
+        :param agg:        'count', 'sum' or 'max'
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to aggregate only the matching keys
+        :raises:           ValueError, if agg is not 'count', 'sum' or 'max', \
+            or if field is None for sum and max
+        :returns:          a dict of the aggregated value for each cell, \
+            given as a geohash
+
+        >>> cells = geo_a.aggregateByCell(2, conditions=[('country_code', 'FR')])
+        >>> cells['u0'], sum(cells.values())
+        (46, 90)
+        >>> geo_a.aggregateByCell(1, 'lat', 'max')['u']
+        78.2...
+
+        Values are not kept, they are only cached for findBestNear.
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> geo_s.aggregateByCell(1, 'lat', 'max')['u']
+        55.7...
+        >>> geo_s._scores
+        {}
+        """
+        if agg not in ('count', 'sum', 'max'):
+            raise ValueError("Aggregation %s not in ['count', 'sum', 'max']." % agg)
+
+        if agg != 'count' and field is None:
+            raise ValueError('A field is needed for %s.' % agg)
+
+        index = self._ggrid
+
+        if conditions is not None:
+            index = self._getSubIndex(conditions)
+
+        if not isinstance(index, GeoGrid):
+            # Other indexes, things are looked at one by one
+            index = GeoGrid(precision=precision, verbose=False)
+
+            for _, key in self.getKeysWhere(conditions or []):
+                lat_lng = self.getLocation(key)
 
+                if lat_lng is not None:
+                    index.add(key, lat_lng, False)
+
+        # Values are only read for the aggregated things
+        values = None if field is None else self._numericValues(field, index._keys)
+
+        return index.aggregateByCell(precision, values, agg)
+
+
+
+    def _findInArea(self, area, polygon=None, from_keys=None, grid=True, conditions=None):
+        """
+        Generates keys inside an area, and inside the polygon if given.
+        """
         if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=False)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is not None:
             # Using grid, from_keys if just a post-filter
-            from_keys = set(from_keys)
+            for thing in index._findInArea(area, polygon):
 
-            for dist, thing in self._ggrid.findNearPoint(lat_lng, radius, double_check):
+                if from_keys is None or thing in from_keys:
 
-                if thing in from_keys:
+                    yield thing
 
-                    yield (dist, thing)
+        else:
+            if from_keys is None:
+                from_keys = iter(self)
+
+            for thing in from_keys:
+
+                lat_lng = self.getLocation(thing)
+
+                if lat_lng is not None and point_in_area(lat_lng, area, polygon):
+
+                    yield thing
+
+
+
+    def findInBBox(self, south, west, north, east, from_keys=None, grid=True, conditions=None):
+        """
+        Returns keys inside a bounding box, like a map viewport.
+        If *west* is greater than *east*, the box crosses the
+        antimeridian. Using grid, only the cases covering the box
+        are visited, and only those crossing its sides are tested.
+
+        :param south:   the southern latitude
+        :param west:    the western longitude
+        :param north:   the northern latitude
+        :param east:    the eastern longitude
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform search.
+        :param grid:    boolean, use grid or not
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of keys
+
+        >>> sorted(geo_a.findInBBox(48.7, 2.3, 49.1, 2.6))
+        ['CDG', 'LBG', 'ORY']
+        >>> sorted(geo_a.findInBBox(48.7, 2.3, 49.1, 2.6, grid=False))
+        ['CDG', 'LBG', 'ORY']
+        >>> sorted(geo_a.findInBBox(48.7, 2.3, 49.1, 2.6, from_keys=['ORY', 'NCE']))
+        ['ORY']
+        >>> sorted(geo_a.findInBBox(-21.5, 178, -21, -174)) # Across the antimeridian
+        ['TBU']
+        """
+        area = bbox_area(south, west, north, east)
+
+        return self._findInArea(area, None, from_keys, grid, conditions)
+
+
+
+    def findInPolygon(self, points, from_keys=None, grid=True, conditions=None):
+        """
+        Returns keys inside a polygon, like a country outline, given
+        as a list of (lat, lng) vertices. Polygons crossing the
+        antimeridian are supported, polygons enclosing a pole are not.
+        Using grid, only the cases covering the polygon are visited,
+        and only those crossing its edges are tested.
+
+        :param points:  the vertices of the polygon
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform search.
+        :param grid:    boolean, use grid or not
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of keys
+
+        >>> triangle = [(48.7, 2.3), (49, 2.3), (48.7, 2.6)]
+        >>> sorted(geo_a.findInPolygon(triangle))
+        ['ORY']
+        >>> sorted(geo_a.findInPolygon(triangle, grid=False))
+        ['ORY']
+        >>> sorted(geo_a.findInPolygon([(48.7, 2.3), (48.7, 2.3)]))
+        []
+        """
+        polygon = unwrap_polygon(points)
+
+        if len(polygon) < 3:
+            return iter([])
+
+        return self._findInArea(polygon_area(polygon), polygon, from_keys, grid, conditions)
+
+
+
+    def findNearRoute(self, keys_or_points, radius=50, from_keys=None, grid=True, double_check=True, conditions=None):
+        """
+        Returns things near a route, made of the shortest paths
+        between successive points, like a great circle flight path.
+        Points may be given as keys, like 'CDG', or as (lat, lng).
+        Each thing is returned once, with its exact cross-track
+        distance and its along-track position on the route.
+
+        :param keys_or_points: the route, as an iterable of keys or lat_lng
+        :param radius:  the half width of the corridor (kilometers)
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform search.
+        :param grid:    boolean, use grid or not
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of (distance, key, along-track position) like \
+            [(3.2, 'SFO', 0.0), (4.5, 'LAX', 540.1)], sorted by along-track position
+
+        >>> # Airports within 10km of the path Orly -> Nice
+        >>> [k for _, k, _ in geo_a.findNearRoute(['ORY', 'NCE'], 10)]
+        ['ORY', 'QNX', 'NCE']
+        >>> [(k, int(along)) for _, k, along in geo_a.findNearRoute(['ORY', (43.66, 7.21)], 10)]
+        [('ORY', 0), ('QNX', 326), ('NCE', 675)]
+        >>> [(k, int(along)) for _, k, along in geo_a.findNearRoute(['ORY', (43.66, 7.21)], 10, grid=False)]
+        [('ORY', 0), ('QNX', 326), ('NCE', 675)]
+        >>> list(geo_a.findNearRoute(['ORY', 'NCE'], 10, from_keys=['NCE', 'CDG']))
+        [(0.0, 'NCE', 675.82...)]
+        """
+        route = []
+
+        for point in keys_or_points:
+            if not isinstance(point, (tuple, list)):
+                point = self.getLocation(point)
+
+            if point is not None:
+                route.append(tuple(point))
+
+        if not route:
+            raise StopIteration
 
+        if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=False)
         else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
 
-            for dist, thing in self._buildDistances(lat_lng, from_keys):
+        if index is not None:
+            # Using grid, from_keys if just a post-filter
+            for dist, thing, along in index.findNearRoute(route, radius, double_check):
 
-                if dist <= radius:
+                if from_keys is None or thing in from_keys:
 
-                    yield (dist, thing)
+                    yield (dist, thing, along)
+
+            raise StopIteration
+
+        if from_keys is None:
+            from_keys = iter(self)
+
+        keys, lat_lngs = [], []
+
+        for thing in from_keys:
+
+            lat_lng = self.getLocation(thing)
+
+            if lat_lng is not None:
+                keys.append(thing)
+                lat_lngs.append(lat_lng)
+
+        results = [(dist, thing, along)
+                   for (dist, along), thing in izip(route_distances(route, lat_lngs), keys)
+                   if dist <= radius]
+
+        for result in sorted(results, key=lambda r: (r[2], r[0])):
+            yield result
 
 
 
-    def findNearKey(self, key, radius=50, from_keys=None, grid=True, double_check=True):
+    def findNearKey(self, key, radius=50, from_keys=None, grid=True, double_check=True, conditions=None):
         """
         Same as findNearPoint, except the point is given
         not by a lat/lng, but with its key, like ORY or SFO.
@@ -987,6 +2569,8 @@ class GeoBase(object):
         :param double_check: when using grid, perform an additional check on results distance, \
             this is useful because the grid is approximate, so the results are only as accurate \
             as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
         :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
 
         >>> sorted(geo_o.findNearKey('ORY', 10)) # Orly, por <= 10km
@@ -1008,26 +2592,28 @@ class GeoBase(object):
         >>> 
         >>> sorted(geo_a.findNearKey('ORY', 50, grid=False, from_keys=['ORY', 'CDG', 'SFO']))
         [(0.0, 'ORY'), (34.8..., 'CDG')]
-        """
-        if from_keys is None:
-            from_keys = iter(self)
 
-        if grid:
-            # Using grid, from_keys if just a post-filter
-            from_keys = set(from_keys)
+        With a graph of nearest neighbours, see buildKnnGraph, results
+        are read from the graph if the Kth neighbour is beyond radius.
+        """
+        if self._knn is not None and key in self._knn['graph'] and \
+                from_keys is None and conditions is None and double_check:
 
-            for dist, thing in self._ggrid.findNearKey(key, radius, double_check):
+            neighbours = self._knn['graph'][key]
 
-                if thing in from_keys:
-                    yield (dist, thing)
+            # Shorter lists mean the base has less than K keys
+            if len(neighbours) < self._knn['K'] or neighbours[-1][0] > radius:
+                for dist, thing in neighbours:
+                    if dist <= radius:
+                        yield (dist, thing)
+                raise StopIteration
 
-        else:
-            for dist, thing in self.findNearPoint(self.getLocation(key), radius, from_keys, grid, double_check):
-                yield (dist, thing)
+        for dist, thing in self.findNearPoint(self.getLocation(key), radius, from_keys, grid, double_check, conditions):
+            yield (dist, thing)
 
 
 
-    def findClosestFromPoint(self, lat_lng, N=1, from_keys=None, grid=True, double_check=True):
+    def findClosestFromPoint(self, lat_lng, N=1, from_keys=None, grid=True, double_check=True, conditions=None):
         """
         Concept close to findNearPoint, but here we do not
         look for the things radius-close to a point,
@@ -1040,9 +2626,11 @@ class GeoBase(object):
             iterable of keys to perform findClosestFromPoint. This is useful when we have names \
             and have to perform a matching based on name and location (see fuzzyGetAroundLatLng).
         :param grid:    boolean, use grid or not
-        :param double_check: when using grid, perform an additional check on results distance, \
-            this is useful because the grid is approximate, so the results are only as accurate \
+        :param double_check: when using grid, compute results distance, \
+            the search is then exact, otherwise it is only as accurate \
             as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
         :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
 
         >>> list(geo_a.findClosestFromPoint((43.70, 7.26))) # Nice
@@ -1073,12 +2661,49 @@ class GeoBase(object):
         [(0.56..., 'frnic')]
         >>> list(geo_t.findClosestFromPoint((43.70, 7.26), N=2, grid=False, from_keys=('frpaz', 'frply', 'frbve')))
         [(482.84..., 'frbve'), (683.89..., 'frpaz')]
-        """
-        if from_keys is None:
-            from_keys = iter(self)
 
+        With a tree as spatial index, results are exact.
+
+        >>> geo_tt = GeoBase(data='stations', spatial_index='tree', verbose=False)
+        >>> list(geo_tt.findClosestFromPoint((43.70, 7.26), N=3))
+        [(0.56..., 'frnic'), (2.52..., 'fr4342'), (2.82..., 'fr5737')]
+        >>> list(geo_tt.findClosestFromPoint((43.70, 7.26), N=2, from_keys=('frpaz', 'frply', 'frbve')))
+        [(482.84..., 'frbve'), (683.89..., 'frpaz')]
+        >>> geo_ta = GeoBase(data='stations', spatial_index='adaptive', verbose=False)
+        >>> list(geo_ta.findClosestFromPoint((43.70, 7.26), N=3))
+        [(0.56..., 'frnic'), (2.52..., 'fr4342'), (2.82..., 'fr5737')]
+
+        With conditions on things, a sub-grid is built and cached.
+
+        >>> list(geo_a.findClosestFromPoint((43.70, 7.26), N=2, conditions=[('country_code', 'IT')]))
+        [(79.71..., 'ALL'), (98.54..., 'CUF')]
+        >>> list(geo_a.findClosestFromPoint((43.70, 7.26), N=2, grid=False, conditions=[('country_code', 'IT')]))
+        [(79.71..., 'ALL'), (98.54..., 'CUF')]
+        """
         if grid:
-            for dist, thing in self._ggrid.findClosestFromPoint(lat_lng, N, double_check, from_keys):
+            index, from_keys = self._planSearch(from_keys, conditions, closest=True)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is not None:
+            for dist, thing in index.findClosestFromPoint(lat_lng, N, double_check, from_keys):
+                yield (dist, thing)
+
+        elif HAS_NUMPY_SUPPORT:
+            if lat_lng is None:
+                raise StopIteration
+
+            keys, dists = self._computeDistances(lat_lng, from_keys)
+
+            if N < len(keys):
+                # Everything as close as the Nth is kept, so that
+                # ties are broken on keys, as with the heap
+                kth   = dists[np.argpartition(dists, N - 1)[N - 1]]
+                where = np.flatnonzero(dists <= kth)
+            else:
+                where = np.arange(len(keys))
+
+            for dist, thing in heapq.nsmallest(N, izip(dists[where].tolist(), (keys[i] for i in where))):
                 yield (dist, thing)
 
         else:
@@ -1089,59 +2714,954 @@ class GeoBase(object):
 
 
 
-    def findClosestFromKey(self, key, N=1, from_keys=None, grid=True, double_check=True):
+    def reverseGeocode(self, lat_lng, fields=(), conditions=None):
         """
-        Same as findClosestFromPoint, except the point is given
-        not by a lat/lng, but with its key, like ORY or SFO.
-        We just look up in the base to retrieve lat/lng, and
-        call findClosestFromPoint.
+        Find the closest thing from a point, and get some of its
+        fields in the same call, like the name and country of the
+        closest city. The candidates for each cell of the Earth,
+        which may be the closest for some point of the cell, are
+        computed once, so most lookups are a dictionary lookup
+        and a few distances.
+
+        :param lat_lng:    the lat_lng of the point (a tuple of (lat, lng))
+        :param fields:     a list of fields, like ['name', 'country_code']
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys
+        :returns:          a tuple (distance, key, values), with the values \
+            of fields, or None if there is nothing to find
+
+        >>> geo_a.reverseGeocode((43.70, 7.26), ['name', 'country_code'])
+        (5.82..., 'NCE', ["Nice - Cote d'Azur", 'FR'])
+        >>> geo_a.reverseGeocode((43.70, 7.26), conditions=[('country_code', 'IT')])
+        (79.71..., 'ALL', [])
+        >>> geo_t.reverseGeocode(None) is None
+        True
+        """
+        if lat_lng is None:
+            return None
 
-        :param key:       the key of the thing (like 'SFO')
-        :param N:         the N closest results wanted
-        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
-            iterable of keys to perform findClosestFromPoint. This is useful when we have names \
-            and have to perform a matching based on name and location (see fuzzyGetAroundLatLng).
-        :param grid:    boolean, use grid or not
-        :param double_check: when using grid, perform an additional check on results distance, \
-            this is useful because the grid is approximate, so the results are only as accurate \
-            as the grid size
-        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        try:
+            cell = encode_cell(lat_lng[0], lat_lng[1], REVERSE_PRECISION)
+
+        except ValueError:
+            # Invalid coordinates, no cell
+            closest = list(self.findClosestFromPoint(lat_lng, conditions=conditions))
+            candidates = None
+        else:
+            candidates = self._reverseCandidates(cell, conditions)
+            closest = [min((haversine(lat_lng, l), k) for k, l in candidates)] if candidates else []
+
+        if not closest:
+            return None
+
+        dist, key = closest[0]
+
+        return dist, key, [self.get(key, f) for f in fields]
+
+
+    def _reverseCandidates(self, cell, conditions=None):
+        """
+        Get the candidates of reverse geocoding for a cell, that is the
+        things which may be the closest from a point of the cell, with
+        their lat_lng, computing them if necessary.
+
+        >>> cell = encode_cell(43.70, 7.26, REVERSE_PRECISION)
+        >>> sorted(k for k, _ in geo_a._reverseCandidates(cell))
+        ['NCE']
+        """
+        entry = self._conditionsKey(conditions), cell
+        cached = self._reverse_cells.get(entry)
+
+        if cached is not None:
+            return cached[2]
+
+        box    = cell_bbox(cell, REVERSE_PRECISION)
+        center = 0.5 * (box['s'] + box['n']), 0.5 * (box['w'] + box['e'])
+
+        # Some margin for rounding
+        r = 1.01 * max(haversine(center, (box[lat], box[lng]))
+                       for lat in 'sn' for lng in 'we')
+
+        limit      = self._candidatesLimit(center, 1, None, r, conditions)
+        candidates = [(k, self.getLocation(k))
+                      for _, k in self.findNearPoint(center, limit, conditions=conditions)]
+
+        if len(self._reverse_cells) >= self._reverse_cells.max_size:
+            self._dropReverseCell(self._reverse_cells.oldest())
+
+        self._reverse_cells.put(entry, (center, limit, candidates))
+
+        if entry[0] not in self._reverse_grids:
+            self._reverse_grids[entry[0]] = {
+                'conditions' : conditions,
+                'grid'       : GeoGrid(precision=3, verbose=False),
+                'limit'      : 0,
+            }
+
+        info = self._reverse_grids[entry[0]]
+        info['grid'].add(cell, center, False)
+        info['limit'] = max(info['limit'], limit)
+
+        for key, _ in candidates:
+            self._reverse_by_key.setdefault(key, set()).add(entry)
+
+        return candidates
+
+
+    def _candidatesAround(self, center, N=1, radius=None, margin=0, conditions=None):
+        """
+        Get the things which may be in the results of a search for
+        any point within margin from center, with their lat_lng.
+
+        If the Nth closest thing from center is at d, the N closest
+        things from a point within margin are within d + 2 * margin
+        from center. Things within radius from such a point are
+        within radius + margin from center.
+
+        :param center:     the lat_lng of the center
+        :param N:          the N closest results wanted, or None
+        :param radius:     if not None, the radius of the search
+        :param margin:     the distance from the center of the points
+        :param conditions: if not None, a list of (field, value) conditions
+        :returns:          a list of (key, lat_lng)
+
+        >>> sorted(k for k, _ in geo_a._candidatesAround((48.78, 2.36), N=1, margin=5))
+        ['ORY']
+        >>> sorted(k for k, _ in geo_a._candidatesAround((48.78, 2.36), N=None, radius=20, margin=5))
+        ['LBG', 'ORY', 'TNF']
+        """
+        limit = self._candidatesLimit(center, N, radius, margin, conditions)
+        near  = self.findNearPoint(center, limit, conditions=conditions)
+
+        return [(k, self.getLocation(k)) for _, k in near]
+
+
+    def _candidatesLimit(self, center, N=1, radius=None, margin=0, conditions=None):
+        """
+        Get the distance from center within which are the
+        candidates of _candidatesAround. A thing moved within
+        this distance may change the candidates.
+
+        >>> geo_a._candidatesLimit((48.78, 2.36), N=1, margin=5)
+        16.08...
+        >>> geo_a._candidatesLimit((48.78, 2.36), N=None, radius=20, margin=5)
+        25
+        """
+        # Half the circumference, everything is within this distance
+        limit = pi * EARTH_RADIUS + 2 * margin
+
+        if N is not None:
+            closest = list(self.findClosestFromPoint(center, N, conditions=conditions))
+
+            if len(closest) == N:
+                limit = closest[-1][0] + 2 * margin
+
+        if radius is not None:
+            limit = min(limit, radius + margin)
+
+        return limit
+
+
+    def findFromStream(self, stream, N=1, radius=None, margin=STREAM_MARGIN, conditions=None):
+        """
+        Find the closest things, or the things within a radius, from a
+        stream of positions of several moving objects, like vehicles.
+        For each object, the candidates around its last position are
+        kept, and computed again only when the object moves farther
+        than margin, so slow objects are mostly a few distances.
+
+        :param stream:     an iterable of (id, lat, lng), where id is \
+            the moving object identifier
+        :param N:          the N closest results wanted, if None \
+            all results within radius are given
+        :param radius:     if not None, results farther than radius (kilometers) are dropped
+        :param margin:     the distance (kilometers) an object can move \
+            before its candidates are computed again
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys
+        :raises:           ValueError, if both N and radius are None
+        :returns:          an iterable of (id, results), where results \
+            are lists of (distance, key), sorted by distance
+
+        >>> stream = [('t1', 43.70, 7.26), ('t2', 48.72, 2.36), ('t1', 43.71, 7.27)]
+        >>> for vehicle, results in geo_a.findFromStream(stream, N=2):
+        ...     print vehicle, results
+        t1 [(5.82..., 'NCE'), (30.28..., 'CEQ')]
+        t2 [(0.58..., 'ORY'), (18.94..., 'TNF')]
+        t1 [(7.20..., 'NCE'), (31.58..., 'CEQ')]
+        >>> list(geo_a.findFromStream([('t1', 43.70, 7.26)], N=None, radius=10))
+        [('t1', [(5.82..., 'NCE')])]
+        """
+        if N is None and radius is None:
+            raise ValueError('N and radius cannot both be None.')
+
+        # Last position and candidates of objects
+        cache = _LRUCache(STREAM_CACHE_SIZE)
+
+        for id_, lat, lng in stream:
+
+            if lat is None or lng is None:
+                yield id_, []
+                continue
+
+            lat_lng = lat, lng
+            last    = cache.get(id_)
+
+            if last is None or haversine(last[0], lat_lng) > margin:
+                last = lat_lng, self._candidatesAround(lat_lng, N, radius, margin, conditions)
+                cache.put(id_, last)
+
+            results = sorted((haversine(lat_lng, l), k) for k, l in last[1])
+
+            if radius is not None:
+                results = [(d, k) for d, k in results if d <= radius]
+
+            yield id_, results if N is None else results[:N]
+
+
+    def findBestNear(self, lat_lng, score_field, alpha=1.0, N=1, grid=True):
+        """
+        Find the things with the best combined score from a point,
+        like the most important airport near here. The score of a
+        thing is the value of score_field, minus alpha times its
+        distance, so alpha is the score lost per kilometer. Things
+        without a numeric value for score_field are ignored.
+
+        With the grid, the maximum value of each case is computed once,
+        and only cases which may beat the N best found are expanded.
+
+        :param lat_lng:     the lat_lng of the point (a tuple of (lat, lng))
+        :param score_field: the field of the scores, like 'population'
+        :param alpha:       the score lost per kilometer
+        :param N:           the N best results wanted
+        :param grid:        boolean, use grid or not
+        :raises:            ValueError, if alpha is negative
+        :returns:           an iterable of (combined score, distance, key), \
+            best first
+
+        >>> geo_c = GeoBase(data='cities', verbose=False)
+        >>> [geo_c.get(k, 'name') for _, _, k in geo_c.findBestNear((43.70, 7.26), 'population', 10000, N=2)]
+        ['Nice', 'Saint-Laurent-du-Var']
+
+        With a lower alpha, larger cities farther away are better,
+        here Istanbul and Moscow.
+
+        >>> list(geo_c.findBestNear((43.70, 7.26), 'population', 1000, N=2))
+        [(9372548.4..., 1801.7..., '745044'), (7851171.0..., 2530.0..., '524901')]
+        >>> list(geo_c.findBestNear((43.70, 7.26), 'population', 1000, N=2, grid=False))
+        [(9372548.4..., 1801.7..., '745044'), (7851171.0..., 2530.0..., '524901')]
+        """
+        if alpha < 0:
+            raise ValueError('Alpha cannot be negative, got %s.' % alpha)
+
+        if lat_lng is None:
+            raise StopIteration
+
+        scores, cell_max = self._getScores(score_field)
+
+        if grid and isinstance(self._ggrid, GeoGrid):
+            results = self._ggrid.findBestNear(lat_lng, scores, alpha, N, cell_max)
+        else:
+            results = [(scores[k] - alpha * d, d, k) for d, k in self._buildDistances(lat_lng, scores)]
+            results = heapq.nsmallest(N, results, key=lambda r: (-r[0], r[1], r[2]))
+
+        for score, dist, key in results:
+            yield (score, dist, key)
+
+
+    def _getScores(self, field):
+        """
+        Get the numeric values of a field, and their maximum for each
+        case of the grid, computing them if necessary.
+
+        >>> scores, cell_max = geo_a._getScores('lat')
+        >>> scores['ORY'], max(cell_max.values())
+        (48.7..., 78.2...)
+        """
+        if field not in self._scores:
+            scores = self._numericValues(field, self._things)
+
+            if isinstance(self._ggrid, GeoGrid):
+                cell_max = self._ggrid.cellMaxima(scores)
+            else:
+                cell_max = None
+
+            self._scores[field] = scores, cell_max
+
+        return self._scores[field]
+
+
+    def _numericValues(self, field, keys):
+        """
+        Get the numeric values of a field for some keys,
+        keys without numeric values are left out.
+
+        >>> sorted(geo_a._numericValues('lat', ['ORY', 'CDG', 'NCE']).items())
+        [('CDG', 49.0...), ('NCE', 43.6...), ('ORY', 48.7...)]
+        """
+        values = {}
+
+        for key in keys:
+            value = _to_float(self._things[key].get(field))
+
+            # NaN is not equal to itself
+            if value == value:
+                values[key] = value
+
+        return values
+
+
+    def findClosestFromKey(self, key, N=1, from_keys=None, grid=True, double_check=True, conditions=None):
+        """
+        Same as findClosestFromPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+        We just look up in the base to retrieve lat/lng, and
+        call findClosestFromPoint.
+
+        :param key:       the key of the thing (like 'SFO')
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint. This is useful when we have names \
+            and have to perform a matching based on name and location (see fuzzyGetAroundLatLng).
+        :param grid:    boolean, use grid or not
+        :param double_check: when using grid, compute results distance, \
+            the search is then exact, otherwise it is only as accurate \
+            as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> list(geo_a.findClosestFromKey('ORY')) # Orly
+        [(0.0, 'ORY')]
+        >>> list(geo_a.findClosestFromKey('ORY', N=3))
+        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
+        >>> # Corner case, from_keys empty is not used
+        >>> list(geo_t.findClosestFromKey('ORY', N=2, from_keys=()))
+        []
+        >>> list(geo_t.findClosestFromKey(None, N=2))
+        []
+        >>> #from datetime import datetime
+        >>> #before = datetime.now()
+        >>> #for _ in range(100): s = geo_a.findClosestFromKey('NCE', N=3)
+        >>> #print(datetime.now() - before)
+
+        No grid.
+
+        >>> list(geo_o.findClosestFromKey('ORY', grid=False)) # Nice
+        [(0.0, 'ORY')]
+        >>> list(geo_a.findClosestFromKey('ORY', N=3, grid=False)) # Nice
+        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
+        >>> list(geo_t.findClosestFromKey('frnic', N=1, grid=False)) # Nice
+        [(0.0, 'frnic')]
+        >>> list(geo_t.findClosestFromKey('frnic', N=2, grid=False, from_keys=('frpaz', 'frply', 'frbve')))
+        [(482.79..., 'frbve'), (683.52..., 'frpaz')]
+
+        With a graph of nearest neighbours, see buildKnnGraph,
+        results are read from the graph if N is at most K.
+        """
+        if self._knn is not None and key in self._knn['graph'] and N <= self._knn['K'] and \
+                from_keys is None and conditions is None and double_check:
+            for dist, thing in self._knn['graph'][key][:N]:
+                yield (dist, thing)
+            raise StopIteration
+
+        for dist, thing in self.findClosestFromPoint(self.getLocation(key), N, from_keys, grid, double_check, conditions):
+            yield (dist, thing)
+
+
+    def buildKnnGraph(self, K=10, processes=None):
+        """
+        Build the graph of the K nearest neighbours of each key, like
+        the nearest alternative airports of each airport. The graph is
+        then used by findClosestFromKey and findNearKey, and updated
+        when locations change through set and delete.
+
+        :param K:         the number of neighbours of each key, \
+            including the key itself
+        :param processes: if more than 1, keys are split among this number of processes
+        :returns:         None
+
+        >>> geo_a.buildKnnGraph(K=5)
+        >>> geo_a._knn['graph']['ORY'][:3]
+        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
+        >>> list(geo_a.findClosestFromKey('ORY', N=2))
+        [(0.0, 'ORY'), (18.80..., 'TNF')]
+        >>> sorted(geo_a.findNearKey('ORY', 30))
+        [(0.0, 'ORY'), (18.8..., 'TNF'), (27.8..., 'LBG')]
+        >>> geo_a.clearKnnGraph()
+        """
+        keys    = [key for key in self if self.getLocation(key) is not None]
+        results = self.findClosestFromPoints([self.getLocation(k) for k in keys], K, processes=processes)
+
+        self._setKnnGraph(K, dict(izip(keys, ([tuple(r) for r in res] for res in results))))
+
+
+    def _setKnnGraph(self, K, graph):
+        """
+        Set the graph of nearest neighbours, the keys of the lists
+        containing each key, the keys of the lists shorter than K,
+        and a heap of the Kth distances of the other lists.
+        """
+        self._knn = {
+            'K'       : K,
+            'graph'   : {},
+            'reverse' : {},
+            'short'   : set(),
+            'kth'     : [],
+        }
+
+        for key, neighbours in graph.iteritems():
+            self._setKnnList(key, neighbours)
+
+
+    def clearKnnGraph(self):
+        """Remove the graph of nearest neighbours.
+        """
+        self._knn = None
+
+
+    def saveKnnGraph(self, filename):
+        """
+        Save the graph of nearest neighbours in a json file.
+
+        :param filename: the file name
+        :raises:         ValueError, if there is no graph
+        :returns:        None
+
+        >>> import os, tempfile
+        >>> filename = os.path.join(tempfile.mkdtemp(), 'knn.json')
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> geo_s.setWithDict('fr\\xc3\\xa9', {'lat': '43.71', 'lng': '7.26'})
+        >>> geo_s.buildKnnGraph(K=3)
+        >>> geo_s.saveKnnGraph(filename)
+        >>> geo_s.clearKnnGraph()
+        >>> geo_s.loadKnnGraph(filename)
+        >>> geo_s._knn['K'], list(geo_s.findClosestFromKey('frnic', N=2))
+        (3, [(0.0, 'frnic'), (0.59..., 'fr\\xc3\\xa9')])
+
+        Graphs saved for other locations are not loaded.
+
+        >>> geo_s.set('frnic', LAT_FIELD, '43.8')
+        >>> geo_s.loadKnnGraph(filename)
+        Traceback (most recent call last):
+        ValueError: Graph of nearest neighbours saved for other locations...
+        >>> os.remove(filename)
+        """
+        if self._knn is None:
+            raise ValueError('No graph of nearest neighbours to save.')
+
+        with open(filename, 'w') as out:
+            json.dump({
+                'K'           : self._knn['K'],
+                'graph'       : self._knn['graph'],
+                'fingerprint' : self._knnFingerprint(),
+            }, out)
+
+
+    def loadKnnGraph(self, filename):
+        """
+        Load the graph of nearest neighbours from a json file,
+        saved with saveKnnGraph for the same data.
+
+        :param filename: the file name
+        :raises:         ValueError, if the graph was saved for other locations
+        :returns:        None
+        """
+        with open(filename) as fl:
+            data = json.load(fl)
+
+        if data.get('fingerprint') != self._knnFingerprint():
+            raise ValueError('Graph of nearest neighbours saved for other locations in %s' % filename)
+
+        # Json gives unicode strings
+        graph = dict((key.encode('utf8'), [(dist, other.encode('utf8')) for dist, other in neighbours])
+                     for key, neighbours in data['graph'].iteritems())
+
+        self._setKnnGraph(data['K'], graph)
+
+
+    def _knnFingerprint(self):
+        """
+        A fingerprint of the locations of the base, the number of keys
+        with a location, and a hash of their locations, to check a graph
+        of nearest neighbours is loaded for the same data.
+        """
+        digest = hashlib.md5()
+        count  = 0
+
+        for key in sorted(self._things):
+            lat_lng = self.getLocation(key)
+
+            if lat_lng is not None:
+                digest.update('%s^%r^%r\n' % (key, lat_lng[0], lat_lng[1]))
+                count += 1
+
+        return {
+            'keys'      : count,
+            'locations' : digest.hexdigest(),
+        }
+
+
+    def _updateKnnGraph(self, key):
+        """
+        Update the graph of nearest neighbours after the location of key
+        changed. The lists of key, the lists containing key, and the lists
+        key may now enter are computed again.
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> geo_s.buildKnnGraph(K=3)
+        >>> neighbours = lambda: dict((k, [o for _, o in l]) for k, l in geo_s._knn['graph'].items())
+        >>> before = neighbours()
+        >>> sorted(geo_s._knn['reverse']['fr4342']) # Lists containing fr4342
+        ['fr4342', 'fr4708', 'fr5737', 'frnic']
+        >>> lat = geo_s.get('frnic', LAT_FIELD)
+        >>> geo_s.set('frnic', LAT_FIELD, '48.84')
+        >>> sorted(geo_s._knn['reverse']['fr4342'])
+        ['fr4342', 'fr4708', 'fr5737']
+        >>> neighbours()['frnic'] == [k for _, k in geo_s.findClosestFromPoint(geo_s.getLocation('frnic'), 3)]
+        True
+        >>> geo_s.set('frnic', LAT_FIELD, lat)
+        >>> neighbours() == before
+        True
+        """
+        if self._knn is None:
+            return
+
+        K, graph, reverse = self._knn['K'], self._knn['graph'], self._knn['reverse']
+
+        lat_lng = self.getLocation(key) if key in self._things else None
+
+        # Lists containing key, which may have left them
+        stale = reverse.pop(key, set())
+        stale.discard(key)
+
+        if key in graph:
+            self._setKnnList(key, None)
+
+        if lat_lng is not None:
+            stale.update(self._knnEntrants(key, lat_lng))
+
+            self._setKnnList(key, [tuple(r) for r in self.findClosestFromPoint(lat_lng, K)])
+
+        for other in stale:
+            if other in graph:
+                res = self.findClosestFromPoint(self.getLocation(other), K)
+                self._setKnnList(other, [tuple(r) for r in res])
+
+
+    def _setKnnList(self, key, neighbours):
+        """
+        Set the list of nearest neighbours of key, or remove it
+        if neighbours is None, keeping the reverse index, the short
+        lists and the heap of Kth distances consistent.
+        Outdated entries of the heap are dropped lazily.
+        """
+        K, graph, reverse = self._knn['K'], self._knn['graph'], self._knn['reverse']
+        short, kth = self._knn['short'], self._knn['kth']
+
+        for _, other in graph.pop(key, []):
+            if other in reverse:
+                reverse[other].discard(key)
+
+        short.discard(key)
+
+        if neighbours is None:
+            return
+
+        graph[key] = neighbours
+
+        for _, other in neighbours:
+            reverse.setdefault(other, set()).add(key)
+
+        if len(neighbours) < K:
+            short.add(key)
+            return
+
+        heapq.heappush(kth, (-neighbours[-1][0], key))
+
+        if len(kth) > 2 * len(graph) + K:
+            # Too many outdated entries
+            kth[:] = [(-n[-1][0], k) for k, n in graph.iteritems() if len(n) == K]
+            heapq.heapify(kth)
+
+
+    def _knnEntrants(self, key, lat_lng):
+        """
+        Find the lists of neighbours key may enter at lat_lng, those
+        whose Kth distance is at least the distance to key, and the
+        lists shorter than K. Things are explored by increasing
+        distance, and once few lists have a Kth distance larger than
+        the explored distance, those lists are checked one by one.
+        """
+        K, graph = self._knn['K'], self._knn['graph']
+
+        def enters(dist, other):
+            neighbours = graph.get(other)
+
+            if neighbours is None or other == key:
+                return False
+
+            return len(neighbours) < K or (dist, key) < tuple(neighbours[-1])
+
+        entrants = set(other for other in self._knn['short'] if other != key)
+        scanned  = 0
+        check    = 1
+
+        for dist, other in self.iterClosestFromPoint(lat_lng):
+            if enters(dist, other):
+                entrants.add(other)
+
+            scanned += 1
+
+            if scanned < check:
+                continue
+
+            check *= 2
+
+            # Things not explored yet are farther than dist
+            farther = self._knnFarther(dist, scanned)
+
+            if farther is not None:
+                for other in farther:
+                    if enters(haversine(lat_lng, self.getLocation(other)), other):
+                        entrants.add(other)
+                break
+
+        return entrants
+
+
+    def _knnFarther(self, dist, limit):
+        """
+        The keys of the lists whose Kth distance is at least dist, or None
+        if there are more than limit. The heap of Kth distances is walked
+        from the top, some of the keys found may be outdated entries.
+        """
+        kth   = self._knn['kth']
+        found = set()
+        stack = [0]
+
+        while stack:
+            i = stack.pop()
+
+            if i >= len(kth) or -kth[i][0] < dist:
+                continue
+
+            found.add(kth[i][1])
+
+            if len(found) > limit:
+                return None
+
+            stack.extend((2 * i + 1, 2 * i + 2))
+
+        return found
+
+
+    def iterClosestFromPoint(self, lat_lng, from_keys=None, grid=True, conditions=None):
+        """
+        Yields the closest things from a point, by increasing distance.
+        Results are computed lazily, so the caller can stop after any
+        number of results, or at a distance cutoff.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform the search.
+        :param grid:    boolean, use grid or not
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> from itertools import islice, takewhile
+        >>> list(islice(geo_a.iterClosestFromPoint((43.70, 7.26)), 3)) # Nice
+        [(5.82..., 'NCE'), (30.28..., 'CEQ'), (79.71..., 'ALL')]
+        >>> list(takewhile(lambda r: r[0] < 50, geo_a.iterClosestFromPoint((43.70, 7.26))))
+        [(5.82..., 'NCE'), (30.28..., 'CEQ')]
+        >>> list(islice(geo_a.iterClosestFromPoint((43.70, 7.26), grid=False), 3))
+        [(5.82..., 'NCE'), (30.28..., 'CEQ'), (79.71..., 'ALL')]
+        >>> list(geo_t.iterClosestFromPoint((43.70, 7.26), from_keys=['frpaz', 'frbve']))
+        [(482.84..., 'frbve'), (683.89..., 'frpaz')]
+        """
+        if lat_lng is None:
+            raise StopIteration
+
+        if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=True)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is not None:
+            for dist, thing in index.iterClosestFromPoint(lat_lng, from_keys):
+                yield (dist, thing)
+
+        elif HAS_NUMPY_SUPPORT:
+            keys, dists = self._computeDistances(lat_lng, from_keys)
+
+            for i in np.lexsort((keys, dists)) if keys else []:
+                yield (float(dists[i]), keys[i])
+
+        else:
+            for dist, thing in sorted(self._buildDistances(lat_lng, from_keys)):
+                yield (dist, thing)
+
+
+
+    def iterClosestFromKey(self, key, from_keys=None, grid=True, conditions=None):
+        """
+        Same as iterClosestFromPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+
+        :param key:       the key of the thing (like 'SFO')
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform the search.
+        :param grid:    boolean, use grid or not
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> from itertools import islice
+        >>> list(islice(geo_a.iterClosestFromKey('ORY'), 3))
+        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
+        """
+        for dist, thing in self.iterClosestFromPoint(self.getLocation(key), from_keys, grid, conditions):
+            yield (dist, thing)
+
+
+
+    def findNearPoints(self, points, radius=50, from_keys=None, grid=True, double_check=True,
+                       conditions=None, processes=None, pool=None):
+        """
+        Same as findNearPoint, for many points at once.
+        With the grid, points in the same case share their candidates.
+
+        :param points:  an iterable of lat_lng, like a list of tuples, or an array
+        :param radius:  the radius of the search (kilometers)
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform search.
+        :param grid:    boolean, use grid or not
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :param processes: if more than 1, points are split among this number of processes
+        :param pool:    if not None, a pool of processes opened with _openPool, used \
+            instead of opening one for this call
+        :returns:       a list of results aligned with points, as lists of (distance, key)
+
+        >>> paris, nice = (48.84, 2.367), (43.70, 7.26)
+        >>> [sorted(r) for r in geo_a.findNearPoints([paris, nice, None], 30)]
+        [[(12.76..., 'ORY'), (15.38..., 'LBG'), (21.46..., 'TNF'), (23.40..., 'CDG')], [(5.82..., 'NCE')], []]
+        >>> geo_a.findNearPoints([paris, nice], 30, grid=False, from_keys=['NCE', 'CDG'])
+        [[(23.40..., 'CDG')], [(5.82..., 'NCE')]]
+        >>> geo_a.findNearPoints([paris, nice], 30, processes=2) == geo_a.findNearPoints([paris, nice], 30)
+        True
+        """
+        points = _toPoints(points)
+
+        if from_keys is not None:
+            # The same keys are used for each point
+            from_keys = list(from_keys)
+
+        if pool is not None or (processes is not None and processes > 1):
+            return self._mapProcesses('findNearPoints', points, processes, pool,
+                                      radius=radius, from_keys=from_keys,
+                                      grid=grid, double_check=double_check,
+                                      conditions=conditions)
+
+        if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=False)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is None:
+            return [list(self.findNearPoint(p, radius, from_keys, False, double_check)) for p in points]
+
+        results = index.findNearPoints(points, radius, double_check)
+
+        if from_keys is not None:
+            # Using grid, from_keys if just a post-filter
+            results = [[(d, k) for d, k in res if k in from_keys] for res in results]
+
+        return results
+
+
+
+    def findClosestFromPoints(self, points, N=1, from_keys=None, grid=True, double_check=True,
+                              conditions=None, processes=None, pool=None):
+        """
+        Same as findClosestFromPoint, for many points at once.
+        With the grid, points in the same case share their candidates.
+
+        :param points:    an iterable of lat_lng, like a list of tuples, or an array
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param grid:    boolean, use grid or not
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :param conditions: if not None, a list of (field, value) conditions, like \
+            for getKeysWhere, to search only the matching keys, with a cached sub-grid
+        :param processes: if more than 1, points are split among this number of processes
+        :param pool:    if not None, a pool of processes opened with _openPool, used \
+            instead of opening one for this call
+        :returns:       a list of results aligned with points, as lists of (distance, key)
+
+        >>> paris, nice = (48.84, 2.367), (43.70, 7.26)
+        >>> geo_a.findClosestFromPoints([paris, nice, None])
+        [[(12.76..., 'ORY')], [(5.82..., 'NCE')], []]
+        >>> geo_a.findClosestFromPoints([paris, nice], N=2, grid=False, from_keys=['NCE', 'CDG', 'ORY'])
+        [[(12.76..., 'ORY'), (23.40..., 'CDG')], [(5.82..., 'NCE'), (673.78..., 'ORY')]]
+        >>> geo_t.findClosestFromPoints([nice] * 3, processes=2)
+        [[(0.56..., 'frnic')], [(0.56..., 'frnic')], [(0.56..., 'frnic')]]
+        """
+        points = _toPoints(points)
+
+        if from_keys is not None:
+            # The same keys are used for each point
+            from_keys = list(from_keys)
+
+        if pool is not None or (processes is not None and processes > 1):
+            return self._mapProcesses('findClosestFromPoints', points, processes, pool,
+                                      N=N, from_keys=from_keys,
+                                      grid=grid, double_check=double_check,
+                                      conditions=conditions)
+
+        if grid:
+            index, from_keys = self._planSearch(from_keys, conditions, closest=True)
+        else:
+            index, from_keys = None, self._keysWhere(from_keys, conditions)
+
+        if index is None:
+            return [list(self.findClosestFromPoint(p, N, from_keys, False, double_check)) for p in points]
+
+        return index.findClosestFromPoints(points, N, double_check, from_keys)
+
+
+
+    def spatialJoin(self, other, N=1, radius=None, from_keys=None, to_keys=None,
+                    grid=True, double_check=True, processes=None):
+        """
+        Map the things of this base to their closest things in another base.
+        Keys are processed by chunks of nearby points, using the batch methods
+        of the other base, and results are streamed.
+
+        :param other:     the other base
+        :param N:         the N closest results wanted for each key, if None \
+            all results within radius are given
+        :param radius:    if not None, results farther than radius (kilometers) are dropped
+        :param from_keys: if None, it takes all keys of this base, else takes from_keys
+        :param to_keys:   if None, it takes all keys of the other base, else takes to_keys
+        :param grid:      boolean, use grid or not
+        :param double_check: when using grid, perform an additional check on results distance
+        :param processes: if more than 1, each chunk is split among this number of processes
+        :raises:          ValueError, if both N and radius are None
+        :returns:         an iterable of (key, other key, distance)
+
+        >>> list(geo_t.spatialJoin(geo_a, from_keys=['frnic', 'frpaz', 'frxxx']))
+        [('frnic', 'NCE', 6.35...), ('frpaz', 'ORY', 12.82...)]
+        >>> list(geo_t.spatialJoin(geo_a, N=None, radius=30, from_keys=['frpaz']))
+        [('frpaz', 'ORY', 12.82...), ...]
+        >>> list(geo_t.spatialJoin(geo_a, N=2, from_keys=['frnic'], to_keys=['ORY', 'CDG', 'NCE']))
+        [('frnic', 'NCE', 6.35...), ('frnic', 'ORY', 673.42...)]
+        """
+        if N is None and radius is None:
+            raise ValueError('N and radius cannot both be None.')
+
+        if from_keys is None:
+            from_keys = iter(self)
+
+        if to_keys is not None:
+            to_keys = list(to_keys)
+
+        # Sorting by cell puts nearby points in the same chunks
+        located = []
+
+        for key in from_keys:
+            lat_lng = self.getLocation(key)
+
+            if lat_lng is None:
+                continue
+
+            try:
+                cell = encode_cell(lat_lng[0], lat_lng[1], 5)
+            except ValueError:
+                # Invalid coordinates, left to the other base
+                cell = -1
+
+            located.append((cell, key, lat_lng))
+
+        located.sort()
+
+        size = JOIN_CHUNK if processes is None else JOIN_CHUNK * processes
+
+        # The same pool is used for all chunks
+        pool = other._openPool(processes)
+
+        try:
+            for i in xrange(0, len(located), size):
+                chunk  = located[i:i + size]
+                points = [lat_lng for _, _, lat_lng in chunk]
+
+                if N is None:
+                    results = other.findNearPoints(points, radius, to_keys, grid, double_check,
+                                                   processes=processes, pool=pool)
+                else:
+                    results = other.findClosestFromPoints(points, N, to_keys, grid, double_check,
+                                                          processes=processes, pool=pool)
 
-        >>> list(geo_a.findClosestFromKey('ORY')) # Orly
-        [(0.0, 'ORY')]
-        >>> list(geo_a.findClosestFromKey('ORY', N=3))
-        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
-        >>> # Corner case, from_keys empty is not used
-        >>> list(geo_t.findClosestFromKey('ORY', N=2, from_keys=()))
-        []
-        >>> list(geo_t.findClosestFromKey(None, N=2))
-        []
-        >>> #from datetime import datetime
-        >>> #before = datetime.now()
-        >>> #for _ in range(100): s = geo_a.findClosestFromKey('NCE', N=3)
-        >>> #print(datetime.now() - before)
+                for (_, key, _), res in izip(chunk, results):
+                    for dist, other_key in sorted(res):
+                        if radius is None or dist <= radius:
+                            yield (key, other_key, dist)
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
 
-        No grid.
 
-        >>> list(geo_o.findClosestFromKey('ORY', grid=False)) # Nice
-        [(0.0, 'ORY')]
-        >>> list(geo_a.findClosestFromKey('ORY', N=3, grid=False)) # Nice
-        [(0.0, 'ORY'), (18.80..., 'TNF'), (27.80..., 'LBG')]
-        >>> list(geo_t.findClosestFromKey('frnic', N=1, grid=False)) # Nice
-        [(0.0, 'frnic')]
-        >>> list(geo_t.findClosestFromKey('frnic', N=2, grid=False, from_keys=('frpaz', 'frply', 'frbve')))
-        [(482.79..., 'frbve'), (683.52..., 'frpaz')]
+
+    def _openPool(self, processes):
         """
-        if from_keys is None:
-            from_keys = iter(self)
+        Open a pool of processes working on this base, or None if
+        processes is not more than 1. Workers get the base when they
+        are forked, so this requires the fork start method, which is
+        not available on Windows, where None is returned as well, and
+        the work is done in the calling process.
+        """
+        if processes is None or processes <= 1 or sys.platform == 'win32':
+            return None
 
-        if grid:
-            for dist, thing in self._ggrid.findClosestFromKey(key, N, double_check, from_keys):
-                yield (dist, thing)
+        return multiprocessing.Pool(processes, initializer=_poolInit, initargs=(self,))
+
+
+    def _mapProcesses(self, method, points, processes, pool=None, **kwargs):
+        """
+        Split points in chunks, and call a batch method on each
+        chunk in a pool of processes. Results are concatenated.
+        If no pool is given, one is opened for this call.
+        """
+        own = pool is None
+
+        if own:
+            pool = self._openPool(processes)
+
+        if pool is None:
+            # No fork support
+            return getattr(self, method)(points, **kwargs)
+
+        # Several chunks per process, for balance
+        size   = max(1, -(-len(points) // (4 * (processes or 1))))
+        chunks = [(method, points[i:i + size], kwargs) for i in xrange(0, len(points), size)]
+
+        try:
+            results = pool.map(_poolWorker, chunks)
+        finally:
+            if own:
+                pool.close()
+                pool.join()
+
+        return [res for chunk_results in results for res in chunk_results]
 
-        else:
-            for dist, thing in self.findClosestFromPoint(self.getLocation(key), N, from_keys, grid, double_check):
-                yield (dist, thing)
 
 
     def _buildRatios(self, fuzzy_value, field, keys, min_match=0):
@@ -1324,6 +3844,12 @@ class GeoBase(object):
 
             self._cache_fuzzy[entry] = match
 
+            # Indexed to drop outdated entries after changes
+            self._fuzzy_by_field.setdefault(entry[1], set()).add(entry)
+
+            for _, key in match:
+                self._fuzzy_by_key.setdefault(key, set()).add(entry)
+
             # Debug purpose
             if verbose:
                 self._debugFuzzy(match, fuzzy_value, field, show_bad)
@@ -1357,7 +3883,9 @@ class GeoBase(object):
     def clearCache(self):
         """Clear cache for fuzzy searches.
         """
-        self._cache_fuzzy = {}
+        self._cache_fuzzy    = {}
+        self._fuzzy_by_field = {}
+        self._fuzzy_by_key   = {}
 
 
     def clearBiasCache(self):
@@ -1397,6 +3925,9 @@ class GeoBase(object):
 
         This is just a wrapper between the original haversine
         function, but it is probably the most used feature :)
+        Distances are read from the precomputed matrix, see
+        precomputeDistances, or kept in a bounded cache dropping
+        the least recently used pairs.
 
         :param key0: the first key
         :param key1: the second key
@@ -1404,8 +3935,208 @@ class GeoBase(object):
 
         >>> geo_t.distance('frnic', 'frpaz')
         683.526...
+        >>> geo_t.distance('frpaz', 'frnic')
+        683.526...
+        """
+        matrix = self._dist_matrix
+
+        if matrix is not None and key0 in matrix[0] and key1 in matrix[0]:
+            self._dist_stats['hits'] += 1
+            return matrix[1][matrix[0][key0]][matrix[0][key1]]
+
+        # Distances are symmetric
+        pair = (key0, key1) if key0 <= key1 else (key1, key0)
+        dist = self._cache_dist.get(pair)
+
+        if dist is not None:
+            self._dist_stats['hits'] += 1
+            return dist
+
+        self._dist_stats['misses'] += 1
+        dist = haversine(self.getLocation(key0), self.getLocation(key1))
+
+        # Unknown locations are not cached
+        if dist is not None:
+            evicted = self._cache_dist.put(pair, dist)
+
+            for key in pair:
+                self._dist_pairs.setdefault(key, set()).add(pair)
+
+            if evicted is not None:
+                for key in set(evicted):
+                    pairs = self._dist_pairs[key]
+                    pairs.discard(evicted)
+                    if not pairs:
+                        del self._dist_pairs[key]
+
+        return dist
+
+
+    def precomputeDistances(self, keys):
+        """Precompute the distances between some keys, as a
+        symmetric matrix used by distance. Keys without valid
+        geocodes are ignored.
+
+        :param keys: an iterable of keys, like a working set of cities
+        :returns:    None
+
+        >>> geo_a.precomputeDistances(['ORY', 'CDG', 'NCE', 'not_a_key'])
+        >>> geo_a.distance('CDG', 'NCE')
+        694.5162...
+        >>> geo_a.distanceCacheInfo()['precomputed']
+        3
+        >>> geo_a.clearDistanceCache()
+        """
+        keys = [k for k in keys if self.getLocation(k) is not None]
+        locs = [self.getLocation(k) for k in keys]
+
+        if HAS_NUMPY_SUPPORT and keys:
+            lats, lngs = np.array(locs, dtype=np.float64).T
+            matrix = haversine_matrix(lats, lngs, lats, lngs).tolist()
+        else:
+            matrix = [[haversine(l0, l1) for l1 in locs] for l0 in locs]
+
+        self._dist_matrix = dict((k, i) for i, k in enumerate(keys)), matrix
+
+
+    def distanceMatrix(self, keys_a, keys_b=None, dtype='float64', filename=None, chunk=DISTANCE_CHUNK):
+        """Compute the distances between all pairs of keys from
+        two lists, as a NumPy array. Rows are computed by chunks
+        to bound the memory used. Keys without valid geocodes,
+        or not in the base, have nan distances.
+        This requires NumPy.
+
+        :param keys_a:   an iterable of keys, for the rows
+        :param keys_b:   an iterable of keys, for the columns, \
+            if None, keys_a is used
+        :param dtype:    the type of the distances, float32 halves the size
+        :param filename: if not None, the matrix is written in this \
+            .npy file, and returned as a memory-mapped array
+        :param chunk:    the number of distances computed together
+        :raises:         ImportError, without NumPy support
+        :returns:        the matrix of distances (km)
+
+        >>> if geo_a.hasNumpySupport():
+        ...     m = geo_a.distanceMatrix(['ORY', 'CDG', 'XXX'], ['NCE', 'ORY'])
+        ...     print m.shape, m.round(1).tolist()
+        (3, 2) [[675.8, 0.0], [694.5, 34.9], [nan, nan]]
+        >>> if geo_a.hasNumpySupport():
+        ...     m = geo_a.distanceMatrix(['ORY', 'CDG'], dtype='float32', chunk=1)
+        ...     print m.dtype, m.astype('float64').round(1).tolist()
+        float32 [[0.0, 34.9], [34.9, 0.0]]
+        """
+        if not HAS_NUMPY_SUPPORT:
+            raise ImportError('NumPy is required for distance matrices.')
+
+        keys_a = list(keys_a)
+        keys_b = keys_a if keys_b is None else list(keys_b)
+
+        _, positions, lats, lngs = self._getCoordinates()
+
+        def locations(keys):
+            # Missing locations are nan, giving nan distances
+            idx = np.array([positions.get(k, -1) for k in keys], dtype=np.intp)
+
+            if not len(lats):
+                return np.nan * np.ones(len(keys)), np.nan * np.ones(len(keys))
+
+            lats_k = np.where(idx >= 0, lats[idx], np.nan)
+            lngs_k = np.where(idx >= 0, lngs[idx], np.nan)
+
+            return lats_k, lngs_k
+
+        lats_a, lngs_a = locations(keys_a)
+        lats_b, lngs_b = locations(keys_b)
+
+        shape = (len(keys_a), len(keys_b))
+
+        if filename is None:
+            matrix = np.empty(shape, dtype=dtype)
+        else:
+            matrix = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+
+        step = max(1, int(chunk) // max(1, len(keys_b)))
+
+        for i in xrange(0, len(keys_a), step):
+            matrix[i:i + step] = haversine_matrix(lats_a[i:i + step], lngs_a[i:i + step],
+                                                  lats_b, lngs_b)
+
+        if filename is not None:
+            matrix.flush()
+
+        return matrix
+
+
+    def distanceCacheInfo(self):
+        """Get the statistics of the cache of distances.
+
+        :returns: a dict with the hits and misses counters, the \
+            number of cached pairs and precomputed keys
+
+        >>> geo_t.clearDistanceCache()
+        >>> geo_t.distance('frnic', 'frpaz')
+        683.526...
+        >>> geo_t.distance('frnic', 'frpaz')
+        683.526...
+        >>> sorted(geo_t.distanceCacheInfo().items())
+        [('hits', 1), ('max_size', 100000), ('misses', 1), ('precomputed', 0), ('size', 1)]
+        >>> geo_t.clearDistanceCache()
+        """
+        return {
+            'hits'        : self._dist_stats['hits'],
+            'misses'      : self._dist_stats['misses'],
+            'size'        : len(self._cache_dist),
+            'max_size'    : self._cache_dist.max_size,
+            'precomputed' : len(self._dist_matrix[0]) if self._dist_matrix else 0,
+        }
+
+
+    def clearDistanceCache(self):
+        """Clear the cache of distances, the precomputed
+        distances, and reset the counters.
+        """
+        self._cache_dist.clear()
+        self._dist_pairs  = {}
+        self._dist_matrix = None
+        self._dist_stats  = {'hits': 0, 'misses': 0}
+
+
+    def _dropDistanceCache(self, key):
+        """Drop the distances which are outdated after
+        the location of key changed, or key was deleted.
+        The row of key in the precomputed matrix is computed
+        again, or the key is dropped from the matrix.
+
+        >>> geo_t.distance('frnic', 'frpaz')
+        683.526...
+        >>> geo_t._dropDistanceCache('frnic')
+        >>> geo_t.distanceCacheInfo()['size']
+        0
+        >>> geo_t.clearDistanceCache()
         """
-        return haversine(self.getLocation(key0), self.getLocation(key1))
+        for pair in self._dist_pairs.pop(key, ()):
+            self._cache_dist.pop(pair)
+
+            for other in pair:
+                if other != key:
+                    self._dist_pairs[other].discard(pair)
+                    if not self._dist_pairs[other]:
+                        del self._dist_pairs[other]
+
+        if self._dist_matrix is None or key not in self._dist_matrix[0]:
+            return
+
+        positions, matrix = self._dist_matrix
+        lat_lng = self.getLocation(key)
+
+        if lat_lng is None:
+            del positions[key]
+            return
+
+        i = positions[key]
+
+        for k, j in positions.iteritems():
+            matrix[i][j] = matrix[j][i] = haversine(lat_lng, self.getLocation(k))
 
 
     def set(self, key, field, value):
@@ -1428,6 +4159,23 @@ class GeoBase(object):
         >>> geo_t.set('frnic', 'new_field', 'some_value')
         >>> geo_t.get('frnic', 'new_field')
         'some_value'
+
+        Rows shared with views are copied once, before their first change,
+        and changes of views do not change the other base.
+
+        >>> geo_w = GeoBase(data='stations', verbose=False)
+        >>> geo_x = GeoBase(data='stations', view_of=geo_w, verbose=False)
+        >>> row = geo_w._things['frnic']
+        >>> geo_w.set('frnic', 'name', 'Nice')
+        >>> geo_w._things['frnic'] is row, row['name']
+        (False, 'Nice-Ville')
+        >>> row = geo_w._things['frnic']
+        >>> geo_w.set('frnic', 'name', 'Nizza')
+        >>> geo_w._things['frnic'] is row
+        True
+        >>> geo_x.set('frpaz', 'name', 'Paris')
+        >>> geo_w.get('frpaz', 'name'), geo_x.get('frpaz', 'name')
+        ('Paris-Austerlitz', 'Paris')
         """
         # If the key is not in the base,
         # we simply add it
@@ -1440,8 +4188,26 @@ class GeoBase(object):
                 '__par__' : [],       # special field for parent
             }
 
+            if self._has_views:
+                self._own_rows.add(key)
+        else:
+            self._unindexThing(key, field)
+
+            if self._has_views and key not in self._own_rows:
+                # Views keep the shared row unchanged
+                self._things[key] = dict(self._things[key])
+                self._own_rows.add(key)
+
         self._things[key][field] = value
 
+        # Indexes are updated in place, no rebuild needed
+        self._indexThing(key, field)
+        self._updateSpatialIndexes(key, field)
+        self._dropFuzzyCache(field=field)
+
+        if field in GEO_FIELDS:
+            self._dropDistanceCache(key)
+
         # If the field was not referenced in the headers
         # we add it to the headers
         if field not in self.fields:
@@ -1485,7 +4251,169 @@ class GeoBase(object):
         >>> geo_t.get('frxrn', 'name')
         'Redon'
         """
+        self._unindexThing(key)
+
         del self._things[key]
+        self._own_rows.discard(key)
+
+        # Indexes are updated in place, no rebuild needed
+        self._updateSpatialIndexes(key)
+        self._dropFuzzyCache(key=key)
+        self._dropDistanceCache(key)
+
+
+    def _updateSpatialIndexes(self, key, field=None):
+        """Update the grid, the coordinates arrays and the sub-grids
+        after a thing was changed on field, or deleted if field is None.
+        The thing is moved, or removed if it has no location anymore.
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> list(geo_s.findClosestFromPoint((0, 0)))
+        [(4515.72..., 'spmad')]
+        >>> geo_s._things['frnic'][LAT_FIELD] = '0.01'
+        >>> geo_s._updateSpatialIndexes('frnic', LAT_FIELD)
+        >>> list(geo_s.findClosestFromPoint((0, 0)))
+        [(807.49..., 'frnic')]
+        """
+        if key in self._things:
+            lat_lng = self.getLocation(key)
+        else:
+            lat_lng = None
+
+        if field is None or field in GEO_FIELDS:
+            if self._ggrid is not None:
+                if lat_lng is None:
+                    self._ggrid.remove(key)
+                else:
+                    self._ggrid.add(key, lat_lng, False)
+
+            self._moveCoordinates(key, lat_lng)
+
+        for conditions, index in self._subgrids.itervalues():
+
+            if field is not None and field not in GEO_FIELDS and \
+                    field not in [f for f, _ in conditions]:
+                continue
+
+            if lat_lng is not None and any(True for _ in self.getKeysWhere(conditions, from_keys=[key])):
+                index.add(key, lat_lng, False)
+            else:
+                index.remove(key)
+
+        # Scores are computed again when needed
+        if field is None or field in GEO_FIELDS:
+            self._updateKnnGraph(key)
+            self._scores.clear()
+        else:
+            self._scores.pop(field, None)
+
+        self._dropReverseCells(key, field)
+
+
+    def _dropReverseCells(self, key, field=None):
+        """Drop the candidates of reverse geocoding which may be outdated
+        after key was changed on field, or deleted if field is None.
+        Those are the cells where key is a candidate, and the cells
+        where it is within the distance of candidates at its new location.
+
+        >>> geo_s = GeoBase(data='stations', verbose=False)
+        >>> geo_s.reverseGeocode((43.70, 7.26))
+        (0.56..., 'frnic', [])
+        >>> geo_s.reverseGeocode((48.84, 2.37))
+        (0.22..., 'frpaz', [])
+        >>> len(geo_s._reverse_cells)
+        2
+
+        Moving frnic drops only the cell of Nice, then moving it
+        near the cell of Paris drops this one too.
+
+        >>> geo_s.set('frnic', LAT_FIELD, '48.85')
+        >>> len(geo_s._reverse_cells), geo_s._reverse_by_key.get('frnic')
+        (1, None)
+        >>> geo_s.set('frnic', LNG_FIELD, '2.37')
+        >>> len(geo_s._reverse_cells)
+        0
+        >>> geo_s.reverseGeocode((48.84, 2.37))
+        (0.22..., 'frpaz', [])
+        """
+        lat_lng = self.getLocation(key) if key in self._things else None
+        entries = set()
+
+        for cache_key, info in self._reverse_grids.items():
+            conditions = info['conditions']
+
+            if field is not None and field not in GEO_FIELDS and \
+                    (conditions is None or field not in [f for f, _ in conditions]):
+                continue
+
+            entries.update(e for e in self._reverse_by_key.get(key, ()) if e[0] == cache_key)
+
+            if lat_lng is None:
+                continue
+
+            for dist, cell in info['grid'].findNearPoint(lat_lng, info['limit'], True):
+                cached = self._reverse_cells.get((cache_key, cell))
+
+                if cached is not None and dist <= cached[1]:
+                    entries.add((cache_key, cell))
+
+        for entry in entries:
+            self._dropReverseCell(entry)
+
+
+    def _dropReverseCell(self, entry):
+        """Drop the candidates of reverse geocoding of an
+        entry (conditions key, cell), and their references.
+        """
+        cached = self._reverse_cells.pop(entry)
+
+        if cached is None:
+            return
+
+        cache_key, cell = entry
+        info = self._reverse_grids[cache_key]
+        info['grid'].remove(cell)
+
+        if not info['grid']._keys:
+            del self._reverse_grids[cache_key]
+
+        for key, _ in cached[2]:
+            self._reverse_by_key[key].discard(entry)
+
+            if not self._reverse_by_key[key]:
+                del self._reverse_by_key[key]
+
+
+    def _dropFuzzyCache(self, key=None, field=None):
+        """Drop the fuzzy searches results which may be outdated,
+        those on field, and those containing key. The biasing cache
+        is left untouched, it is user input.
+
+        >>> geo_s = GeoBase(data='airports', verbose=False)
+        >>> geo_s.fuzzyGetCached('paris de gaulle', 'name', verbose=False)
+        [(0.78..., 'CDG')]
+        >>> geo_s._dropFuzzyCache(key='ORY')
+        >>> len(geo_s._cache_fuzzy), len(geo_s._fuzzy_by_key['CDG'])
+        (1, 1)
+        >>> geo_s._dropFuzzyCache(key='CDG')
+        >>> geo_s._cache_fuzzy, geo_s._fuzzy_by_field, geo_s._fuzzy_by_key
+        ({}, {}, {})
+        """
+        entries = self._fuzzy_by_field.pop(field, set()) | self._fuzzy_by_key.pop(key, set())
+
+        for entry in entries:
+            match = self._cache_fuzzy.pop(entry, None)
+
+            if match is None:
+                continue
+
+            # Other references to the entry
+            for index, k in [(self._fuzzy_by_field, entry[1])] + [(self._fuzzy_by_key, k) for _, k in match]:
+                if k in index:
+                    index[k].discard(entry)
+
+                    if not index[k]:
+                        del index[k]
 
 
     @staticmethod
@@ -1495,6 +4423,13 @@ class GeoBase(object):
         return HAS_TREP_SUPPORT
 
 
+    @staticmethod
+    def hasNumpySupport():
+        """Check if module has NumPy support.
+        """
+        return HAS_NUMPY_SUPPORT
+
+
     @staticmethod
     def trepGet(fuzzy_value, trep_format='S', from_keys=None, verbose=False):
         """OpenTrep integration.
@@ -1856,6 +4791,194 @@ class GeoBase(object):
 
 
 
+class _ViewRow(DictMixin, object):
+    """Row of a base loaded as a view of another base.
+
+    Fields specific to the view, like __key__, __dup__ and __par__,
+    or fields changed with set, are stored in the row, other fields
+    are read from the row shared with the other base.
+
+    >>> row = _ViewRow({'__key__': 'ORY', 'name': 'Paris-Orly'}, 'FR+ORY')
+    >>> row['__key__'], row['name']
+    ('FR+ORY', 'Paris-Orly')
+    >>> sorted(row.keys())
+    ['__dup__', '__key__', '__par__', 'name']
+    """
+    __slots__ = ('_own', '_shared')
+
+    def __init__(self, shared, key):
+
+        self._shared = shared
+        self._own = {
+            '__key__' : key, # special field for key
+            '__dup__' : [],  # special field for duplicates
+            '__par__' : [],  # special field for parent
+        }
+
+    def __getitem__(self, field):
+        if field in self._own:
+            return self._own[field]
+        return self._shared[field]
+
+    def __setitem__(self, field, value):
+        self._own[field] = value
+
+    def __delitem__(self, field):
+        del self._own[field]
+
+    def __contains__(self, field):
+        return field in self._own or field in self._shared
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        return self._shared.keys() + [f for f in self._own if f not in self._shared]
+
+
+
+# Sizes of the entries of indexes and caches, for memory estimations
+_ENTRY_SIZE = tuple.__itemsize__
+_INT_SIZE   = sys.getsizeof(1 << 20)
+_FLOAT_SIZE = sys.getsizeof(0.0)
+_PAIR_SIZE  = sys.getsizeof((0, 0))
+_LINK_SIZE  = sys.getsizeof([None] * 4)
+
+
+def _estimateIndex(index):
+    """Estimate the memory used by a spatial index, in bytes,
+    from the size of one of its entries.
+
+    >>> g = GeoGrid(verbose=False)
+    >>> _estimateIndex(g) < _estimateIndex(None) + 1
+    True
+    >>> g.add('ORY', (48.72, 2.36), False)
+    >>> _estimateIndex(g) > 0
+    True
+    """
+    if index is None or not index._keys:
+        return 0
+
+    entry = next(index._keys.itervalues())
+    entry = sys.getsizeof(entry) + sum(sys.getsizeof(v) for v in entry.itervalues())
+
+    # Entries are referenced once more in the cases, nodes or leaves
+    return len(index._keys) * (entry + 3 * _ENTRY_SIZE)
+
+
+
+class _LRUCache(object):
+    """Bounded mapping, dropping the least recently used entries.
+
+    Entries are links of a circular doubly linked list,
+    from the least to the most recently used.
+
+    >>> cache = _LRUCache(2)
+    >>> cache.put('a', 1), cache.put('b', 2), cache.get('a')
+    (None, None, 1)
+    >>> cache.put('c', 3) # b is the least recently used
+    'b'
+    >>> cache.keys(), cache.get('b'), len(cache)
+    (['a', 'c'], None, 2)
+    >>> cache.oldest()
+    'a'
+    """
+    __slots__ = ('max_size', '_links', '_root')
+
+    def __init__(self, max_size):
+
+        self.max_size = max_size
+        self._links   = {}
+
+        # Links are [previous, next, key, value]
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+
+    def __len__(self):
+        return len(self._links)
+
+    def __contains__(self, key):
+        return key in self._links
+
+    def get(self, key, default=None):
+        """Get a value, which becomes the most recently used.
+        """
+        link = self._links.get(key)
+
+        if link is None:
+            return default
+
+        # Unlinking, then linking before root
+        prev, next_, _, value = link
+        prev[1] = next_
+        next_[0] = prev
+
+        last = self._root[0]
+        last[1] = self._root[0] = link
+        link[0] = last
+        link[1] = self._root
+
+        return value
+
+    def put(self, key, value):
+        """Set a value, returns the key dropped to make room, if any.
+        """
+        if self.max_size <= 0:
+            return None
+
+        evicted = None
+
+        if key in self._links:
+            self.pop(key)
+
+        elif len(self._links) >= self.max_size:
+            evicted = self._root[1][2]
+            self.pop(evicted)
+
+        last = self._root[0]
+        last[1] = self._root[0] = self._links[key] = [last, self._root, key, value]
+
+        return evicted
+
+    def pop(self, key, default=None):
+        """Remove a key, returns its value.
+        """
+        link = self._links.pop(key, None)
+
+        if link is None:
+            return default
+
+        prev, next_, _, value = link
+        prev[1] = next_
+        next_[0] = prev
+
+        return value
+
+    def oldest(self):
+        """The least recently used key, None if empty.
+        """
+        return self._root[1][2]
+
+    def keys(self):
+        """Keys, from the least to the most recently used.
+        """
+        keys = []
+        link = self._root[1]
+
+        while link is not self._root:
+            keys.append(link[2])
+            link = link[1]
+
+        return keys
+
+    def clear(self):
+        """Remove all keys.
+        """
+        self._links.clear()
+        self._root[:] = [self._root, self._root, None, None]
+
+
+
 def ext_split(value, split):
     """Extended split function handling None and '' splitter.
 
@@ -1886,6 +5009,65 @@ def ext_split(value, split):
     return tuple(value.split(split))
 
 
+def _toPoints(points):
+    """Convert an iterable of coordinates to a list of (lat, lng).
+    None values are kept, for points without coordinates.
+
+    >>> _toPoints([(48.72, '2.359'), None])
+    [(48.72, 2.359), None]
+    """
+    return [None if p is None else (float(p[0]), float(p[1])) for p in points]
+
+
+def _is_in(value, values):
+    """Membership test, unhashable values are never found.
+
+    >>> _is_in('PAR', set(['PAR']))
+    True
+    >>> _is_in([], set(['PAR']))
+    False
+    """
+    try:
+        return value in values
+    except TypeError:
+        return False
+
+
+def _to_float(value):
+    """Float conversion, returning NaN for invalid values.
+
+    >>> _to_float('48.72')
+    48.72
+    >>> _to_float('')
+    nan
+    """
+    try:
+        return float(value)
+    except (ValueError, TypeError):
+        return float('nan')
+
+
+# Base used by the workers of process pools, see GeoBase._openPool
+# Workers are forked, so they get a copy of it
+_POOL_BASE = None
+
+
+def _poolInit(base):
+    """Set the base of a worker of a process pool.
+    """
+    global _POOL_BASE
+
+    _POOL_BASE = base
+
+
+def _poolWorker(args):
+    """Call a batch method of the pool base on a chunk of points.
+    """
+    method, chunk, kwargs = args
+
+    return getattr(_POOL_BASE, method)(chunk, **kwargs)
+
+
 def recursive_split(value, splits):
     """Recursive extended split.
 
@@ -9,23 +9,26 @@ to provide geographical indexation features.
     Setting grid precision to 4, avg radius to 20km
     >>> a.add('ORY', (48.72, 2.359))
     >>> a.add('CDG', (48.75, 2.361))
-    >>> list(a._findInAdjacentCases(encode(48.72, 2.359, a._precision), N=2))
+    >>> list(a._findInAdjacentCases(a._computeCaseId((48.72, 2.359)), N=2))
     ['ORY', 'CDG']
-    >>> a._keys['ORY']
-    {'case': 'u09t', 'lat_lng': (48.7..., 2.359)}
-    >>> neighbors('t0db')
-    ['t0d8', 't0e0', 't06z', 't06x', 't07p', 't0dc', 't0d9', 't0e1']
-    >>> list(a._recursiveFrontier('t0dbr', N=2))
-    [set(['t0dbr']), set(['t0e08', 't0e00', 't0dbn', 't0e02', 't0dbq', 't0dbp', 't0dbw', 't0dbx'])]
-    >>> list(a._recursiveFrontier('t0dbr', N=1))
-    [set(['t0dbr'])]
-    >>> sum(len(f) for f in a._recursiveFrontier('t0dbr', N=2))
+    >>> sorted(a._keys['ORY'].items())
+    [('case', 852281), ('lat_lng', (48.7..., 2.359)), ('rad', (0.85..., 0.04..., 0.65...))]
+    >>> cell_to_geohash(a._keys['ORY']['case'], a._precision)
+    'u09t'
+    >>> sorted(cell_to_geohash(c, 4) for c in a._ring(geohash_to_cell('t0db'), 1))
+    ['t06x', 't06z', 't07p', 't0d8', 't0d9', 't0dc', 't0e0', 't0e1']
+    >>> b = GeoGrid(precision=5, verbose=False)
+    >>> [sorted(cell_to_geohash(c, 5) for c in f) for f in b._recursiveFrontier(geohash_to_cell('t0dbr'), N=2)]
+    [['t0dbr'], ['t0dbn', 't0dbp', 't0dbq', 't0dbw', 't0dbx', 't0e00', 't0e02', 't0e08']]
+    >>> len(list(b._recursiveFrontier(geohash_to_cell('t0dbr'), N=1)))
+    1
+    >>> sum(len(f) for f in b._recursiveFrontier(geohash_to_cell('t0dbr'), N=2))
     9
-    >>> sum(len(f) for f in a._recursiveFrontier('t0dbr', N=3))
+    >>> sum(len(f) for f in b._recursiveFrontier(geohash_to_cell('t0dbr'), N=3))
     25
-    >>> sum(len(f) for f in a._recursiveFrontier('t0dbr', N=4))
+    >>> sum(len(f) for f in b._recursiveFrontier(geohash_to_cell('t0dbr'), N=4))
     49
-    >>> sum(len(f) for f in a._recursiveFrontier('t0dbr', N=5))
+    >>> sum(len(f) for f in b._recursiveFrontier(geohash_to_cell('t0dbr'), N=5))
     81
     >>> list(a.findNearKey('ORY', 20))
     [(0, 'ORY'), (0, 'CDG')]
@@ -38,15 +41,27 @@ to provide geographical indexation features.
 
 from __future__ import with_statement
 
+import heapq
 import itertools
-from geohash import encode, neighbors
+from math import pi, asin, sin, cos, floor
 
-from .GeoUtils import haversine
+from .GeoUtils import (haversine, haversine_vect, haversine_within, radians_cos,
+                       radian, unradian, EARTH_RADIUS, HAS_NUMPY_SUPPORT)
+from .GeoUtils import bbox_area, unwrap_polygon, polygon_area, point_in_area, box_in_area
+from .GeoUtils import circle_area
+from .GeoUtils import corridor_points, route_distances
+
+if HAS_NUMPY_SUPPORT:
+    import numpy as np
 
 
 # Max recursion when iterating on frontiers
 MAX_RECURSIVE_FRONTIER = 5000
 
+# Under this number of candidates, distances are
+# not vectorized, building arrays would cost more
+MIN_VECT_SIZE = 32
+
 # Thanks wikipedia
 # hash length | lat bits | lng bits | lat error | lng error | km error
 HASH_TO_ERROR = {
@@ -60,6 +75,180 @@ HASH_TO_ERROR = {
     8 : (20, 20, 0.000085, 0.00017, 0.019)
 }
 
+# Base 32 alphabet of geohashes, used for display
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+# Rings offsets are cached up to this ring
+MAX_CACHED_RING = 64
+
+_RING_OFFSETS = {}
+
+
+def _spread_bits(x):
+    """Insert a zero bit between each bit of a byte.
+    """
+    return sum(((x >> b) & 1) << (2 * b) for b in xrange(8))
+
+
+# Lookup tables on bytes, faster than bit tricks in Python
+_SPREAD  = [_spread_bits(x) for x in xrange(256)]
+_COMPACT = dict((v, x) for x, v in enumerate(_SPREAD))
+
+
+def _spread(x):
+    """Insert a zero bit between each bit of an integer,
+    up to 24 bits.
+    """
+    if x < 256:
+        return _SPREAD[x]
+
+    return _SPREAD[x & 255] | (_SPREAD[(x >> 8) & 255] << 16) | (_SPREAD[x >> 16] << 32)
+
+
+def _compact(x):
+    """Keep one bit out of two of an integer, inverse of _spread.
+    """
+    x &= 0x555555555555
+
+    return _COMPACT[x & 0x5555] | (_COMPACT[(x >> 16) & 0x5555] << 8) | (_COMPACT[x >> 32] << 16)
+
+
+def _bits(precision):
+    """Number of bits of latitude and longitude for a precision.
+    As for geohashes, longitude has the extra bit.
+    """
+    return 5 * precision // 2, (5 * precision + 1) // 2
+
+
+def interleave(i, j, precision):
+    """Build a cell from its latitude and longitude indexes,
+    interleaving bits in the same order as geohashes, longitude first.
+
+    :param i:         the latitude index, from south
+    :param j:         the longitude index, from west
+    :param precision: the geohash length
+    :returns:         the cell, as an integer
+
+    >>> deinterleave(interleave(5, 11, 4), 4)
+    (5, 11)
+    """
+    if precision % 2:
+        return _spread(j) | (_spread(i) << 1)
+
+    return (_spread(j) << 1) | _spread(i)
+
+
+def deinterleave(cell, precision):
+    """Latitude and longitude indexes of a cell.
+
+    :param cell:      the cell, as an integer
+    :param precision: the geohash length
+    :returns:         the tuple (i, j) of latitude and longitude indexes
+    """
+    if precision % 2:
+        return _compact(cell >> 1), _compact(cell)
+
+    return _compact(cell), _compact(cell >> 1)
+
+
+def encode_cell(lat, lng, precision):
+    """Compute the cell of a point, an integer with the
+    bits of its geohash, without building the string.
+
+    :param lat:       the latitude
+    :param lng:       the longitude
+    :param precision: the geohash length
+    :raises:          ValueError, for invalid coordinates
+    :returns:         the cell, as an integer
+
+    >>> encode_cell(48.72, 2.359, 4) == geohash_to_cell('u09t')
+    True
+    >>> encode_cell(91, 0, 4)
+    Traceback (most recent call last):
+    ValueError: Invalid coordinates (91, 0)
+    """
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise ValueError('Invalid coordinates (%s, %s)' % (lat, lng))
+
+    lat_bits, lng_bits = _bits(precision)
+
+    i = min(int((lat + 90) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    j = min(int((lng + 180) / 360.0 * (1 << lng_bits)), (1 << lng_bits) - 1)
+
+    return interleave(i, j, precision)
+
+
+def cell_bbox(cell, precision):
+    """Bounding box of a cell.
+
+    :param cell:      the cell, as an integer
+    :param precision: the geohash length
+    :returns:         the box, as a dictionary of bounds
+
+    >>> sorted(cell_bbox(geohash_to_cell('u09t'), 4).items())
+    [('e', 2.460...), ('n', 48.86...), ('s', 48.69...), ('w', 2.109...)]
+    """
+    lat_bits, lng_bits = _bits(precision)
+    i, j = deinterleave(cell, precision)
+
+    height = 180.0 / (1 << lat_bits)
+    width  = 360.0 / (1 << lng_bits)
+
+    return {
+        's' : i * height - 90,
+        'n' : (i + 1) * height - 90,
+        'w' : j * width - 180,
+        'e' : (j + 1) * width - 180
+    }
+
+
+def geohash_to_cell(geohash):
+    """Convert a geohash to a cell.
+
+    >>> geohash_to_cell('u09t')
+    852281
+    """
+    cell = 0
+
+    for c in geohash:
+        cell = (cell << 5) | BASE32.index(c)
+
+    return cell
+
+
+def cell_to_geohash(cell, precision):
+    """Convert a cell to a geohash, for display.
+
+    >>> cell_to_geohash(852281, 4)
+    'u09t'
+    """
+    return ''.join(BASE32[(cell >> (5 * k)) & 31] for k in reversed(xrange(precision)))
+
+
+def ring_offsets(k):
+    """Offsets (di, dj) of the cells at ring k around a cell,
+    that is at k cells in latitude or longitude. Offsets of
+    the first rings are cached.
+
+    >>> ring_offsets(0)
+    [(0, 0)]
+    >>> len(ring_offsets(1)), len(ring_offsets(2))
+    (8, 16)
+    """
+    if k in _RING_OFFSETS:
+        return _RING_OFFSETS[k]
+
+    if k == 0:
+        offsets = [(0, 0)]
+    else:
+        offsets  = [(di, dj) for di in (-k, k) for dj in xrange(-k, k + 1)]
+        offsets += [(di, dj) for di in xrange(-k + 1, k) for dj in (-k, k)]
+
+    if k <= MAX_CACHED_RING:
+        _RING_OFFSETS[k] = offsets
+
+    return offsets
+
 
 class GeoGrid(object):
     """
@@ -82,6 +271,11 @@ class GeoGrid(object):
         self._precision  = precision
         self._avg_radius = HASH_TO_ERROR[precision][4]
 
+        # Number of rows and columns of cases
+        lat_bits, lng_bits = _bits(precision)
+        self._rows = 1 << lat_bits
+        self._cols = 1 << lng_bits
+
         # Double mapping
         self._keys = {}
         self._grid = {}
@@ -97,18 +291,33 @@ class GeoGrid(object):
         :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
         :returns:       the case_id
         """
-        return encode(*lat_lng, precision=self._precision)
+        lat, lng = lat_lng
+
+        if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+            raise ValueError('Invalid coordinates (%s, %s)' % (lat, lng))
+
+        i = min(int((lat + 90) / 180.0 * self._rows), self._rows - 1)
+        j = min(int((lng + 180) / 360.0 * self._cols), self._cols - 1)
+
+        return interleave(i, j, self._precision)
 
 
 
     def add(self, key, lat_lng, verbose=True):
         """
-        Add a point to the grid.
+        Add a point to the grid. If the key is already
+        in the grid, the point is moved.
 
         :param key:     the key to be added
         :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
         :param verbose: toggle verbosity
         :returns:       None
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('ORY', (43.66, 7.21))
+        >>> [(cell_to_geohash(c, 4), keys) for c, keys in a._grid.items()]
+        [('spv0', ['ORY'])]
         """
         try:
             case_id = self._computeCaseId(lat_lng)
@@ -118,11 +327,18 @@ class GeoGrid(object):
             # Exception for invalid coordinates
             if verbose:
                 print 'Wrong coordinates %s for key %s, skipping point.' % (str(lat_lng), key)
+
+            # The previous location is not valid anymore
+            self.remove(key)
             return
 
+        if key in self._keys:
+            self.remove(key)
+
         self._keys[key] = {
             'case'    : case_id,
-            'lat_lng' : lat_lng
+            'lat_lng' : lat_lng,
+            'rad'     : radians_cos(lat_lng)
         }
 
         if case_id not in self._grid:
@@ -132,39 +348,104 @@ class GeoGrid(object):
 
 
 
+    def remove(self, key):
+        """
+        Remove a point from the grid. Unknown keys are ignored.
+
+        :param key: the key to be removed
+        :returns:   None
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.remove('ORY')
+        >>> a.remove('ORY')
+        >>> [(cell_to_geohash(c, 4), keys) for c, keys in a._grid.items()]
+        [('u09t', ['CDG'])]
+        >>> a.remove('CDG')
+        >>> a._grid
+        {}
+        """
+        if key not in self._keys:
+            return
+
+        case_id = self._keys.pop(key)['case']
+
+        self._grid[case_id].remove(key)
+
+        if not self._grid[case_id]:
+            del self._grid[case_id]
+
+
+
     def _recursiveFrontier(self, case_id, N=1, stop=True):
         """
         Yield the successive frontiers from a case.
-        A frontier is a set of case ids.
+        A frontier is a set of case ids, the ring around the
+        previous frontiers. Frontiers are empty once the whole
+        grid has been covered.
         """
         if stop is True:
             gen = xrange(N)
         else:
             gen = itertools.count()
 
-        frontier = set([case_id])
-        interior = frontier
-
         for i in gen:
 
             if i > MAX_RECURSIVE_FRONTIER:
                 print '/!\ Recursion exceeded in recursiveFrontier'
                 raise StopIteration
 
-            yield frontier
+            yield self._ring(case_id, i)
+
+
+    def _ring(self, case_id, k):
+        """
+        Compute the set of cases at ring k around a case.
+        Longitudes wrap around, latitudes stop at the poles.
+        Cases already in a smaller ring because of the wrap
+        are left out.
+        """
+        rows, cols = self._rows, self._cols
+
+        i, j = deinterleave(case_id, self._precision)
+        ring = set()
 
-            frontier = self._nextFrontier(frontier, interior)
-            interior = interior | frontier
+        for di, dj in ring_offsets(k):
+            if not 0 <= i + di < rows:
+                continue
 
+            # Distance in longitude, the shortest way around
+            wrapped = dj % cols
+            if max(abs(di), min(wrapped, cols - wrapped)) < k:
+                continue
 
-    @staticmethod
-    def _nextFrontier(frontier, interior):
+            ring.add(interleave(i + di, (j + dj) % cols, self._precision))
+
+        return ring
+
+
+    def _nextFrontier(self, frontier, interior):
         """
-        Compute next frontier from a frontier and a 
+        Compute next frontier from a frontier and a
         matching interior.
         Interior is the set of case ids in the frontier.
         """
-        return set([k for cid in frontier for k in neighbors(cid) if k not in interior])
+        rows, cols = self._rows, self._cols
+
+        next_frontier = set()
+
+        for case_id in frontier:
+            i, j = deinterleave(case_id, self._precision)
+
+            for di, dj in ring_offsets(1):
+                if 0 <= i + di < rows:
+                    cid = interleave(i + di, (j + dj) % cols, self._precision)
+
+                    if cid not in interior:
+                        next_frontier.add(cid)
+
+        return next_frontier
 
 
 
@@ -172,15 +453,39 @@ class GeoGrid(object):
         """
         Filter from a iterator of candidates, the ones 
         who are within a radius if a ref_lat_lng.
+        Candidates out of the latitude band are rejected
+        before computing any distance.
 
         Yields the good ones.
+
+        >>> a = GeoGrid(verbose=False)
+        >>> for i in range(40):
+        ...     a.add(i, (48.0 + 0.01 * i, 2.0))
+        >>> len(list(a._check_distance(range(40), (48.0, 2.0), 2)))
+        2
+        >>> len(list(a._check_distance(range(10), (48.0, 2.0), 2)))
+        2
         """
-        for can in candidate:
+        if HAS_NUMPY_SUPPORT:
+            candidate = list(candidate)
+
+            if len(candidate) >= MIN_VECT_SIZE:
+                lat_lngs = np.array([self._keys[can]['lat_lng'] for can in candidate], dtype=np.float64)
+
+                # Latitude band, with some margin for rounding
+                band  = unradian(float(radius) / EARTH_RADIUS) * (1 + 1e-9)
+                close = np.flatnonzero(np.abs(lat_lngs[:, 0] - ref_lat_lng[0]) <= band)
+                dists = haversine_vect(ref_lat_lng, lat_lngs[close, 0], lat_lngs[close, 1])
 
-            dist = haversine(ref_lat_lng, self._keys[can]['lat_lng'])
+                for dist, i in itertools.izip(dists.tolist(), close.tolist()):
+                    if dist <= radius:
+                        yield (dist, candidate[i])
+                return
 
-            if dist <= radius:
-                yield (dist, can)
+        points = ((can, self._keys[can]['lat_lng'], self._keys[can]['rad']) for can in candidate)
+
+        for dist, can in haversine_within(ref_lat_lng, points, radius):
+            yield (dist, can)
 
 
     def _allKeysInCases(self, cases):
@@ -206,22 +511,25 @@ class GeoGrid(object):
                 yield key
 
 
-    def _findNearCase(self, case_id, radius=20):
+    def _findNearCase(self, lat_lngs, radius=20):
         """
         Same as _findInAdjacentCases, but the limitation
-        is given with a radius and not with a recursive limit
-        in adjacency computation.
-        """
-        # Do your homework :D
-        # A more accurate formula would be with
-        # self._avg_radius = min(r1, r2) where r1 are r2 are
-        # the size of one case
-        if float(radius) == self._avg_radius:
-            N = 2
-        else:
-            N = int(float(radius) / self._avg_radius) + 2
+        is given with a radius around some points, and not with
+        a recursive limit in adjacency computation.
+        The cases covering the bounding box of the circles are
+        explored, as cases get narrower far from the equator,
+        so no key within the radius is missed.
+        """
+        areas = [circle_area(lat_lng, radius) for lat_lng in lat_lngs]
 
-        return self._findInAdjacentCases(case_id, N)
+        area = {
+            's' : min(a['s'] for a in areas),
+            'w' : min(a['w'] for a in areas),
+            'n' : max(a['n'] for a in areas),
+            'e' : max(a['e'] for a in areas)
+        }
+
+        return self._allKeysInCases(self._coveringCases(area))
 
 
 
@@ -239,12 +547,21 @@ class GeoGrid(object):
             this is useful because the grid is approximate, so the results are only as accurate \
             as the grid size
         :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        Cases get narrower far from the equator, but no key is missed.
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> for i in range(200):
+        ...     a.add(i, (0, 0.5 * i))
+        >>> a.add('LYR', (78.25, 15.47))
+        >>> list(a.findNearPoint((78.25, 14.0), 35, double_check=True))
+        [(33.28..., 'LYR')]
         """
         if lat_lng is None:
             # Case where the lat_lng was missing from base
             return iter([])
 
-        candidate = self._findNearCase(self._computeCaseId(lat_lng), radius)
+        candidate = self._findNearCase([lat_lng], radius)
 
         if double_check:
             return self._check_distance(candidate, lat_lng, radius)
@@ -272,7 +589,7 @@ class GeoGrid(object):
             # and as such was never indexed
             return iter([])
 
-        candidate = self._findNearCase(self._keys[key]['case'], radius)
+        candidate = self._findNearCase([self._keys[key]['lat_lng']], radius)
 
         if double_check:
             return self._check_distance(candidate, self._keys[key]['lat_lng'], radius)
@@ -310,6 +627,119 @@ class GeoGrid(object):
 
 
 
+    def _ringBound(self, lat_lng, box, k):
+        """
+        Lower bound of the distance from a point to the keys
+        outside the first k rings around the point case.
+        The rings cover a rectangle of cells around the case box.
+        """
+        lat, lng = lat_lng
+
+        height = box['n'] - box['s']
+        width  = box['e'] - box['w']
+
+        north = box['n'] + k * height
+        south = box['s'] - k * height
+
+        bounds = []
+
+        if north < 90:
+            bounds.append(radian(north - lat))
+
+        if south > -90:
+            bounds.append(radian(lat - south))
+
+        if (2 * k + 1) * width < 360:
+            # Points out of the rectangle longitudes are farther than
+            # the great circle of the closest meridian
+            d_lng = min(lng - box['w'], box['e'] - lng) + k * width
+            bounds.append(asin(min(cos(radian(lat)) * sin(radian(min(d_lng, 90))), 1.0)))
+
+        if not bounds:
+            return float('inf')
+
+        return EARTH_RADIUS * min(bounds)
+
+
+    def _iterRings(self, case_id, cache=None):
+        """
+        Yields the lists of keys of successive rings around a case.
+        The cache may be shared by searches from the same case.
+        """
+        if cache is None:
+            cache = {}
+
+        if not cache:
+            cache['rings']     = []
+            cache['frontiers'] = self._recursiveFrontier(case_id, stop=False)
+
+        for keys in cache['rings']:
+            yield keys
+
+        for frontier in cache['frontiers']:
+            if not frontier:
+                # The whole grid has been explored
+                break
+
+            keys = list(self._allKeysInCases(frontier))
+            cache['rings'].append(keys)
+
+            yield keys
+
+
+
+    def iterClosestFromPoint(self, lat_lng, from_keys=None, _cache=None):
+        """
+        Yields the closest things from a point, by increasing
+        distance. Rings of cases are explored around the point case,
+        and a key is yielded once no unexplored ring can contain
+        a closer one, so results are exact, and the search can be
+        stopped at any time.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform the search.
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.215))
+        >>> it = a.iterClosestFromPoint((48.75, 2.361))
+        >>> next(it)
+        (0.0, 'CDG')
+        >>> list(it)
+        [(3.33..., 'ORY'), (677.8..., 'NCE')]
+        >>> list(a.iterClosestFromPoint((48.75, 2.361), from_keys=set(['NCE'])))
+        [(677.8..., 'NCE')]
+        """
+        if lat_lng is None:
+            return
+
+        case_id = self._computeCaseId(lat_lng)
+        box     = cell_bbox(case_id, self._precision)
+        heap    = []
+
+        for k, keys in enumerate(self._iterRings(case_id, _cache)):
+
+            if from_keys is not None:
+                keys = [key for key in keys if key in from_keys]
+
+            if keys:
+                dists = next(self._batchDistances(keys, [lat_lng]))
+                heap.extend(itertools.izip(dists, keys))
+                heapq.heapify(heap)
+
+            bound = self._ringBound(lat_lng, box, k)
+
+            while heap and heap[0][0] <= bound:
+                yield heapq.heappop(heap)
+
+        while heap:
+            yield heapq.heappop(heap)
+
+
+
     def findClosestFromPoint(self, lat_lng, N=1, double_check=False, from_keys=None):
         """
         Concept close to findNearPoint, but here we do not
@@ -350,13 +780,13 @@ class GeoGrid(object):
         # Some precaution for the number of wanted keys
         N = min(N, len(self._keys))
 
+        if double_check:
+            return list(itertools.islice(self.iterClosestFromPoint(lat_lng, from_keys), N))
+
         # The case of the point is computed by _computeCaseId
         candidate = self._findClosestFromCase(self._computeCaseId(lat_lng), N, from_keys)
 
-        if double_check:
-            return sorted(self._check_distance(candidate, lat_lng, radius=float('inf')))[:N]
-        else:
-            return ((0, f) for f in candidate)
+        return ((0, f) for f in candidate)
 
 
     def findClosestFromKey(self, key, N=1, double_check=False, from_keys=None):
@@ -400,13 +830,573 @@ class GeoGrid(object):
         # Some precaution for the number of wanted keys
         N = min(N, len(self._keys))
 
+        if double_check:
+            return list(itertools.islice(self.iterClosestFromPoint(self._keys[key]['lat_lng'], from_keys), N))
+
         # The case of the point is just retrieved
         candidate = self._findClosestFromCase(self._keys[key]['case'], N, from_keys)
 
-        if double_check:
-            return sorted(self._check_distance(candidate, self._keys[key]['lat_lng'], radius=float('inf')))[:N]
+        return ((0, f) for f in candidate)
+
+
+
+    def cellMaxima(self, scores):
+        """
+        Compute the maximum score of the keys of each case,
+        to prune cases in findBestNear.
+
+        :param scores: a dict of scores, keys without scores are ignored
+        :returns:      a dict of the maximum score for each case
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> [(cell_to_geohash(c, 4), m) for c, m in a.cellMaxima({'ORY': 2, 'CDG': 3}).items()]
+        [('u09t', 3)]
+        """
+        cell_max = {}
+
+        for case_id, keys in self._grid.iteritems():
+            values = [scores[key] for key in keys if key in scores]
+
+            if values:
+                cell_max[case_id] = max(values)
+
+        return cell_max
+
+
+
+    def findBestNear(self, lat_lng, scores, alpha=1.0, N=1, cell_max=None):
+        """
+        Find the things with the best combined score from a point, the
+        score of a thing being its own score, minus alpha times its
+        distance. Rings of cases are explored around the point case, and
+        cases are expanded only if their maximum score may beat the N
+        best found, so results are exact.
+
+        :param lat_lng:  the lat_lng of the point (a tuple of (lat, lng))
+        :param scores:   a dict of scores, keys without scores are ignored
+        :param alpha:    the score lost per kilometer
+        :param N:        the N best results wanted
+        :param cell_max: the maximum score of each case, computed \
+            with cellMaxima if None
+        :returns:        a list of (combined score, distance, key), best first
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.215))
+        >>> scores = {'ORY': 20, 'CDG': 60, 'NCE': 100}
+        >>> a.findBestNear((48.72, 2.359), scores, alpha=1)
+        [(56.66..., 3.33..., 'CDG')]
+        >>> a.findBestNear((48.72, 2.359), scores, alpha=0.01, N=2)
+        [(93.24..., 675.17..., 'NCE'), (59.96..., 3.33..., 'CDG')]
+        """
+        if lat_lng is None or N < 1:
+            return []
+
+        if cell_max is None:
+            cell_max = self.cellMaxima(scores)
+
+        if not cell_max:
+            return []
+
+        best_max = max(cell_max.itervalues())
+
+        case_id = self._computeCaseId(lat_lng)
+        box     = cell_bbox(case_id, self._precision)
+
+        # The N best scores, the worst on top
+        best    = []
+        results = []
+        visited = set()
+
+        def expand(case, lower):
+            # Cases which cannot beat the N best are skipped
+            if case not in cell_max:
+                return
+
+            if len(best) == N and cell_max[case] - alpha * lower < best[0]:
+                return
+
+            for key in self._grid[case]:
+                if key not in scores:
+                    continue
+
+                dist  = haversine(lat_lng, self._keys[key]['lat_lng'])
+                score = scores[key] - alpha * dist
+
+                if len(best) < N:
+                    heapq.heappush(best, score)
+                elif score >= best[0]:
+                    heapq.heappushpop(best, score)
+                else:
+                    continue
+
+                results.append((score, dist, key))
+
+        for k, ring in enumerate(self._recursiveFrontier(case_id, stop=False)):
+
+            if not ring:
+                # The whole grid has been explored
+                break
+
+            # Lower bound of distances from ring k
+            lower = 0 if k == 0 else self._ringBound(lat_lng, box, k - 1)
+
+            if len(best) == N and best_max - alpha * lower < best[0]:
+                break
+
+            if len(visited) + len(ring) > len(cell_max):
+                # Rings are larger than the remaining cases, which
+                # are expanded directly, best maximum scores first
+                for case in sorted(cell_max, key=cell_max.get, reverse=True):
+                    if case not in visited:
+                        expand(case, lower)
+                break
+
+            visited.update(ring)
+
+            for case in ring:
+                expand(case, lower)
+
+        results.sort(key=lambda r: (-r[0], r[1], r[2]))
+
+        return results[:N]
+
+
+
+    def _groupByCase(self, points):
+        """
+        Group the indexes of points by case id.
+        Points without valid coordinates are left out.
+        """
+        cases = {}
+
+        for i, lat_lng in enumerate(points):
+            try:
+                case_id = self._computeCaseId(lat_lng)
+            except (TypeError, Exception):
+                continue
+
+            if case_id not in cases:
+                cases[case_id] = []
+
+            cases[case_id].append(i)
+
+        return cases
+
+
+    def _batchDistances(self, candidate, refs):
+        """
+        Yields the lists of distances from each reference
+        lat_lng to the candidates.
+        """
+        if HAS_NUMPY_SUPPORT and len(candidate) >= MIN_VECT_SIZE:
+            # Arrays are built once for all references
+            lat_lngs = np.array([self._keys[can]['lat_lng'] for can in candidate], dtype=np.float64)
+            lats     = lat_lngs[:, 0]
+            lngs     = lat_lngs[:, 1]
+
+            for ref_lat_lng in refs:
+                yield haversine_vect(ref_lat_lng, lats, lngs).tolist()
+        else:
+            lat_lngs = [self._keys[can]['lat_lng'] for can in candidate]
+
+            for ref_lat_lng in refs:
+                yield [haversine(ref_lat_lng, l) for l in lat_lngs]
+
+
+
+    def findNearPoints(self, points, radius=20, double_check=False):
+        """
+        Same as findNearPoint, for many points at once.
+        Points in the same case share their candidates.
+
+        :param points:  an iterable of lat_lng
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findNearPoints([(48.72, 2.359), None, (48.75, 2.361)], 2, double_check=True)
+        [[(0.0, 'ORY')], [], [(0.0, 'CDG')]]
+        """
+        points  = list(points)
+        results = [[] for _ in points]
+
+        for case_id, indexes in self._groupByCase(points).iteritems():
+
+            candidate = list(self._findNearCase([points[i] for i in indexes], radius))
+
+            if not double_check:
+                for i in indexes:
+                    results[i] = [(0, can) for can in candidate]
+                continue
+
+            refs = (points[i] for i in indexes)
+
+            for i, dists in itertools.izip(indexes, self._batchDistances(candidate, refs)):
+                results[i] = [(d, can) for d, can in itertools.izip(dists, candidate) if d <= radius]
+
+        return results
+
+
+
+    def findClosestFromPoints(self, points, N=1, double_check=False, from_keys=None):
+        """
+        Same as findClosestFromPoint, for many points at once.
+        Points in the same case share their candidates.
+
+        :param points:    an iterable of lat_lng
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findClosestFromPoints([(48.72, 2.359), None, (48.75, 2.361)], double_check=True)
+        [[(0.0, 'ORY')], [], [(0.0, 'CDG')]]
+        """
+        points  = list(points)
+        results = [[] for _ in points]
+
+        if from_keys is not None:
+            from_keys = set(from_keys)
+
+            # If from_keys is empty, the result is obvious
+            if not from_keys:
+                return results
+
+            # We cannot give what we do not have
+            N = min(N, len(from_keys))
+
+        # Some precaution for the number of wanted keys
+        N = min(N, len(self._keys))
+
+        for case_id, indexes in self._groupByCase(points).iteritems():
+
+            if double_check:
+                # Rings are shared by points of the same case
+                cache = {}
+
+                for i in indexes:
+                    it = self.iterClosestFromPoint(points[i], from_keys, cache)
+                    results[i] = list(itertools.islice(it, N))
+                continue
+
+            candidate = list(self._findClosestFromCase(case_id, N, from_keys))
+
+            for i in indexes:
+                results[i] = [(0, can) for can in candidate]
+
+        return results
+
+
+
+    def _coveringCases(self, area):
+        """
+        Generates the cases covering an area. If there are more
+        of them than non-empty cases, only non-empty cases are
+        generated, as the area covers most of the grid anyway.
+
+        >>> a = GeoGrid(precision=3, verbose=False)
+        >>> for i in range(10):
+        ...     a.add(i, (0, 10 * i))
+        >>> sorted(cell_to_geohash(c, 3) for c in a._coveringCases(bbox_area(48, 179, 49, -179)))
+        ['b08', 'zbx']
+        """
+        rows, cols = self._rows, self._cols
+
+        # Same computation as for points, so boundaries are consistent
+        i0 = max(int(floor((area['s'] + 90) / 180.0 * rows)), 0)
+        i1 = min(int(floor((area['n'] + 90) / 180.0 * rows)), rows - 1)
+        j0 = int(floor((area['w'] + 180) / 360.0 * cols))
+        j1 = int(floor((area['e'] + 180) / 360.0 * cols))
+
+        if j1 - j0 >= cols:
+            j0, j1 = 0, cols - 1
+
+        if (i1 - i0 + 1) * (j1 - j0 + 1) > len(self._grid):
+            for case_id in self._grid:
+                yield case_id
+            return
+
+        for i in xrange(i0, i1 + 1):
+            for j in xrange(j0, j1 + 1):
+                yield interleave(i, j % cols, self._precision)
+
+
+
+    def _findInArea(self, area, polygon=None):
+        """
+        Generates keys inside an area, and inside the polygon if given.
+        Keys from cases fully inside are yielded without any test,
+        only cases crossing the boundary are tested key by key.
+        """
+        for case_id in self._coveringCases(area):
+
+            if case_id not in self._grid:
+                continue
+
+            kind = box_in_area(cell_bbox(case_id, self._precision), area, polygon)
+
+            if kind == 'out':
+                continue
+
+            for key in self._grid[case_id]:
+                if kind == 'in' or point_in_area(self._keys[key]['lat_lng'], area, polygon):
+                    yield key
+
+
+
+    def findInBBox(self, south, west, north, east):
+        """
+        Returns keys inside a bounding box. If *west* is greater
+        than *east*, the box crosses the antimeridian.
+
+        :param south: the southern latitude
+        :param west:  the western longitude
+        :param north: the northern latitude
+        :param east:  the eastern longitude
+        :returns:     an iterable of keys
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInBBox(48.73, 2, 49, 3))
+        ['CDG']
+        >>> sorted(a.findInBBox(-25, 170, -15, -170))
+        ['SUV', 'TBU']
+        """
+        return self._findInArea(bbox_area(south, west, north, east))
+
+
+
+    def findInPolygon(self, points):
+        """
+        Returns keys inside a polygon, given as a list of LatLng
+        vertices. Polygons crossing the antimeridian are supported.
+
+        :param points: the vertices of the polygon
+        :returns:      an iterable of keys
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInPolygon([(48, 2), (48.74, 2), (48.74, 3), (48, 3)]))
+        ['ORY']
+        >>> sorted(a.findInPolygon([(-25, 170), (-15, 170), (-15, -170), (-25, -170)]))
+        ['SUV', 'TBU']
+        """
+        polygon = unwrap_polygon(points)
+
+        if len(polygon) < 3:
+            return iter([])
+
+        return self._findInArea(polygon_area(polygon), polygon)
+
+
+
+    def _caseInCircle(self, case_id, lat_lng, radius):
+        """
+        Tell if a case is inside the circle of a radius around a point.
+        The farthest points of a case are its corners, as long as the
+        radius is less than a quarter of the Earth circumference, and
+        the case does not contain the meridian opposite to the point.
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> ory = geohash_to_cell('u09t')
+        >>> a._caseInCircle(ory, (48.78, 2.28), 30), a._caseInCircle(ory, (48.78, 2.28), 10)
+        (True, False)
+        """
+        if radius >= 0.5 * pi * EARTH_RADIUS:
+            return False
+
+        box = cell_bbox(case_id, self._precision)
+
+        opposite = lat_lng[1] + 180 if lat_lng[1] < 0 else lat_lng[1] - 180
+
+        if box['w'] < opposite < box['e']:
+            return False
+
+        return all(haversine(lat_lng, (box[lat], box[lng])) <= radius
+                   for lat in 'sn' for lng in 'we')
+
+
+
+    def countNear(self, lat_lng, radius=20):
+        """
+        Count the things within a radius from a point. Cases fully
+        inside the radius are counted without looking at their keys,
+        only cases crossing the boundary are checked key by key.
+
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param radius:  the radius of the search (kilometers)
+        :returns:       the number of things
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.215))
+        >>> a.countNear((48.72, 2.359), 10), a.countNear((48.72, 2.359), 1000)
+        (2, 3)
+        >>> a.countNear(None, 10)
+        0
+        """
+        if lat_lng is None:
+            return 0
+
+        count = 0
+
+        for case_id in self._coveringCases(circle_area(lat_lng, radius)):
+
+            keys = self._grid.get(case_id)
+
+            if not keys:
+                continue
+
+            # With a few keys, checking the corners is not worth it
+            if len(keys) > 4 and self._caseInCircle(case_id, lat_lng, radius):
+                count += len(keys)
+            else:
+                count += sum(1 for _ in self._check_distance(keys, lat_lng, radius))
+
+        return count
+
+
+
+    def aggregateByCell(self, precision, values=None, agg='count'):
+        """
+        Aggregate the things by cells of a precision. With a precision
+        up to the grid precision, cases are merged into their cell,
+        so things are only counted with the case sizes.
+
+        :param precision: the geohash length of the cells
+        :param values:    a dict of values, for sum and max, \
+            keys without values are ignored
+        :param agg:       'count', 'sum' or 'max'
+        :raises:          ValueError, if agg is not 'count', 'sum' or 'max'
+        :returns:         a dict of the aggregated value for each cell, \
+            given as a geohash
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.215))
+        >>> sorted(a.aggregateByCell(2).items())
+        [('sp', 1), ('u0', 2)]
+        >>> sorted(a.aggregateByCell(2, {'ORY': 20, 'CDG': 60}, 'sum').items())
+        [('u0', 80)]
+        >>> sorted(a.aggregateByCell(6, {'ORY': 20, 'CDG': 60}, 'max').items())
+        [('u09tjt', 20), ('u09tmd', 60)]
+        """
+        if agg not in ('count', 'sum', 'max'):
+            raise ValueError("Aggregation %s not in ['count', 'sum', 'max']." % agg)
+
+        if precision <= self._precision:
+            shift = 5 * (self._precision - precision)
+            parts = ((case_id >> shift, keys) for case_id, keys in self._grid.iteritems())
         else:
-            return ((0, f) for f in candidate)
+            parts = ((encode_cell(v['lat_lng'][0], v['lat_lng'][1], precision), [key])
+                     for key, v in self._keys.iteritems())
+
+        cells = {}
+
+        for cell, keys in parts:
+            if agg == 'count':
+                value = len(keys)
+            else:
+                keys = [key for key in keys if key in values]
+
+                if not keys:
+                    continue
+
+                if agg == 'sum':
+                    value = sum(values[key] for key in keys)
+                else:
+                    value = max(values[key] for key in keys)
+
+            if cell not in cells:
+                cells[cell] = value
+            elif agg == 'max':
+                cells[cell] = max(cells[cell], value)
+            else:
+                cells[cell] += value
+
+        return dict((cell_to_geohash(c, precision), v) for c, v in cells.iteritems())
+
+
+
+    def _routeCases(self, route, radius):
+        """
+        Cases covering the corridor around a route. The corridor
+        is covered by disks along the route, and each disk by the
+        cases of its bounding box, as for countNear.
+        """
+        points, search = corridor_points(route, radius)
+
+        cases = set()
+
+        for lat_lng in points:
+            cases.update(self._coveringCases(circle_area(lat_lng, search)))
+
+        return cases
+
+
+
+    def findNearRoute(self, points, radius=20, double_check=False):
+        """
+        Returns keys near a route, made of the shortest paths between
+        successive points. The cases covering the corridor are visited
+        once, then exact cross-track distances are computed.
+
+        :param points:  the list of lat_lng of the route
+        :param radius:  the half width of the corridor (kilometers)
+        :param double_check: when using grid, perform an additional check on results distance, \
+            this is useful because the grid is approximate, so the results are only as accurate \
+            as the grid size
+        :returns:       a list of (distance, key, along-track position), sorted \
+            by along-track position
+
+        >>> a = GeoGrid(radius=20, verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.21))
+        >>> a.findNearRoute([(48.84, 2.367), (43.70, 7.26)], 15, double_check=True)
+        [(6.12..., 'CDG', 7.93...), (8.16..., 'ORY', 10.57...), (5.99..., 'NCE', 683.85...)]
+        >>> for i in range(200):
+        ...     a.add(i, (0, 0.5 * i))
+        >>> a.add('LYR', (78.25, 15.47))
+        >>> a.findNearRoute([(78.25, 10.0), (78.25, 14.0)], 35, double_check=True)
+        [(33.28..., 'LYR', 90.55...)]
+        """
+        route = list(points)
+
+        if not route:
+            return []
+
+        candidate = list(self._allKeysInCases(self._routeCases(route, radius)))
+        lat_lngs  = [self._keys[can]['lat_lng'] for can in candidate]
+
+        results = [(dist, can, along)
+                   for (dist, along), can in itertools.izip(route_distances(route, lat_lngs), candidate)
+                   if not double_check or dist <= radius]
+
+        return sorted(results, key=lambda r: (r[2], r[0]))
 
 
 
@@ -0,0 +1,690 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+
+"""
+This module is a tree implementation, in order
+to provide exact geographical indexation features.
+
+Points are stored with their coordinates on the unit sphere,
+in a KD-tree. The chord between two points of the unit sphere
+grows with the great circle distance, so the closest points for
+the chord are the closest points on the sphere, and a radius on
+the sphere is a radius for the chord.
+
+    >>> a = GeoTree()
+    Setting tree leaf size to 16
+    >>> a.add('ORY', (48.72, 2.359))
+    >>> a.add('CDG', (48.75, 2.361))
+    >>> a.add('NCE', (43.66, 7.215))
+    >>> a._keys['ORY']['lat_lng']
+    (48.7..., 2.359)
+    >>> list(a.findNearKey('ORY', 20))
+    [(0.0, 'ORY'), (3.33..., 'CDG')]
+    >>> list(a.findClosestFromPoint((48.75, 2.361), N=2))
+    [(0.0, 'CDG'), (3.33..., 'ORY')]
+    >>> list(a.findClosestFromPoint((48.75, 2.361), N=2, from_keys=['NCE', 'ORY']))
+    [(3.33..., 'ORY'), (677.8..., 'NCE')]
+    >>> list(a.findClosestFromKey('NCE', N=5))
+    [(0.0, 'NCE'), (675.1..., 'ORY'), (677.8..., 'CDG')]
+"""
+
+
+from __future__ import with_statement
+
+import heapq
+from itertools import count, islice, izip
+from math import asin, sin, cos, pi
+
+from .GeoUtils import haversine, radian, EARTH_RADIUS
+from .GeoUtils import corridor_points, route_distances
+from .GeoUtils import bbox_area, unwrap_polygon, polygon_area, point_in_area
+
+
+# Max number of points in a leaf
+LEAF_SIZE = 16
+
+
+def to_xyz(lat_lng):
+    """Coordinates on the unit sphere.
+
+    :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+    :raises:        ValueError, for invalid coordinates
+    :returns:       the (x, y, z) tuple
+
+    >>> to_xyz((0, 0))
+    (1.0, 0.0, 0.0)
+    >>> to_xyz((90, 0))
+    (6.1...e-17, 0.0, 1.0)
+    >>> to_xyz((91, 0))
+    Traceback (most recent call last):
+    ValueError: Invalid coordinates (91, 0)
+    """
+    lat, lng = lat_lng
+
+    if not -90 <= lat <= 90 or not -180 <= lng <= 180:
+        raise ValueError('Invalid coordinates %s' % str(lat_lng))
+
+    lat = radian(lat)
+    lng = radian(lng)
+
+    return (cos(lat) * cos(lng), cos(lat) * sin(lng), sin(lat))
+
+
+def radius_to_chord(radius):
+    """Convert a distance on the sphere to a chord on the unit sphere.
+
+    :param radius: the distance in kilometers
+    :returns:      the chord length
+
+    >>> radius_to_chord(0)
+    0.0
+    >>> radius_to_chord(float('inf'))
+    2.0
+    """
+    return 2 * sin(0.5 * min(float(radius) / EARTH_RADIUS, pi))
+
+
+def chord_to_radius(chord):
+    """Convert a chord on the unit sphere to a distance on the sphere.
+
+    :param chord: the chord length
+    :returns:     the distance in kilometers
+
+    >>> chord_to_radius(radius_to_chord(683.85))
+    683.85...
+    """
+    return 2 * EARTH_RADIUS * asin(min(0.5 * chord, 1.0))
+
+
+
+def _box_dist2(lo, hi, xyz):
+    """Squared distance between a point and a box.
+    """
+    d2 = 0.0
+
+    for l, h, c in zip(lo, hi, xyz):
+        if c < l:
+            d2 += (l - c) ** 2
+        elif c > h:
+            d2 += (c - h) ** 2
+
+    return d2
+
+
+def _dist2(a, b):
+    """Squared euclidean distance.
+    """
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+
+class GeoTree(object):
+    """
+    This is the main and only class.
+    """
+    def __init__(self, leaf_size=LEAF_SIZE, verbose=True):
+        """Creates tree.
+
+        The tree is built on the first search after points are added.
+
+        :param leaf_size: the maximum number of points in a leaf
+        :param verbose:   toggle verbosity
+        :returns:         None
+        """
+        self._leaf_size = leaf_size
+
+        # Points, and the tree built from them
+        self._keys = {}
+        self._root = None
+
+        if verbose:
+            print 'Setting tree leaf size to %s' % leaf_size
+
+
+    def add(self, key, lat_lng, verbose=True):
+        """
+        Add a point to the tree. If the key is already
+        in the tree, the point is moved. Once the tree is
+        built, points are inserted in place.
+
+        :param key:     the key to be added
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param verbose: toggle verbosity
+        :returns:       None
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findClosestFromPoint((43.66, 7.21))
+        [(674.96..., 'ORY')]
+        >>> a.add('ORY', (43.66, 7.21))
+        >>> a.findClosestFromPoint((43.66, 7.21))
+        [(0.0, 'ORY')]
+        """
+        try:
+            xyz = to_xyz(lat_lng)
+
+        except (TypeError, Exception):
+            # TypeError for wrong type (NoneType, str)
+            # Exception for invalid coordinates
+            if verbose:
+                print 'Wrong coordinates %s for key %s, skipping point.' % (str(lat_lng), key)
+
+            # The previous location is not valid anymore
+            self.remove(key)
+            return
+
+        if key in self._keys:
+            self.remove(key)
+
+        self._keys[key] = {
+            'xyz'     : xyz,
+            'lat_lng' : lat_lng
+        }
+
+        if self._root is not None:
+            self._insertItem(xyz, key)
+
+
+
+    def remove(self, key):
+        """
+        Remove a point from the tree. Unknown keys are ignored.
+        Bounding boxes are not shrunk, they stay valid bounds.
+
+        :param key: the key to be removed
+        :returns:   None
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findClosestFromPoint((48.72, 2.359))
+        [(0.0, 'ORY')]
+        >>> a.remove('ORY')
+        >>> a.remove('ORY')
+        >>> a.findClosestFromPoint((48.72, 2.359))
+        [(3.33..., 'CDG')]
+        """
+        if key not in self._keys:
+            return
+
+        xyz = self._keys.pop(key)['xyz']
+
+        if self._root is None:
+            return
+
+        stack = [self._root]
+
+        while stack:
+            lo, hi, children, items = stack.pop()
+
+            if _box_dist2(lo, hi, xyz) > 0:
+                continue
+
+            if children is None:
+                for i, (_, k) in enumerate(items):
+                    if k == key:
+                        del items[i]
+                        return
+            else:
+                stack.extend(c for c in children if c is not None)
+
+
+
+    def _insertItem(self, xyz, key):
+        """
+        Insert a point in the built tree, going down to the closest
+        leaf and extending boxes on the way. Leaves which become
+        too large are rebuilt as sub-trees.
+        """
+        node = self._root
+
+        while True:
+            node[0] = tuple(min(l, c) for l, c in zip(node[0], xyz))
+            node[1] = tuple(max(h, c) for h, c in zip(node[1], xyz))
+
+            if node[2] is None:
+                break
+
+            node = min((c for c in node[2] if c is not None),
+                       key=lambda c: _box_dist2(c[0], c[1], xyz))
+
+        node[3].append((xyz, key))
+
+        if len(node[3]) > 2 * self._leaf_size:
+            node[:] = self._buildNode(node[3])
+
+
+
+    def _getRoot(self):
+        """
+        Get the root of the tree, building it if necessary.
+        """
+        if self._root is None:
+            items = [(v['xyz'], k) for k, v in self._keys.iteritems()]
+            self._root = self._buildNode(items)
+
+        return self._root
+
+
+    def _buildNode(self, items):
+        """
+        Build a node from a list of (xyz, key).
+
+        A node is a list [lo, hi, children, items], where lo and hi
+        are the corners of the bounding box. Leaves have no children,
+        other nodes have no items. Nodes are lists so they can be
+        updated in place when points are added.
+        """
+        if not items:
+            return None
+
+        lo = tuple(min(it[0][i] for it in items) for i in range(3))
+        hi = tuple(max(it[0][i] for it in items) for i in range(3))
+
+        if len(items) <= self._leaf_size:
+            return [lo, hi, None, items]
+
+        # Splitting on the widest axis
+        axis = max(range(3), key=lambda i: hi[i] - lo[i])
+        items.sort(key=lambda it: it[0][axis])
+        mid = len(items) // 2
+
+        children = (self._buildNode(items[:mid]), self._buildNode(items[mid:]))
+
+        return [lo, hi, children, None]
+
+
+
+    def _checkDistances(self, candidates, ref_lat_lng, radius=None):
+        """
+        Compute the great circle distances of candidates,
+        sorted by distance.
+        """
+        res = []
+
+        for can in candidates:
+
+            dist = haversine(ref_lat_lng, self._keys[can]['lat_lng'])
+
+            if radius is None or dist <= radius:
+                res.append((dist, can))
+
+        return sorted(res)
+
+
+
+    def _findNearXYZ(self, xyz, chord):
+        """
+        Yields keys within a chord of a point.
+        """
+        root = self._getRoot()
+
+        if root is None:
+            return
+
+        # Some margin for rounding, exact distances are checked after
+        chord2 = (chord * (1 + 1e-9)) ** 2
+        stack  = [root]
+
+        while stack:
+            lo, hi, children, items = stack.pop()
+
+            if _box_dist2(lo, hi, xyz) > chord2:
+                continue
+
+            if children is None:
+                for p, key in items:
+                    if _dist2(p, xyz) <= chord2:
+                        yield key
+            else:
+                stack.extend(c for c in children if c is not None)
+
+
+
+    def _iterClosestFromXYZ(self, xyz, from_keys=None):
+        """
+        Yields keys by increasing distance from a point.
+        This is a best-first search, on nodes and points.
+        """
+        root = self._getRoot()
+
+        if root is None:
+            return
+
+        # Nodes are (dist2, 0, counter, node), points are (dist2, 1, key, None)
+        # The counter avoids comparing nodes on equal distances
+        tie   = count()
+        queue = [(0.0, 0, next(tie), root)]
+
+        while queue:
+            d2, kind, name, node = heapq.heappop(queue)
+
+            if kind == 1:
+                yield name
+                continue
+
+            lo, hi, children, items = node
+
+            if children is not None:
+                for c in children:
+                    if c is not None:
+                        heapq.heappush(queue, (_box_dist2(c[0], c[1], xyz), 0, next(tie), c))
+                continue
+
+            for p, key in items:
+                if from_keys is None or key in from_keys:
+                    heapq.heappush(queue, (_dist2(p, xyz), 1, key, None))
+
+
+
+    def iterClosestFromPoint(self, lat_lng, from_keys=None):
+        """
+        Yields the closest things from a point, by increasing
+        distance, so the search can be stopped at any time.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform the search.
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.215))
+        >>> it = a.iterClosestFromPoint((48.75, 2.361))
+        >>> next(it)
+        (0.0, 'CDG')
+        >>> list(it)
+        [(3.33..., 'ORY'), (677.8..., 'NCE')]
+        """
+        if lat_lng is None:
+            return
+
+        for key in self._iterClosestFromXYZ(to_xyz(lat_lng), from_keys):
+            yield haversine(lat_lng, self._keys[key]['lat_lng']), key
+
+
+
+    def findNearPoint(self, lat_lng, radius=20, double_check=False):
+        """
+        Returns a list of nearby things from a point (given
+        latidude and longitude), and a radius for the search.
+        Results are exact, so double_check is only here for
+        compatibility with the grid.
+
+        :param lat_lng: the lat_lng of the point (a tuple of (lat, lng))
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if lat_lng is None:
+            # Case where the lat_lng was missing from base
+            return iter([])
+
+        candidates = self._findNearXYZ(to_xyz(lat_lng), radius_to_chord(radius))
+
+        return self._checkDistances(candidates, lat_lng, radius)
+
+
+
+    def findNearKey(self, key, radius=20, double_check=False):
+        """
+        Same as findNearPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+
+        :param key:     the key
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if key not in self._keys:
+            # Case where the key probably did not have a proper geocode
+            # and as such was never indexed
+            return iter([])
+
+        return self.findNearPoint(self._keys[key]['lat_lng'], radius, double_check)
+
+
+
+    def findClosestFromPoint(self, lat_lng, N=1, double_check=False, from_keys=None):
+        """
+        Concept close to findNearPoint, but here we do not
+        look for the things radius-close to a point,
+        we look for the closest thing from this point, given by
+        latitude/longitude. Results are exact.
+
+        :param lat_lng:   the lat_lng of the point (a tuple of (lat, lng))
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if lat_lng is None:
+            # Case where the lat_lng was missing from base
+            return iter([])
+
+        if from_keys is not None:
+            if not isinstance(from_keys, (set, frozenset)):
+                from_keys = set(from_keys)
+
+            # If from_keys is empty, the result is obvious
+            if not from_keys:
+                return []
+
+        return sorted(islice(self.iterClosestFromPoint(lat_lng, from_keys), N))
+
+
+
+    def findClosestFromKey(self, key, N=1, double_check=False, from_keys=None):
+        """
+        Same as findClosestFromPoint, except the point is given
+        not by a lat/lng, but with its key, like ORY or SFO.
+
+        :param key:       the key
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       an iterable of (distance, key) like [(3.2, 'SFO'), (4.5, 'LAX')]
+        """
+        if key not in self._keys:
+            # Case where the key probably did not have a proper geocode
+            # and as such was never indexed
+            return iter([])
+
+        return self.findClosestFromPoint(self._keys[key]['lat_lng'], N, double_check, from_keys)
+
+
+
+    def findNearPoints(self, points, radius=20, double_check=False):
+        """
+        Same as findNearPoint, for many points at once.
+        The tree is shared, each point is a separate search.
+
+        :param points:  an iterable of lat_lng
+        :param radius:  the radius of the search (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findNearPoints([(48.72, 2.359), None, (48.75, 2.361)], 2)
+        [[(0.0, 'ORY')], [], [(0.0, 'CDG')]]
+        """
+        return [list(self.findNearPoint(lat_lng, radius, double_check)) for lat_lng in points]
+
+
+
+    def findClosestFromPoints(self, points, N=1, double_check=False, from_keys=None):
+        """
+        Same as findClosestFromPoint, for many points at once.
+        The tree is shared, each point is a separate search.
+
+        :param points:    an iterable of lat_lng
+        :param N:         the N closest results wanted
+        :param from_keys: if None, it takes all keys in consideration, else takes from_keys \
+            iterable of keys to perform findClosestFromPoint.
+        :param double_check: not used, distances are always computed
+        :returns:       a list of results, one for each point, as lists of (distance, key)
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.findClosestFromPoints([(48.72, 2.359), None, (48.75, 2.361)])
+        [[(0.0, 'ORY')], [], [(0.0, 'CDG')]]
+        """
+        if from_keys is not None:
+            # Computed once for all points
+            from_keys = set(from_keys)
+
+        return [list(self.findClosestFromPoint(lat_lng, N, double_check, from_keys)) for lat_lng in points]
+
+
+
+    def _findInArea(self, area, polygon=None):
+        """
+        Generates keys inside an area, and inside the polygon if given.
+        Nodes are pruned on their latitude band, given by the z axis,
+        then points of the remaining leaves are tested.
+        """
+        root = self._getRoot()
+
+        if root is None:
+            return
+
+        # Some margin for rounding, exact tests are performed after
+        z_min = sin(radian(max(area['s'], -90))) - 1e-9
+        z_max = sin(radian(min(area['n'], 90))) + 1e-9
+
+        stack = [root]
+
+        while stack:
+            lo, hi, children, items = stack.pop()
+
+            if hi[2] < z_min or lo[2] > z_max:
+                continue
+
+            if children is None:
+                for _, key in items:
+                    if point_in_area(self._keys[key]['lat_lng'], area, polygon):
+                        yield key
+            else:
+                stack.extend(c for c in children if c is not None)
+
+
+
+    def findInBBox(self, south, west, north, east):
+        """
+        Returns keys inside a bounding box. If *west* is greater
+        than *east*, the box crosses the antimeridian.
+
+        :param south: the southern latitude
+        :param west:  the western longitude
+        :param north: the northern latitude
+        :param east:  the eastern longitude
+        :returns:     an iterable of keys
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInBBox(48.73, 2, 49, 3))
+        ['CDG']
+        >>> sorted(a.findInBBox(-25, 170, -15, -170))
+        ['SUV', 'TBU']
+        """
+        return self._findInArea(bbox_area(south, west, north, east))
+
+
+
+    def findInPolygon(self, points):
+        """
+        Returns keys inside a polygon, given as a list of LatLng
+        vertices. Polygons crossing the antimeridian are supported.
+
+        :param points: the vertices of the polygon
+        :returns:      an iterable of keys
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('SUV', (-18.04, 178.56))
+        >>> a.add('TBU', (-21.24, -175.15))
+        >>> sorted(a.findInPolygon([(48, 2), (48.74, 2), (48.74, 3), (48, 3)]))
+        ['ORY']
+        >>> sorted(a.findInPolygon([(-25, 170), (-15, 170), (-15, -170), (-25, -170)]))
+        ['SUV', 'TBU']
+        """
+        polygon = unwrap_polygon(points)
+
+        if len(polygon) < 3:
+            return iter([])
+
+        return self._findInArea(polygon_area(polygon), polygon)
+
+
+
+    def findNearRoute(self, points, radius=20, double_check=False):
+        """
+        Returns keys near a route, made of the shortest paths between
+        successive points. Candidates around points along the route
+        are gathered once, then exact cross-track distances are computed.
+
+        :param points:  the list of lat_lng of the route
+        :param radius:  the half width of the corridor (kilometers)
+        :param double_check: not used, distances are always computed
+        :returns:       a list of (distance, key, along-track position), sorted \
+            by along-track position
+
+        >>> a = GeoTree(verbose=False)
+        >>> a.add('ORY', (48.72, 2.359))
+        >>> a.add('CDG', (48.75, 2.361))
+        >>> a.add('NCE', (43.66, 7.21))
+        >>> a.findNearRoute([(48.84, 2.367), (43.70, 7.26)], 15)
+        [(6.12..., 'CDG', 7.93...), (8.16..., 'ORY', 10.57...), (5.99..., 'NCE', 683.85...)]
+        """
+        route = list(points)
+
+        if not route:
+            return []
+
+        samples, search = corridor_points(route, radius)
+        candidate = set()
+
+        for lat_lng in samples:
+            candidate.update(self._findNearXYZ(to_xyz(lat_lng), radius_to_chord(search)))
+
+        candidate = list(candidate)
+        lat_lngs  = [self._keys[can]['lat_lng'] for can in candidate]
+
+        results = [(dist, can, along)
+                   for (dist, along), can in izip(route_distances(route, lat_lngs), candidate)
+                   if dist <= radius]
+
+        return sorted(results, key=lambda r: (r[2], r[0]))
+
+
+
+def _test():
+    """
+    When called directly, launching doctests.
+    """
+    import doctest
+
+    extraglobs = {}
+
+    opt =  (doctest.ELLIPSIS |
+            doctest.NORMALIZE_WHITESPACE |
+            doctest.REPORT_ONLY_FIRST_FAILURE |
+            doctest.IGNORE_EXCEPTION_DETAIL)
+
+    doctest.testmod(extraglobs=extraglobs, optionflags=opt)
+
+
+
+if __name__ == '__main__':
+    _test()
@@ -17,6 +17,20 @@ Functions frequently used by other modules:
   a dichotomy, because so far I have an exact formula only for 50%
   (implemented in function *mid_point*)
 
+- *haversine_vect*: a vectorized version of haversine, computing
+  distances from one point to many, if NumPy is available
+  (and *haversine_matrix* for all pairs of points from two sets)
+- *prog_points_vect*: a vectorized and exact version of prog_point,
+  computing many progressions on many paths at once, if NumPy is
+  available (along with *mid_point_vect* and *mercator_vect*)
+- *route_distance*: a function to compute the cross-track distance
+  from a point to a route made of great circle legs, and the
+  along-track position of its projection on the route
+  (vectorized in *route_distance_vect*, if NumPy is available)
+- *point_in_area*, *box_in_area*: functions to test if points
+  or boxes are inside a bounding box or a polygon, used for
+  area queries on the spatial indexes
+
 Simple examples::
 
     >>> haversine((48.84, 2.367), (43.70, 7.26)) # Paris -> Nice
@@ -28,7 +42,15 @@ Simple examples::
 
 """
 
-from math import pi, cos, sin, acos, asin, tan, atan2, log, sqrt
+from math import pi, cos, sin, acos, asin, tan, atan2, log, sqrt, ceil
+
+try:
+    import numpy as np
+except ImportError:
+    # Vectorized functions will not be available
+    HAS_NUMPY_SUPPORT = False
+else:
+    HAS_NUMPY_SUPPORT = True
 
 # kms, mean radius
 EARTH_RADIUS = 6371.0
@@ -120,6 +142,117 @@ def haversine_precise(lat0, lng0, lat1, lng1):
 
 
 
+def haversine_vect(lat_lng, lats, lngs):
+    """
+    Vectorized version of haversine, computing the distances
+    between one point and arrays of latitudes and longitudes.
+    This requires NumPy.
+
+    :param lat_lng: the LatLng tuple of the reference point
+    :param lats:    the array of latitudes
+    :param lngs:    the array of longitudes
+    :returns:       the array of distances in kilometers
+
+    >>> haversine_vect((48.84, 2.367), [43.70, 35.5522], [7.26, 139.7796]).tolist()
+    [683.85..., 9730.22...]
+    """
+    return haversine_precise_vect(lat_lng[0], lat_lng[1], lats, lngs)
+
+
+
+def haversine_matrix(lats0, lngs0, lats1, lngs1):
+    """
+    Vectorized version of haversine, computing the distances
+    between all pairs of points from two sets, with broadcasting.
+    This requires NumPy.
+
+    :param lats0: the array of latitudes of the first points
+    :param lngs0: the array of longitudes of the first points
+    :param lats1: the array of latitudes of the second points
+    :param lngs1: the array of longitudes of the second points
+    :returns:     the matrix of distances in kilometers, with a row \
+        for each of the first points
+
+    >>> haversine_matrix([48.84, 43.70], [2.367, 7.26], [43.70], [7.26]).tolist()
+    [[683.85...], [0.0]]
+    """
+    return haversine_precise_vect(np.asarray(lats0)[:, np.newaxis],
+                                  np.asarray(lngs0)[:, np.newaxis],
+                                  np.asarray(lats1)[np.newaxis, :],
+                                  np.asarray(lngs1)[np.newaxis, :])
+
+
+
+def radians_cos(lat_lng):
+    """
+    Precompute the latitude and longitude in radians of a point,
+    and the cosine of its latitude, for *haversine_within*.
+
+    :param lat_lng: the LatLng tuple of the point
+    :returns:       the tuple (lat, lng, cos(lat)), in radians
+
+    >>> radians_cos((60, 0))
+    (1.04..., 0.0, 0.50...)
+    """
+    lat = radian(lat_lng[0])
+
+    return lat, radian(lat_lng[1]), cos(lat)
+
+
+
+def haversine_within(lat_lng, points, radius):
+    """
+    Filter points within a radius from a point, with cheap rejections
+    before the haversine formula. Points out of the latitude band are
+    rejected without trigonometry, then the haversine term is compared
+    before asin and sqrt, so only points within the radius pay for them.
+    Distances are exactly the ones of haversine.
+
+    :param lat_lng: the LatLng tuple of the reference point
+    :param points:  an iterable of (key, lat_lng, rad), where rad is the \
+        result of radians_cos, or None to compute it when needed
+    :param radius:  the radius, in kilometers
+    :returns:       an iterable of (distance, key)
+
+    >>> points = [('NCE', (43.70, 7.26), None), ('ORY', (48.72, 2.359), None)]
+    >>> list(haversine_within((48.84, 2.367), points, 50))
+    [(13.3..., 'ORY')]
+    """
+    lat0, lng0 = lat_lng
+
+    rad_lat0 = radian(lat0)
+    rad_lng0 = radian(lng0)
+    cos_lat0 = cos(rad_lat0)
+
+    # Some margin for rounding, exact distances are checked after
+    band  = unradian(float(radius) / EARTH_RADIUS) * (1 + 1e-9)
+    a_max = sin(0.5 * min(float(radius) / EARTH_RADIUS, pi)) ** 2 * (1 + 1e-9)
+
+    for key, (lat, lng), rad in points:
+
+        if abs(lat - lat0) > band:
+            continue
+
+        if rad is None:
+            rad = radians_cos((lat, lng))
+
+        rad_lat, rad_lng, cos_lat = rad
+
+        # Same operations as haversine
+        a = (sin(0.5 * (rad_lat0 - rad_lat)) ** 2 +
+             sin(0.5 * (rad_lng0 - rad_lng)) ** 2 *
+             cos_lat0 * cos_lat)
+
+        if a > a_max:
+            continue
+
+        dist = 2 * EARTH_RADIUS * asin(sqrt(a))
+
+        if dist <= radius:
+            yield dist, key
+
+
+
 def haversine_simple(lat0, lng0, lat1, lng1):
     """
     Another implementation of Haversine formula,
@@ -220,6 +353,8 @@ def prog_point(lat0, lng0,
     (67.461..., 86.233...)
     >>> prog_point(48.84, 2.367, 35.5522, 139.7796, 1.0)
     (35.552..., 139.779...)
+
+    See prog_points_vect for an exact formula, without dichotomy.
     """
     # We treat some obvious/moronic user input
     if progression > 1 or progression < 0:
@@ -282,6 +417,675 @@ def mercator(lat, lng):
 
 
 
+def haversine_precise_vect(lat0, lng0, lat1, lng1):
+    """
+    Vectorized version of haversine_precise, computing the distances
+    between points of arrays, with broadcasting. This requires NumPy.
+    This is used by haversine_vect and haversine_matrix.
+
+    :param lat0: the latitudes of the first points
+    :param lng0: the longitudes of the first points
+    :param lat1: the latitudes of the second points
+    :param lng1: the longitudes of the second points
+    :returns:    the array of distances in kilometers
+
+    >>> haversine_precise_vect([48.84, 48.84], [2.367, 2.367], [43.70, 35.5522], [7.26, 139.7796]).tolist()
+    [683.85..., 9730.22...]
+    """
+    lat0 = np.radians(lat0)
+    lat1 = np.radians(lat1)
+    lng0 = np.radians(lng0)
+    lng1 = np.radians(lng1)
+
+    # Haversine
+    return 2 * EARTH_RADIUS * np.arcsin(np.sqrt(
+        np.sin(0.5 * (lat0 - lat1)) ** 2 +
+        np.sin(0.5 * (lng0 - lng1)) ** 2 *
+        np.cos(lat0) * np.cos(lat1)
+    ))
+
+
+
+def mid_point_vect(lat0, lng0, lat1, lng1):
+    """
+    Vectorized version of mid_point, with broadcasting.
+    This requires NumPy.
+
+    :param lat0: the latitudes of the first points
+    :param lng0: the longitudes of the first points
+    :param lat1: the latitudes of the second points
+    :param lng1: the longitudes of the second points
+    :returns:    the arrays of latitudes and longitudes of the points in the middle
+
+    >>> lats, lngs = mid_point_vect(48.84, 2.367, [35.5522, 43.70], [139.7796, 7.26])
+    >>> lats.tolist(), lngs.tolist()
+    ([67.461..., 46.296...], [86.233..., 4.928...])
+    """
+    lat0 = np.radians(lat0)
+    lat1 = np.radians(lat1)
+    lng0 = np.radians(lng0)
+    lng1 = np.radians(lng1)
+
+    Bx = np.cos(lat1) * np.cos(lng1 - lng0)
+    By = np.cos(lat1) * np.sin(lng1 - lng0)
+
+    latm = np.arctan2(
+        np.sin(lat0) + np.sin(lat1),
+        np.sqrt((np.cos(lat0) + Bx) ** 2 + By ** 2)
+    )
+
+    lngm = lng0 + np.arctan2(By, np.cos(lat0) + Bx)
+
+    return np.degrees(latm), np.degrees(lngm)
+
+
+
+def mercator_vect(lat, lng):
+    """
+    Vectorized version of mercator. This requires NumPy.
+
+    :param lat: the latitudes of the points
+    :param lng: the longitudes of the points
+    :returns:   the arrays of the projections
+
+    >>> x, y = mercator_vect([48.84, 43.70], [2.367, 7.26])
+    >>> x.tolist(), y.tolist()
+    ([0.85..., 0.76...], [0.04..., 0.12...])
+    """
+    lat = np.radians(lat)
+    lng = np.radians(lng)
+
+    y = np.log(np.tan(0.25 * pi + 0.5 * lng))
+
+    return lat, y
+
+
+
+def prog_points_vect(lat0, lng0, lat1, lng1, progressions):
+    """
+    Compute the localization of points traveling on the shortest
+    paths between points on a sphere, given progression ratios.
+    This uses the spherical linear interpolation, so results are
+    exact, and many points are computed at once, with broadcasting:
+    paths given as arrays of shape (m, 1), and progressions of shape
+    (n,), give points of shape (m, n). This requires NumPy.
+
+    The path between antipodal points is not defined.
+
+    :param lat0:         the latitudes of the first points
+    :param lng0:         the longitudes of the first points
+    :param lat1:         the latitudes of the second points
+    :param lng1:         the longitudes of the second points
+    :param progressions: the progressions of the travelers, in [0, 1]
+    :raises:             ValueError, if progressions not in [0, 1]
+    :returns:            the arrays of latitudes and longitudes of the points
+
+    >>> lats, lngs = prog_points_vect(48.84, 2.367, 35.5522, 139.7796, [0, 0.001, 0.5, 1])
+    >>> lats.tolist()
+    [48.84..., 48.91..., 67.461..., 35.552...]
+    >>> lngs.tolist()
+    [2.367..., 2.440..., 86.233..., 139.779...]
+
+    Several paths at once.
+
+    >>> lats, lngs = prog_points_vect([[48.84], [48.84]], [[2.367], [2.367]],
+    ...                               [[35.5522], [43.70]], [[139.7796], [7.26]],
+    ...                               [0.5, 1])
+    >>> lats.shape, lats.round(2).tolist()
+    ((2, 2), [[67.46, 35.55], [46.3, 43.7]])
+    """
+    progressions = np.asarray(progressions, dtype=np.float64)
+
+    if np.any((progressions < 0) | (progressions > 1)):
+        raise ValueError("Progression not in [0, 1]")
+
+    lat0 = np.radians(lat0)
+    lat1 = np.radians(lat1)
+    lng0 = np.radians(lng0)
+    lng1 = np.radians(lng1)
+
+    # Unit vectors of the ends
+    x0, y0, z0 = np.cos(lat0) * np.cos(lng0), np.cos(lat0) * np.sin(lng0), np.sin(lat0)
+    x1, y1, z1 = np.cos(lat1) * np.cos(lng1), np.cos(lat1) * np.sin(lng1), np.sin(lat1)
+
+    # Angle between the ends, accurate for small and large angles
+    cross  = np.sqrt((y0 * z1 - z0 * y1) ** 2 +
+                     (z0 * x1 - x0 * z1) ** 2 +
+                     (x0 * y1 - y0 * x1) ** 2)
+    length = np.arctan2(cross, x0 * x1 + y0 * y1 + z0 * z1)
+
+    # Spherical linear interpolation, or linear when ends are the same
+    sin_length = np.sin(length)
+    same = sin_length < 1e-12
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        w0 = np.where(same, 1 - progressions, np.sin((1 - progressions) * length) / sin_length)
+        w1 = np.where(same, progressions, np.sin(progressions * length) / sin_length)
+
+    x = w0 * x0 + w1 * x1
+    y = w0 * y0 + w1 * y1
+    z = w0 * z0 + w1 * z1
+
+    return np.degrees(np.arctan2(z, np.hypot(x, y))), np.degrees(np.arctan2(y, x))
+
+
+
+def _unit(lat_lng):
+    """
+    Unit vector of a point on the sphere.
+    """
+    lat = radian(lat_lng[0])
+    lng = radian(lat_lng[1])
+
+    return (cos(lat) * cos(lng), cos(lat) * sin(lng), sin(lat))
+
+
+def _dot(a, b):
+    """
+    Dot product of two vectors.
+    """
+    return a[0] * b[0] + a[1] * b[1] + a[2] * b[2]
+
+
+def _cross(a, b):
+    """
+    Cross product of two vectors.
+    """
+    return (a[1] * b[2] - a[2] * b[1],
+            a[2] * b[0] - a[0] * b[2],
+            a[0] * b[1] - a[1] * b[0])
+
+
+
+def great_circle_points(lat_lng0, lat_lng1, step):
+    """
+    Points on the shortest path between two points on a sphere,
+    spaced by at most *step* kilometers, including both ends.
+
+    :param lat_lng0: the LatLng tuple of the first point
+    :param lat_lng1: the LatLng tuple of the second point
+    :param step:     the maximum spacing, in kilometers
+    :returns:        the list of LatLng tuples
+
+    >>> great_circle_points((48.84, 2.367), (43.70, 7.26), 300) # Paris -> Nice
+    [(48.84, 2.367), (47.15..., 4.10...), (45.43..., 5.72...), (43.7, 7.26)]
+    """
+    a = _unit(lat_lng0)
+    b = _unit(lat_lng1)
+
+    length = atan2(sqrt(_dot(*[_cross(a, b)] * 2)), _dot(a, b))
+    steps  = max(1, int(ceil(length * EARTH_RADIUS / step)))
+
+    if sin(length) < 1e-12:
+        return [lat_lng0, lat_lng1]
+
+    points = [lat_lng0]
+
+    for i in xrange(1, steps):
+        # Spherical linear interpolation
+        w0 = sin((1 - float(i) / steps) * length) / sin(length)
+        w1 = sin(float(i) / steps * length) / sin(length)
+
+        x, y, z = [w0 * u + w1 * v for u, v in zip(a, b)]
+
+        points.append((unradian(atan2(z, sqrt(x * x + y * y))), unradian(atan2(y, x))))
+
+    points.append(lat_lng1)
+
+    return points
+
+
+
+def _legs(route):
+    """
+    Pre-compute the legs of a route, as tuples of (start, end,
+    unit start, normal, tangent, length in kilometers, offset
+    in kilometers). Normal and tangent are None for null legs.
+    """
+    if len(route) == 1:
+        route = [route[0], route[0]]
+
+    legs   = []
+    offset = 0.0
+
+    for lat_lng0, lat_lng1 in zip(route, route[1:]):
+        a = _unit(lat_lng0)
+        n = _cross(a, _unit(lat_lng1))
+
+        sin_length = sqrt(_dot(n, n))
+        length = atan2(sin_length, _dot(a, _unit(lat_lng1))) * EARTH_RADIUS
+
+        if sin_length < 1e-12:
+            n, t = None, None
+        else:
+            n = tuple(c / sin_length for c in n)
+            t = _cross(n, a)
+
+        legs.append((lat_lng0, lat_lng1, a, n, t, length, offset))
+        offset += length
+
+    return legs
+
+
+
+def route_distance(lat_lng, route):
+    """
+    Compute the distance from a point to a route, made of the
+    shortest paths between successive points, and the along-track
+    position of the closest point of the route.
+
+    :param lat_lng: the LatLng tuple of the point
+    :param route:   the list of LatLng tuples of the route
+    :returns:       a tuple (distance, along-track position), in kilometers
+
+    >>> route_distance((46.0, 4.0), [(48.84, 2.367), (43.70, 7.26)]) # Paris -> Nice
+    (77.78..., 329.78...)
+    >>> route_distance((50.0, 0.0), [(48.84, 2.367), (43.70, 7.26)])
+    (214.34..., 0.0)
+    """
+    best = None
+
+    for lat_lng0, lat_lng1, a, n, t, length, offset in _legs(route):
+
+        p = _unit(lat_lng)
+
+        if n is not None:
+            theta = atan2(_dot(p, t), _dot(p, a)) * EARTH_RADIUS
+
+            if 0 <= theta <= length:
+                dist = abs(asin(max(-1.0, min(1.0, _dot(p, n))))) * EARTH_RADIUS
+
+                if best is None or dist < best[0]:
+                    best = (dist, offset + theta)
+                continue
+
+        # Projection outside the leg, the closest point is an end
+        for dist, along in ((haversine(lat_lng, lat_lng0), 0),
+                            (haversine(lat_lng, lat_lng1), length)):
+
+            if best is None or dist < best[0]:
+                best = (dist, offset + along)
+
+    return best
+
+
+
+def route_distance_vect(route, lats, lngs):
+    """
+    Vectorized version of route_distance, computing the distances
+    between a route and arrays of latitudes and longitudes.
+    This requires NumPy.
+
+    :param route: the list of LatLng tuples of the route
+    :param lats:  the array of latitudes
+    :param lngs:  the array of longitudes
+    :returns:     a tuple of arrays (distances, along-track positions)
+
+    >>> dists, alongs = route_distance_vect([(48.84, 2.367), (43.70, 7.26)], [46.0, 50.0], [4.0, 0.0])
+    >>> dists.tolist(), alongs.tolist()
+    ([77.78..., 214.34...], [329.78..., 0.0])
+    """
+    lats = np.radians(np.asarray(lats, dtype=np.float64))
+    lngs = np.radians(np.asarray(lngs, dtype=np.float64))
+
+    p = (np.cos(lats) * np.cos(lngs), np.cos(lats) * np.sin(lngs), np.sin(lats))
+
+    best_dists  = np.empty(len(lats))
+    best_alongs = np.zeros(len(lats))
+    best_dists.fill(np.inf)
+
+    for lat_lng0, lat_lng1, a, n, t, length, offset in _legs(route):
+
+        dists_0 = haversine_vect(lat_lng0, np.degrees(lats), np.degrees(lngs))
+        dists_1 = haversine_vect(lat_lng1, np.degrees(lats), np.degrees(lngs))
+
+        # Projection outside the leg, the closest point is an end
+        dists  = np.minimum(dists_0, dists_1)
+        alongs = np.where(dists_1 < dists_0, length, 0.0)
+
+        if n is not None:
+            theta  = np.arctan2(_dot(p, t), _dot(p, a)) * EARTH_RADIUS
+            inside = (theta >= 0) & (theta <= length)
+            cross  = np.abs(np.arcsin(np.clip(_dot(p, n), -1.0, 1.0))) * EARTH_RADIUS
+
+            dists  = np.where(inside, cross, dists)
+            alongs = np.where(inside, theta, alongs)
+
+        better = dists < best_dists
+        best_dists[better]  = dists[better]
+        best_alongs[better] = offset + alongs[better]
+
+    return best_dists, best_alongs
+
+
+
+def route_points(route, step):
+    """
+    Points along a route, spaced by at most *step* kilometers.
+
+    :param route: the list of LatLng tuples of the route
+    :param step:  the maximum spacing, in kilometers
+    :returns:     the list of LatLng tuples
+
+    >>> len(route_points([(48.84, 2.367), (43.70, 7.26), (43.70, 7.26)], 300))
+    5
+    """
+    if len(route) == 1:
+        return list(route)
+
+    points = [route[0]]
+
+    for lat_lng0, lat_lng1 in zip(route, route[1:]):
+        # The start of a leg is the end of the previous one
+        points.extend(great_circle_points(lat_lng0, lat_lng1, step)[1:])
+
+    return points
+
+
+
+def corridor_points(route, radius):
+    """
+    Points along a route, and a search radius around them, such
+    that the disks around those points cover the corridor of
+    *radius* kilometers around the route.
+
+    :param route:  the list of LatLng tuples of the route
+    :param radius: the half width of the corridor, in kilometers
+    :returns:      a tuple (list of LatLng tuples, search radius)
+
+    >>> points, search = corridor_points([(48.84, 2.367), (43.70, 7.26)], 100)
+    >>> len(points), search
+    (5, 141.42...)
+    """
+    # Points are two radius apart, so disks overlap on the route sides
+    step = max(2.0 * radius, 1.0)
+
+    return route_points(route, step), sqrt(radius ** 2 + (0.5 * step) ** 2)
+
+
+
+def route_distances(route, lat_lngs):
+    """
+    Compute route_distance for a list of points, with
+    route_distance_vect if NumPy is available.
+
+    :param route:    the list of LatLng tuples of the route
+    :param lat_lngs: the list of LatLng tuples of the points
+    :returns:        the list of (distance, along-track position)
+
+    >>> route_distances([(48.84, 2.367), (43.70, 7.26)], [(46.0, 4.0), (50.0, 0.0)])
+    [(77.78..., 329.78...), (214.34..., 0.0)]
+    """
+    if not HAS_NUMPY_SUPPORT or not lat_lngs:
+        return [route_distance(lat_lng, route) for lat_lng in lat_lngs]
+
+    lat_lngs = np.array(lat_lngs, dtype=np.float64)
+    dists, alongs = route_distance_vect(route, lat_lngs[:, 0], lat_lngs[:, 1])
+
+    return zip(dists.tolist(), alongs.tolist())
+
+
+
+def bbox_area(south, west, north, east):
+    """
+    Build the area of a bounding box. If *west* is greater than
+    *east*, the box crosses the antimeridian, and its eastern
+    longitude is shifted beyond 180.
+
+    :param south: the southern latitude
+    :param west:  the western longitude
+    :param north: the northern latitude
+    :param east:  the eastern longitude
+    :returns:     the area, as a dictionary of bounds
+
+    >>> sorted(bbox_area(40, 170, 50, -170).items())
+    [('e', 190.0), ('n', 50.0), ('s', 40.0), ('w', 170.0)]
+    """
+    south, west, north, east = [float(v) for v in (south, west, north, east)]
+
+    if west > east:
+        east += 360
+
+    return { 's' : south, 'w' : west, 'n' : north, 'e' : east }
+
+
+
+def circle_area(lat_lng, radius):
+    """
+    Build the bounding box area of the points within a radius
+    from a point. Longitudes may go beyond -180 or 180 when the
+    circle crosses the antimeridian, and cover every longitude
+    when the circle contains a pole.
+
+    :param lat_lng: the LatLng tuple of the center
+    :param radius:  the radius, in kilometers
+    :returns:       the area, as a dictionary of bounds
+
+    >>> sorted(circle_area((48.84, 2.367), 50).items())
+    [('e', 3.05...), ('n', 49.28...), ('s', 48.39...), ('w', 1.68...)]
+    >>> sorted(circle_area((89.9, 0), 50).items())
+    [('e', 180.0), ('n', 90.0), ('s', 89.45...), ('w', -180.0)]
+    """
+    lat, lng = lat_lng
+
+    angle = float(radius) / EARTH_RADIUS
+    d_lat = unradian(angle)
+
+    south = max(lat - d_lat, -90.0)
+    north = min(lat + d_lat, 90.0)
+
+    if north == 90 or south == -90 or sin(angle) >= cos(radian(lat)):
+        return { 's' : south, 'w' : -180.0, 'n' : north, 'e' : 180.0 }
+
+    # Largest longitude difference on the circle
+    d_lng = unradian(asin(sin(angle) / cos(radian(lat))))
+
+    return { 's' : south, 'w' : lng - d_lng, 'n' : north, 'e' : lng + d_lng }
+
+
+
+def unwrap_polygon(polygon):
+    """
+    Make the longitudes of a polygon continuous, so that polygons
+    crossing the antimeridian have longitudes beyond 180 instead
+    of jumping from 180 to -180. Polygons enclosing a pole are
+    not supported.
+
+    :param polygon: an iterable of LatLng vertices
+    :returns:       the list of unwrapped vertices
+
+    >>> unwrap_polygon([(0, 170), (0, -170), (10, -170), (10, 170)])
+    [(0.0, 170.0), (0.0, 190.0), (10.0, 190.0), (10.0, 170.0)]
+    """
+    unwrapped = []
+    prev = None
+
+    for lat, lng in polygon:
+        lat, lng = float(lat), float(lng)
+
+        if prev is not None:
+            while lng - prev > 180:
+                lng -= 360
+            while prev - lng > 180:
+                lng += 360
+
+        unwrapped.append((lat, lng))
+        prev = lng
+
+    if unwrapped and min(lng for _, lng in unwrapped) < -180:
+        unwrapped = [(lat, lng + 360) for lat, lng in unwrapped]
+
+    return unwrapped
+
+
+
+def polygon_area(polygon):
+    """
+    Build the area of the bounding box of an unwrapped polygon.
+
+    :param polygon: the list of unwrapped vertices
+    :returns:       the area, as a dictionary of bounds
+
+    >>> sorted(polygon_area([(0.0, 170.0), (0.0, 190.0), (10.0, 180.0)]).items())
+    [('e', 190.0), ('n', 10.0), ('s', 0.0), ('w', 170.0)]
+    """
+    lats = [lat for lat, _ in polygon]
+    lngs = [lng for _, lng in polygon]
+
+    return { 's' : min(lats), 'w' : min(lngs), 'n' : max(lats), 'e' : max(lngs) }
+
+
+
+def point_in_polygon(lat_lng, polygon):
+    """
+    Test if a point is inside a polygon, using ray casting
+    on latitudes and longitudes, as on a map.
+
+    :param lat_lng: the LatLng tuple of the point
+    :param polygon: the list of unwrapped vertices
+    :returns:       a boolean
+
+    >>> square = [(0, 0), (0, 10), (10, 10), (10, 0)]
+    >>> point_in_polygon((5, 5), square), point_in_polygon((5, 15), square)
+    (True, False)
+    """
+    lat, lng = lat_lng
+    inside = False
+
+    lat_j, lng_j = polygon[-1]
+
+    for lat_i, lng_i in polygon:
+        if (lat_i > lat) != (lat_j > lat):
+            if lng < lng_i + (lat - lat_i) * (lng_j - lng_i) / (lat_j - lat_i):
+                inside = not inside
+
+        lat_j, lng_j = lat_i, lng_i
+
+    return inside
+
+
+
+def point_in_area(lat_lng, area, polygon=None):
+    """
+    Test if a point is inside an area, and inside the polygon if given.
+    Longitudes are tested both as is and shifted by 360, to handle
+    areas crossing the antimeridian.
+
+    :param lat_lng: the LatLng tuple of the point
+    :param area:    the area, built by *bbox_area* or *polygon_area*
+    :param polygon: the list of unwrapped vertices, if any
+    :returns:       a boolean
+
+    >>> point_in_area((45, -175), bbox_area(40, 170, 50, -170))
+    True
+    >>> point_in_area((45, 0), bbox_area(40, 170, 50, -170))
+    False
+    """
+    lat, lng = lat_lng
+
+    if not area['s'] <= lat <= area['n']:
+        return False
+
+    for lng in (lng, lng + 360):
+        if area['w'] <= lng <= area['e']:
+            if polygon is None or point_in_polygon((lat, lng), polygon):
+                return True
+
+    return False
+
+
+
+def _segment_in_box(p0, p1, box):
+    """
+    Test if a segment intersects a box, with Liang-Barsky clipping.
+    """
+    (lat0, lng0), (lat1, lng1) = p0, p1
+
+    d_lat, d_lng = lat1 - lat0, lng1 - lng0
+    t0, t1 = 0.0, 1.0
+
+    for p, q in ((-d_lng, lng0 - box['w']), (d_lng, box['e'] - lng0),
+                 (-d_lat, lat0 - box['s']), (d_lat, box['n'] - lat0)):
+        if p == 0:
+            if q < 0:
+                return False
+            continue
+
+        t = float(q) / p
+
+        if p < 0:
+            if t > t1:
+                return False
+            t0 = max(t0, t)
+        else:
+            if t < t0:
+                return False
+            t1 = min(t1, t)
+
+    return True
+
+
+
+def _box_in_area(box, area, polygon):
+    """
+    Classify a box in the same longitude frame as the area.
+    """
+    if (box['w'] > area['e'] or box['e'] < area['w'] or
+        box['s'] > area['n'] or box['n'] < area['s']):
+        return 'out'
+
+    if polygon is None:
+        if (area['w'] <= box['w'] and box['e'] <= area['e'] and
+            area['s'] <= box['s'] and box['n'] <= area['n']):
+            return 'in'
+        return 'cross'
+
+    # If no edge crosses the box, it is either fully inside or fully outside
+    prev = polygon[-1]
+
+    for vertex in polygon:
+        if _segment_in_box(prev, vertex, box):
+            return 'cross'
+        prev = vertex
+
+    center = (0.5 * (box['s'] + box['n']), 0.5 * (box['w'] + box['e']))
+
+    return 'in' if point_in_polygon(center, polygon) else 'out'
+
+
+
+def box_in_area(box, area, polygon=None):
+    """
+    Classify a box, like a geohash cell, relatively to an area,
+    and to the polygon if given. The box is *in* if all its points
+    are in the area, *out* if none of them is, or *cross* otherwise.
+
+    :param box:     the box, as a dictionary of bounds between -180 and 180
+    :param area:    the area, built by *bbox_area* or *polygon_area*
+    :param polygon: the list of unwrapped vertices, if any
+    :returns:       'in', 'out' or 'cross'
+
+    >>> area = bbox_area(40, 170, 50, -170)
+    >>> box_in_area({'s': 42, 'w': -179, 'n': 44, 'e': -178}, area)
+    'in'
+    >>> box_in_area({'s': 42, 'w': -171, 'n': 44, 'e': -169}, area)
+    'cross'
+    >>> box_in_area({'s': 42, 'w': 0, 'n': 44, 'e': 1}, area)
+    'out'
+    """
+    kinds = [_box_in_area(dict(box, w=box['w'] + shift, e=box['e'] + shift), area, polygon)
+             for shift in (0, 360)]
+
+    if 'cross' in kinds:
+        return 'cross'
+
+    if 'in' in kinds:
+        return 'in'
+
+    return 'out'
+
+
+
 def _test():
     """
     When called directly, launching doctests.
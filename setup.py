@@ -25,7 +25,9 @@ INSTALL_REQUIRES = [
 
 EXTRAS_REQUIRE = {
     # Private
-    'OpenTrep': ['OpenTrepWrapper>=0.6']
+    'OpenTrep': ['OpenTrepWrapper>=0.6'],
+    # Public - arrays
+    'NumPy': ['numpy']
 }
 
 DEPENDENCY_LINKS        = []
@@ -25,6 +25,8 @@ if UPDIR not in sys.path:
 
 import GeoBases.GeoBaseModule    as GeoM
 import GeoBases.GeoGridModule    as GeoG
+import GeoBases.GeoTreeModule    as GeoR
+import GeoBases.GeoAdaptiveGridModule as GeoAG
 import GeoBases.GeoUtils         as GeoU
 import GeoBases.LevenshteinUtils as GeoL
 
@@ -36,7 +38,7 @@ class GeoBaseTest(unittest.TestCase):
     '''
     def setUp(self):
 
-        self.g = GeoM.GeoBase(data='ori_por', verbose=False)
+        self.g = GeoM.GeoBase.shared('ori_por', verbose=False)
 
 
     def tearDown(self):
@@ -51,6 +53,23 @@ class GeoBaseTest(unittest.TestCase):
                          (('', 'Brive-Souillac', ''),))
 
 
+    def test_get_by(self):
+        '''Testing get method on alternate keys.
+        '''
+        self.assertEqual(self.g.get('LFPG', 'iata_code', by='icao_code'), 'CDG')
+        self.assertEqual(self.g.get('NOT_A_KEY', by='icao_code', default=None), None)
+
+
+    def test_getMany(self):
+        '''Testing getMany method.
+        '''
+        self.assertEqual(self.g.getMany(['CDG', 'ORY'], 'city_code'),
+                         [self.g.get('CDG', 'city_code'), self.g.get('ORY', 'city_code')])
+        self.assertEqual(self.g.getMany(['CDG', 'NOT_A_KEY'], ['city_code'], default=None),
+                         [['PAR', None]])
+        self.assertRaises(KeyError, self.g.getMany, ['CDG', 'NOT_A_KEY'], 'city_code')
+
+
     def test_distance(self):
         '''Test distance method.
         '''
@@ -83,6 +102,8 @@ def test_suite():
     # Adding doctests
     tests.addTests(doctest.DocTestSuite(GeoM, optionflags=opt, extraglobs=globsGeo))
     tests.addTests(doctest.DocTestSuite(GeoG, optionflags=opt, extraglobs=globsGeo))
+    tests.addTests(doctest.DocTestSuite(GeoR, optionflags=opt))
+    tests.addTests(doctest.DocTestSuite(GeoAG, optionflags=opt))
     tests.addTests(doctest.DocTestSuite(GeoU, optionflags=opt))
     tests.addTests(doctest.DocTestSuite(GeoL, optionflags=opt))
 